@@ -0,0 +1,111 @@
+"""
+Import-time benchmark for the entry points batch workers and scripts use.
+
+Each target is started in a fresh interpreter several times; the report gives
+p50/max wall time, peak RSS and which heavy dependencies got loaded. Targets
+that must stay light fail the run when they exceed --max-seconds or load
+Gradio/the OpenAI SDK, so the check can guard against regressions:
+
+    python benchmarks/benchmark_import.py --runs 5 --max-seconds 1.0
+    python benchmarks/benchmark_import.py --importtime usmlegpt   # slowest modules of one target
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ["gradio", "openai", "httpx", "pandas", "numpy"]
+FORBIDDEN_IN_LIGHT = ["gradio", "openai", "httpx", "pandas", "numpy"]
+
+# name -> (python code run after the clock starts, must stay light)
+TARGETS = {
+    "usmlegpt": ("import usmlegpt", True),
+    "usmlegpt.cli": ("import usmlegpt.cli", True),
+    "python -m usmlegpt --help": ("import runpy; sys.argv = ['usmlegpt', '--help']; runpy.run_module('usmlegpt', run_name='__main__')", True),
+    "usmlegpt.ui": ("import usmlegpt.ui", False),
+    "UsmleGPT": ("import UsmleGPT", False)
+}
+
+PROBE = """
+import contextlib, io, json, resource, sys, time
+started = time.perf_counter()
+with contextlib.redirect_stdout(io.StringIO()):
+    try:
+        {code}
+    except SystemExit:
+        pass
+elapsed = time.perf_counter() - started
+print(json.dumps({{
+    "seconds": elapsed,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "loaded": [name for name in {heavy!r} if name in sys.modules]
+}}))
+"""
+
+def measure(code, runs):
+    samples = []
+    for _ in range(runs):
+        probe = PROBE.format(code=code, heavy=HEAVY_MODULES)
+        completed = subprocess.run([sys.executable, "-c", probe], cwd=ROOT, capture_output=True, text=True, check=True)
+        samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    seconds = [sample["seconds"] for sample in samples]
+    return {
+        "p50": round(statistics.median(seconds), 3),
+        "max": round(max(seconds), 3),
+        "max_rss_mb": round(max(sample["max_rss_mb"] for sample in samples), 1),
+        "loaded": samples[-1]["loaded"]
+    }
+
+def slowest_imports(module, top):
+    """ Cumulative import times from python -X importtime, slowest first """
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                               cwd=ROOT, capture_output=True, text=True, check=True)
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len("import time:"):].split("|")]
+        rows.append((int(cumulative), name))
+    return sorted(rows, reverse=True)[:top]
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import time of the usmlegpt entry points")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per target")
+    parser.add_argument("--max-seconds", type=float, default=1.0, help="Budget for the light targets (p50)")
+    parser.add_argument("--importtime", metavar="MODULE", help="Only list the slowest imports of MODULE")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    if args.importtime:
+        for cumulative, name in slowest_imports(args.importtime, args.top):
+            print(f"{cumulative / 1e6:>9.3f}s  {name}")
+        return 0
+
+    report, failures = {}, []
+    print(f"{'target':<28}{'p50':>8}{'max':>8}{'rss MB':>9}  loaded")
+    for name, (code, light) in TARGETS.items():
+        result = measure(code, args.runs)
+        report[name] = dict(result, light=light)
+        print(f"{name:<28}{result['p50']:>8}{result['max']:>8}{result['max_rss_mb']:>9}  {', '.join(result['loaded']) or '-'}")
+        if not light:
+            continue
+        if result["p50"] > args.max_seconds:
+            failures.append(f"{name} took {result['p50']}s (budget {args.max_seconds}s)")
+        forbidden = [module for module in result["loaded"] if module in FORBIDDEN_IN_LIGHT]
+        if forbidden:
+            failures.append(f"{name} imported {', '.join(forbidden)}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
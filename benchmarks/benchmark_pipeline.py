@@ -0,0 +1,202 @@
+"""
+End-to-end benchmark of the MCQ pipeline against the local fake OpenAI server.
+
+Reports per-stage and whole-pipeline p50/p95/p99 latency for stream_mcq
+(the streaming pipeline behind process_mcq),
+items per minute for run_batch as concurrency increases, the retry
+overhead caused by injected errors and 429 responses, and the share of prompt
+tokens served from the (simulated, with --prefix-cache) provider prefix cache:
+
+    python benchmarks/benchmark_pipeline.py --runs 5 --items 16 --concurrency 1 2 4 8 --latency lognormal:0.3:0.5 --rate-limit-rate 0.05 --prefix-cache
+"""
+import argparse
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import usmlegpt
+from fake_openai_server import start_fake_server
+
+STAGES = ["Item Writer", "Reviewer 1", "Reviewer 2", "Reviewer 3", "Editorial Staff", "Author Revision", "Final Editorial Decision"]
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def pick(q):
+        return round(ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))], 3)
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+def stage_durations(history, started_at):
+    """
+    Seconds spent per stage. Uses the per-call metrics when the entry has them,
+    otherwise the history timestamps (the concurrent reviewers then show up as
+    one "Reviewers" phase).
+    """
+    durations = {}
+    previous = started_at
+    for entry in history:
+        if "timestamp" not in entry or not isinstance(entry.get("version"), int):
+            continue
+        finished = datetime.datetime.fromisoformat(entry["timestamp"])
+        latency = (entry.get("metrics") or {}).get("latency_s")
+        if latency is not None:
+            durations[entry["role"]] = latency
+        else:
+            stage = "Reviewers" if entry["role"].startswith("Reviewer") else entry["role"]
+            durations.setdefault(stage, (finished - previous).total_seconds())
+        previous = finished
+    return durations
+
+def server_delta(server, before):
+    return {key: server.config.stats[key] - before[key] for key in before}
+
+def prompt_cache_usage(delta):
+    return {
+        "prompt_tokens": delta["prompt_tokens"],
+        "cached_tokens": delta["cached_tokens"],
+        "cached_pct": round(100 * delta["cached_tokens"] / delta["prompt_tokens"], 2) if delta["prompt_tokens"] else None
+    }
+
+def retry_overhead(delta):
+    extra = delta["requests"] - delta["ok"]
+    return {
+        "requests": delta["requests"],
+        "successful": delta["ok"],
+        "retried": extra,
+        "overhead_pct": round(100 * extra / delta["ok"], 2) if delta["ok"] else None
+    }
+
+def benchmark_process_mcq(models_config, runs):
+    stage_samples = {stage: [] for stage in STAGES}
+    totals = []
+    first_output = []
+
+    for _ in range(runs):
+        started_at = datetime.datetime.now()
+        started = time.perf_counter()
+        history = None
+        for history in usmlegpt.stream_mcq(models_config, ["Pathology"], ["Cardiovascular System"],
+                                           ["Patient Care: Diagnosis"], ""):
+            if len(first_output) == len(totals):
+                first_output.append(time.perf_counter() - started)
+        totals.append(time.perf_counter() - started)
+
+        for stage, seconds in stage_durations(history or [], started_at).items():
+            stage_samples.setdefault(stage, []).append(seconds)
+
+    return {
+        "stages": {stage: percentiles(samples) for stage, samples in stage_samples.items()},
+        "pipeline": percentiles(totals),
+        "time_to_first_output": percentiles(first_output)
+    }
+
+def benchmark_batch(models_config, items, concurrency_levels, per_model_concurrency):
+    results = []
+    for concurrency in concurrency_levels:
+        blueprint = [{"disciplines": ["Pathology"], "systems": ["Cardiovascular System"],
+                      "competencies": ["Patient Care: Diagnosis"], "count": items}]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_path = os.path.join(tmp, "batch.jsonl")
+            started = time.perf_counter()
+            counts = usmlegpt.run_batch(models_config, blueprint, output_path,
+                                        max_concurrency=concurrency,
+                                        per_model_concurrency=per_model_concurrency)
+            elapsed = time.perf_counter() - started
+            with open(output_path, encoding="utf-8") as f:
+                latencies = [json.loads(line)["elapsed_seconds"] for line in f]
+
+        results.append({
+            "concurrency": concurrency,
+            "ok": counts["ok"],
+            "failed": counts["error"],
+            "elapsed_seconds": round(elapsed, 3),
+            "items_per_minute": round(60 * counts["ok"] / elapsed, 2) if elapsed else None,
+            "item_latency": percentiles(latencies)
+        })
+    return results
+
+def print_report(report):
+    print("\n== stream_mcq ==")
+    print(f"{'stage':<28}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = list(report["process_mcq"]["stages"].items()) + [
+        ("time to first output", report["process_mcq"]["time_to_first_output"]),
+        ("whole pipeline", report["process_mcq"]["pipeline"])
+    ]
+    for name, p in rows:
+        print(f"{name:<28}{str(p['p50']):>9}{str(p['p95']):>9}{str(p['p99']):>9}")
+
+    print("\n== run_batch ==")
+    print(f"{'concurrency':>11}{'ok':>6}{'failed':>8}{'items/min':>11}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for row in report["batch"]:
+        p = row["item_latency"]
+        print(f"{row['concurrency']:>11}{row['ok']:>6}{row['failed']:>8}{str(row['items_per_minute']):>11}"
+              f"{str(p['p50']):>9}{str(p['p95']):>9}{str(p['p99']):>9}")
+
+    print("\n== retry overhead ==")
+    for phase, overhead in report["retry_overhead"].items():
+        print(f"{phase}: {overhead}")
+
+    print("\n== prompt prefix cache ==")
+    for phase, usage in report["prompt_cache"].items():
+        print(f"{phase}: {usage}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MCQ pipeline against a local fake OpenAI server")
+    parser.add_argument("--runs", type=int, default=5, help="Sequential process_mcq runs")
+    parser.add_argument("--items", type=int, default=16, help="Items per batch run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--per-model-concurrency", type=int, default=8)
+    parser.add_argument("--models", type=int, default=2, help="Number of fake model rows")
+    parser.add_argument("--latency", default="lognormal:0.3:0.5")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--prefix-cache", action="store_true", help="Simulate provider prompt prefix caching")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="Shortest cached prefix (1024 like OpenAI)")
+    parser.add_argument("--cache-block-tokens", type=int, default=128, help="Cached prefix granularity")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    server, base_url = start_fake_server(latency=args.latency, error_rate=args.error_rate,
+                                         rate_limit_rate=args.rate_limit_rate, retry_after=args.retry_after,
+                                         tokens_per_second=args.tokens_per_second, prefix_cache=args.prefix_cache,
+                                         cache_min_tokens=args.cache_min_tokens, cache_block_tokens=args.cache_block_tokens)
+    models_config = [{"api_key": "sk-fake", "base_url": base_url, "model_name": f"fake-model-{i}"}
+                     for i in range(args.models)]
+
+    try:
+        before = dict(server.config.stats)
+        pipeline = benchmark_process_mcq(models_config, args.runs)
+        pipeline_delta = server_delta(server, before)
+
+        before = dict(server.config.stats)
+        batch = benchmark_batch(models_config, args.items, args.concurrency, args.per_model_concurrency)
+        batch_delta = server_delta(server, before)
+    finally:
+        server.shutdown()
+
+    report = {
+        "server": {"latency": args.latency, "error_rate": args.error_rate,
+                   "rate_limit_rate": args.rate_limit_rate, "tokens_per_second": args.tokens_per_second,
+                   "prefix_cache": args.prefix_cache, "cache_min_tokens": args.cache_min_tokens},
+        "process_mcq": pipeline,
+        "batch": batch,
+        "retry_overhead": {"process_mcq": retry_overhead(pipeline_delta), "batch": retry_overhead(batch_delta)},
+        "prompt_cache": {"process_mcq": prompt_cache_usage(pipeline_delta), "batch": prompt_cache_usage(batch_delta)}
+    }
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
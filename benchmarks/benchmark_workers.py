@@ -0,0 +1,75 @@
+"""
+Throughput of job queue workers as the number of worker processes grows,
+against the local fake OpenAI server. Each level gets a fresh queue with the
+same jobs; items per minute should scale close to linearly with processes
+until the (simulated) provider or the per-process concurrency is the limit:
+
+    python benchmarks/benchmark_workers.py --jobs 48 --processes 1 2 4 --concurrency 2 --latency 0.2
+
+The in-process fake server streams from Python threads and saturates first
+with many workers; start fake_openai_server.py separately and pass --base-url
+to measure the workers alone.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from usmlegpt.jobs import JobQueue, run_worker, run_worker_processes
+from fake_openai_server import start_fake_server
+
+def worker_main(queue_path, models_config, concurrency):
+    run_worker(JobQueue(queue_path), models_config, concurrency=concurrency, per_model_concurrency=64,
+               poll_interval=0.05, exit_when_idle=True)
+
+def benchmark_level(models_config, jobs, processes, concurrency):
+    with tempfile.TemporaryDirectory() as tmp:
+        queue_path = os.path.join(tmp, "jobs.sqlite3")
+        job_queue = JobQueue(queue_path)
+        job_queue.enqueue([{"disciplines": ["Pathology"], "systems": ["Cardiovascular System"],
+                            "competencies": ["Patient Care: Diagnosis"], "count": jobs}])
+        started = time.perf_counter()
+        run_worker_processes(processes, worker_main, queue_path, models_config, concurrency)
+        elapsed = time.perf_counter() - started
+        counts = job_queue.counts()
+    done = counts.get("done", 0)
+    return {"processes": processes, "done": done, "failed": jobs - done, "elapsed_seconds": round(elapsed, 3),
+            "items_per_minute": round(60 * done / elapsed, 2) if elapsed else None}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark job queue workers against a local fake OpenAI server")
+    parser.add_argument("--jobs", type=int, default=48)
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--concurrency", type=int, default=2, help="Pipelines per worker process")
+    parser.add_argument("--latency", default="0.2")
+    parser.add_argument("--tokens-per-second", type=float, default=400)
+    parser.add_argument("--base-url", help="Use an already running (fake) server instead of starting one")
+    parser.add_argument("--json", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    server, base_url = None, args.base_url
+    if not base_url:
+        server, base_url = start_fake_server(latency=args.latency, tokens_per_second=args.tokens_per_second)
+    models_config = [{"api_key": "sk-fake", "base_url": base_url, "model_name": "fake-model"}]
+    try:
+        results = [benchmark_level(models_config, args.jobs, processes, args.concurrency) for processes in args.processes]
+    finally:
+        if server:
+            server.shutdown()
+
+    baseline = results[0]["items_per_minute"] / results[0]["processes"] if results[0]["items_per_minute"] else None
+    print(f"{'processes':>9}{'done':>6}{'failed':>8}{'seconds':>9}{'items/min':>11}{'scaling':>9}")
+    for row in results:
+        row["scaling_efficiency"] = round(row["items_per_minute"] / (baseline * row["processes"]), 2) if baseline else None
+        print(f"{row['processes']:>9}{row['done']:>6}{row['failed']:>8}{row['elapsed_seconds']:>9}"
+              f"{str(row['items_per_minute']):>11}{str(row['scaling_efficiency']):>9}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
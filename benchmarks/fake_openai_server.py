@@ -0,0 +1,265 @@
+"""
+Local stand-in for the subset of the OpenAI API that UsmleGPT uses
+(POST /v1/chat/completions, streaming and non-streaming).
+
+Latency, error rates and 429 responses are configurable so the pipeline can be
+benchmarked without spending real API money. With --prefix-cache the server
+also imitates provider prompt caching: prompt prefixes it has seen before are
+reported as usage.prompt_tokens_details.cached_tokens and shorten the latency.
+
+    python benchmarks/fake_openai_server.py --port 8765 --latency lognormal:1.5:0.4 --error-rate 0.02 --rate-limit-rate 0.05
+
+Then point a model row at base_url http://127.0.0.1:8765/v1 with any api_key.
+Replies longer than the request's max_tokens (one word per token) stop with
+finish_reason "length"; a request carrying the reply so far as an assistant
+message gets the rest of it, like a continuation.
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_ITEM = (
+    "A 45-year-old man comes to the emergency department because of crushing substernal chest pain "
+    "for 2 hours. His pulse is 110/min and blood pressure is 150/90 mm Hg. An ECG shows ST-segment "
+    "elevation in leads II, III and aVF. Occlusion of which of the following arteries is the most likely "
+    "cause of these findings? (A) Left anterior descending (B) Left circumflex (C) Left main "
+    "(D) Right coronary (E) Posterior descending Correct Answer: D"
+)
+
+def parse_latency(spec):
+    """
+    Parses a latency distribution spec into a zero-argument sampler (seconds):
+    "0.5" or "const:0.5", "uniform:0.2:1.0", "lognormal:median:sigma", "exp:mean".
+    """
+    parts = str(spec).split(":")
+    kind = parts[0]
+    try:
+        if len(parts) == 1:
+            value = float(kind)
+            return lambda: value
+        args = [float(p) for p in parts[1:]]
+    except ValueError:
+        raise ValueError(f"Invalid latency spec: {spec}")
+
+    if kind == "const":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        median, sigma = args
+        return lambda: median * random.lognormvariate(0, sigma)
+    if kind == "exp":
+        return lambda: random.expovariate(1 / args[0])
+    raise ValueError(f"Unknown latency distribution: {kind}")
+
+class FakeServerConfig:
+    def __init__(self, latency="0.2", error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 tokens_per_second=200, content=SAMPLE_ITEM, prefix_cache=False, cache_speedup=0.5,
+                 cache_min_tokens=1024, cache_block_tokens=128):
+        self.sample_latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.tokens_per_second = tokens_per_second
+        self.content = content
+        self.prefix_cache = prefix_cache
+        self.cache_speedup = cache_speedup
+        # OpenAI caches prefixes of at least 1024 tokens in 128-token steps; vLLM-style
+        # servers cache every full block (e.g. --cache-min-tokens 16 --cache-block-tokens 16)
+        self.cache_min_tokens = cache_min_tokens
+        self.cache_block_tokens = cache_block_tokens
+        self.stats = {"requests": 0, "ok": 0, "errors": 0, "rate_limited": 0, "streamed": 0,
+                      "prompt_tokens": 0, "cached_tokens": 0}
+        self._cached_prefixes = set()
+        self._lock = threading.Lock()
+
+    def count(self, key, amount=1):
+        with self._lock:
+            self.stats[key] += amount
+
+    def cached_tokens(self, model, prompt):
+        """ Tokens of the longest previously seen prefix of prompt; remembers every prefix of this one """
+        if not self.prefix_cache:
+            return 0
+        cached = 0
+        # 4 characters per token
+        blocks = range(self.cache_min_tokens, len(prompt) // 4 + 1, self.cache_block_tokens)
+        keys = [(tokens, hashlib.sha256((model + prompt[:tokens * 4]).encode("utf-8")).digest()) for tokens in blocks]
+        with self._lock:
+            for tokens, key in keys:
+                if key not in self._cached_prefixes:
+                    break
+                cached = tokens
+            self._cached_prefixes.update(key for _, key in keys)
+        return cached
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "fake-model", "object": "model"}]})
+        else:
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        config = self.config
+        config.count("requests")
+
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+
+        roll = random.random()
+        if roll < config.rate_limit_rate:
+            config.count("rate_limited")
+            self.send_json(429, {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                           {"Retry-After": str(config.retry_after)})
+            return
+        if roll < config.rate_limit_rate + config.error_rate:
+            config.count("errors")
+            self.send_json(500, {"error": {"message": "Injected server error", "type": "server_error"}})
+            return
+
+        words = config.content.split(" ")
+        # A continuation carries the reply so far; answer with the rest of it
+        replied = sum(len((m.get("content") or "").split()) for m in request.get("messages", [])
+                      if m.get("role") == "assistant")
+        words = [" " + word for word in words[replied:]] if replied else words[:1] + [" " + word for word in words[1:]]
+        finish_reason = "stop"
+        if request.get("max_tokens") and len(words) > request["max_tokens"]:
+            words, finish_reason = words[:request["max_tokens"]], "length"
+        model = request.get("model", "fake-model")
+        prompt = "".join(f"{m.get('role')}:{m.get('content') or ''}\n" for m in request.get("messages", []))
+        prompt_tokens = len(prompt) // 4
+        cached_tokens = config.cached_tokens(model, prompt)
+        config.count("prompt_tokens", prompt_tokens)
+        config.count("cached_tokens", cached_tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                 "total_tokens": prompt_tokens + len(words),
+                 "prompt_tokens_details": {"cached_tokens": cached_tokens}}
+
+        # Latency until the first token, shorter for the cached part of the prompt;
+        # the rest of the reply arrives at tokens_per_second
+        cached_share = cached_tokens / prompt_tokens if prompt_tokens else 0
+        time.sleep(config.sample_latency() * (1 - config.cache_speedup * cached_share))
+
+        if request.get("stream"):
+            config.count("streamed")
+            self.stream_reply(model, words, usage, request, finish_reason)
+        else:
+            time.sleep(len(words) / config.tokens_per_second)
+            self.send_json(200, {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": finish_reason,
+                             "message": {"role": "assistant", "content": "".join(words)}}],
+                "usage": usage
+            })
+        config.count("ok")
+
+    def stream_reply(self, model, words, usage, request, finish_reason):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+        def send_event(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def chunk(delta, finish_reason=None):
+            return json.dumps({
+                "id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            })
+
+        delay = 1 / self.config.tokens_per_second
+        for word in words:
+            send_event(chunk({"content": word}))
+            time.sleep(delay)
+        send_event(chunk({}, finish_reason))
+        if (request.get("stream_options") or {}).get("include_usage"):
+            send_event(json.dumps({"id": completion_id, "object": "chat.completion.chunk",
+                                   "model": model, "choices": [], "usage": usage}))
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config):
+        super().__init__(address, FakeOpenAIHandler)
+        self.config = config
+
+    def handle_error(self, request, client_address):
+        # Clients dropping keep-alive connections is expected, not worth a traceback
+        pass
+
+def start_fake_server(host="127.0.0.1", port=0, **config_kwargs):
+    """
+    Starts the fake server on a background thread.
+    Returns (server, base_url); call server.shutdown() to stop it.
+    """
+    server = FakeOpenAIServer((host, port), FakeServerConfig(**config_kwargs))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stand-in server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="0.2", help='e.g. "0.5", "uniform:0.2:1.0", "lognormal:1.5:0.4", "exp:1.0"')
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 429")
+    parser.add_argument("--retry-after", type=float, default=1, help="Retry-After seconds sent with 429 responses")
+    parser.add_argument("--tokens-per-second", type=float, default=200)
+    parser.add_argument("--prefix-cache", action="store_true", help="Imitate provider prompt prefix caching")
+    parser.add_argument("--cache-speedup", type=float, default=0.5,
+                        help="Fraction of the latency saved when the whole prompt is cached")
+    parser.add_argument("--cache-min-tokens", type=int, default=1024, help="Shortest prefix that is cached")
+    parser.add_argument("--cache-block-tokens", type=int, default=128, help="Cached prefixes grow in steps of this size")
+    args = parser.parse_args()
+
+    server = FakeOpenAIServer((args.host, args.port), FakeServerConfig(
+        args.latency, args.error_rate, args.rate_limit_rate, args.retry_after, args.tokens_per_second,
+        prefix_cache=args.prefix_cache, cache_speedup=args.cache_speedup,
+        cache_min_tokens=args.cache_min_tokens, cache_block_tokens=args.cache_block_tokens))
+    print(f"Fake OpenAI server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"Stats: {server.config.stats}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""
+Reviewers finish in any order: each stage is checkpointed as soon as it
+finishes, and a resumed run still gets its history in stage order.
+"""
+import time
+from types import SimpleNamespace
+
+import openai
+
+from usmlegpt import core
+
+FIRST_FOCUS = core.REVIEWER_FOCUS[0]
+
+def reply(content):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+                           usage=None)
+
+def roles(history):
+    return [entry["role"] for entry in history]
+
+def test_finished_reviewers_are_checkpointed_before_slower_ones(monkeypatch, tmp_path):
+    store = core.CheckpointStore(str(tmp_path / "checkpoints.sqlite3"))
+    seen_while_running = []
+
+    def create(model, messages, **options):
+        prompt = messages[-1]["content"]
+        if prompt.endswith(f"focus more on {FIRST_FOCUS}."):
+            # Reviewer 1 waits for the other reviewers' checkpoints, then fails for good
+            deadline = time.time() + 5
+            while time.time() < deadline:
+                checkpointed = roles(store.load_run("run")["history"])
+                if "Reviewer 2" in checkpointed and "Reviewer 3" in checkpointed:
+                    seen_while_running.append(checkpointed)
+                    break
+                time.sleep(0.01)
+            raise openai.OpenAIError("reviewer 1 is down")
+        return reply("Accept the item as is.")
+
+    client = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(core.client_pool, "get", lambda api_key, base_url=None: client)
+    models = [{"model_name": "fake-model", "api_key": "test"}]
+    params = {"disciplines": ["Pathology"], "systems": ["Cardiovascular System"],
+              "competencies": ["Patient Care: Diagnosis"], "keywords": "", "prescreen": False}
+
+    mcq_system = core.MCQDevelopmentSystem(models, checkpoint_store=store, run_id="run")
+    mcq_system.response_cache = None
+    store.start_run(params, "run")
+    try:
+        with core.checkpoint_outcome(mcq_system):
+            core.develop_mcq(mcq_system, **params)
+    except core.ModelCallError:
+        pass
+    assert seen_while_running == [["Item Writer", "Reviewer 2", "Reviewer 3"]]
+
+    def create(model, messages, **options):
+        return reply("Accept the item as is.")
+
+    client.chat.completions.create = create
+    history = core.resume_run(models, store, "run")
+    assert roles(history) == [
+        "Item Writer", "Reviewer 1", "Reviewer 2", "Reviewer 3",
+        "Editorial Staff", "Author Revision", "Final Editorial Decision"
+    ]
+    assert roles(store.load_run("run")["history"]) == roles(history)
@@ -0,0 +1,28 @@
+"""
+parse_final_decision reads the verdict of the final editorial decision, which
+decides extra revision rounds and the accepted counts of coverage runs.
+"""
+import pytest
+
+from usmlegpt.core import parse_final_decision
+
+@pytest.mark.parametrize("text, decision", [
+    ("Final Decision: The revised item is accepted.", "accepted"),
+    ("Final Decision: Accept the item as is.", "accepted"),
+    ("Final Decision: Reject the item. The revision did not fix the key.", "rejected"),
+    ("Final Decision: Request further revisions to the distractors.", "revise"),
+    ("Final Decision: We request minor revisions before the item is accepted.", "revise"),
+    ("Decision: Revise", "revise"),
+    ("After the revision, the editorial staff decided the item needs further revision.", "revise"),
+    ("**Final Decision:**\n\nThe revised version is accepted for the item bank.", "accepted"),
+    ("Options were to 1. Accept 2. Request further revisions 3. Reject.\nFinal decision: rejected.", "rejected"),
+    ("Final decision: Not acceptable in current form; reject.", "rejected"),
+    ("Final decision: The item cannot be accepted as written.", "rejected"),
+    ("Final decision: The item is unacceptable.", "rejected"),
+    ("Final decision: Not yet acceptable; we request further revisions.", "revise"),
+    ("Final decision: Not acceptable as is, but it will be accepted once revised. Revise.", "revise"),
+    ("The revised item reads well and was revised twice.", None),
+    ("", None),
+])
+def test_parse_final_decision(text, decision):
+    assert parse_final_decision(text) == decision
@@ -0,0 +1,53 @@
+"""
+The response cache scopes sampled generation stages to their run, but
+extraction calls such as the JSON summarizer are keyed by content, so
+summarizing the same history twice only asks the model once.
+"""
+import json
+import threading
+from types import SimpleNamespace
+
+from usmlegpt import core
+
+ITEM = {"question": "Which of the following is the most likely cause of these findings in this patient?",
+        "options": ["A) Alpha", "B) Beta", "C) Gamma", "D) Delta", "E) Epsilon"], "correct_answer": "D"}
+
+class CountingClient:
+    """ Stands in for an OpenAI client and answers every request with a valid summary """
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **options):
+        with self._lock:
+            self.calls += 1
+        content = json.dumps({"draft": {"version": "draft", **ITEM}, "final": {"version": "final", **ITEM}})
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+                               usage=None)
+
+def test_summarizer_is_served_from_cache_on_second_call(monkeypatch, tmp_path):
+    client = CountingClient()
+    monkeypatch.setattr(core.client_pool, "get", lambda api_key, base_url=None: client)
+    monkeypatch.setattr(core, "default_response_cache", core.ResponseCache(str(tmp_path / "cache.sqlite3")))
+    models_config = [{"model_name": "fake-model", "api_key": "test"}]
+    # Entries that do not parse as items, so the summary needs the summarizer model
+    history = [{"timestamp": "2024-01-01 00:00:00", "role": role, "content": "Unstructured notes.", "version": version}
+               for version, role in enumerate(["Item Writer", "Author Revision"], 1)]
+
+    first = core.save_json_summary(history, models_config, "fake-model")
+    assert client.calls == 1
+    second = core.save_json_summary(history, models_config, "fake-model")
+    assert client.calls == 1
+    assert json.loads(first)["final"] == json.loads(second)["final"]
+
+def test_generation_stages_are_scoped_to_their_run(monkeypatch, tmp_path):
+    client = CountingClient()
+    monkeypatch.setattr(core.client_pool, "get", lambda api_key, base_url=None: client)
+    cache = core.ResponseCache(str(tmp_path / "cache.sqlite3"))
+    models_config = [{"model_name": "fake-model", "api_key": "test"}]
+
+    for _ in range(2):
+        mcq_system = core.MCQDevelopmentSystem(models_config, response_cache=cache)
+        mcq_system.call_ai_model(mcq_system.models[0], "system", "Write an item.", cache_tag="Item Writer 1")
+    assert client.calls == 2
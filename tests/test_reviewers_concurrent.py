@@ -0,0 +1,58 @@
+"""
+The reviewer stages depend only on the writer draft, so develop_mcq runs them
+at the same time: with a fake client that sleeps per reviewer, the reviews take
+as long as the slowest one, and still land in the history in reviewer order.
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+from usmlegpt import core
+
+REVIEWER_LATENCY = {focus: latency for focus, latency in zip(core.REVIEWER_FOCUS, (0.6, 0.2, 0.4))}
+
+class LatencyClient:
+    """ Stands in for an OpenAI client: replies name the reviewer and sleep for its latency """
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, model, messages, **options):
+        prompt = messages[-1]["content"]
+        focus = next((focus for focus in REVIEWER_LATENCY if prompt.endswith(f"focus more on {focus}.")), None)
+        started = time.perf_counter()
+        if focus:
+            time.sleep(REVIEWER_LATENCY[focus])
+        with self._lock:
+            self.calls.append((focus, started, time.perf_counter()))
+        content = f"Review focusing on {focus}" if focus else "Accept the item as is."
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content), finish_reason="stop")],
+                               usage=None)
+
+def test_reviewers_overlap_and_keep_their_order(monkeypatch):
+    client = LatencyClient()
+    monkeypatch.setattr(core.client_pool, "get", lambda api_key, base_url=None: client)
+    mcq_system = core.MCQDevelopmentSystem([{"model_name": "fake-model", "api_key": "test"}])
+    mcq_system.response_cache = None
+
+    started = time.perf_counter()
+    history = core.develop_mcq(mcq_system, ["Pathology"], ["Cardiovascular System"], ["Patient Care: Diagnosis"], "",
+                               prescreen=False)
+    elapsed = time.perf_counter() - started
+
+    reviews = [(start, end) for focus, start, end in client.calls if focus]
+    assert len(reviews) == 3
+    slowest, total = max(REVIEWER_LATENCY.values()), sum(REVIEWER_LATENCY.values())
+    # Every review started before the first one finished, so the phase takes about as long as the slowest
+    assert max(start for start, _ in reviews) < min(end for _, end in reviews)
+    assert max(end for _, end in reviews) - min(start for start, _ in reviews) < slowest + 0.2
+    assert slowest <= elapsed < total
+
+    assert [entry["role"] for entry in history] == [
+        "Item Writer", "Reviewer 1", "Reviewer 2", "Reviewer 3",
+        "Editorial Staff", "Author Revision", "Final Editorial Decision"
+    ]
+    assert [entry["version"] for entry in history] == list(range(1, 8))
+    for entry, focus in zip(history[1:4], core.REVIEWER_FOCUS):
+        assert entry["content"] == f"Review focusing on {focus}"
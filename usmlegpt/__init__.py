@@ -0,0 +1,6 @@
+"""
+USMLE MCQ development system. Importing the package loads the pipeline
+(usmlegpt.core) without Gradio or the OpenAI SDK; the web app is in
+usmlegpt.ui and the command line in usmlegpt.cli (python -m usmlegpt).
+"""
+from .core import *
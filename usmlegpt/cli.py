@@ -0,0 +1,429 @@
+"""
+Command line for the MCQ pipeline:
+python -m usmlegpt generate | batch | fill | enqueue | worker | jobs | export | serve.
+Only the serve command imports Gradio.
+"""
+import argparse
+import json
+import os
+import sys
+
+from .core import (
+    CheckpointStore,
+    ItemStore,
+    ModelRouter,
+    NearDuplicateIndex,
+    PrometheusMetrics,
+    ResponseCache,
+    blueprint_grid,
+    cache_limits_from_env,
+    competency_options,
+    default_checkpoint_store,
+    default_item_store,
+    discipline_options,
+    generate_html_report,
+    load_blueprint,
+    load_models_config,
+    load_pipeline,
+    model_router,
+    register_metrics_hook,
+    run_batch,
+    stream_mcq,
+    system_options
+)
+from .coverage import CoveragePlan, run_coverage
+from .export import EXPORT_WRITERS, export_items, iter_batch_items
+from .jobs import JobQueue, run_worker, run_worker_processes
+
+def response_cache_from_args(args):
+    if not args.cache:
+        return None
+    return ResponseCache(args.cache, args.cache_mode, args.cache_ttl,
+                         max_entries=args.cache_max_entries, max_bytes=args.cache_max_bytes)
+
+def print_batch_progress(done, total, record):
+    print(f"[{done}/{total}] item {record['item_id']} {record['status']} "
+          f"({record['elapsed_seconds']}s) {record['disciplines']} / {record['systems']} / {record['competencies']}")
+
+def run_batch_cli(args):
+    models_config = load_models_config(args.models)
+    if args.blueprint:
+        blueprint = load_blueprint(args.blueprint)
+    else:
+        blueprint = blueprint_grid(args.disciplines, args.systems, args.competencies,
+                                   args.count, args.keywords)
+
+    model_router.policy = args.routing
+    response_cache = response_cache_from_args(args)
+
+    item_store = ItemStore(args.store) if args.store else default_item_store
+    checkpoint_store = CheckpointStore(args.checkpoints) if args.checkpoints else default_checkpoint_store
+    duplicate_index = None
+    if args.dedup_threshold > 0:
+        duplicate_index = NearDuplicateIndex.from_store(item_store, threshold=args.dedup_threshold) \
+            if item_store else NearDuplicateIndex(args.dedup_threshold)
+
+    counts = run_batch(models_config, blueprint, args.output,
+                       max_concurrency=args.concurrency,
+                       per_model_concurrency=args.per_model_concurrency,
+                       progress_callback=print_batch_progress,
+                       response_cache=response_cache,
+                       item_store=item_store,
+                       checkpoint_store=checkpoint_store,
+                       duplicate_index=duplicate_index,
+                       prescreen=not args.no_prescreen,
+                       prescreen_model=args.prescreen_model,
+                       max_regenerations=args.max_regenerations,
+                       max_revision_rounds=args.revision_rounds,
+                       pipeline=load_pipeline(args.pipeline) if args.pipeline else None,
+                       max_item_cost=args.max_item_cost,
+                       max_batch_cost=args.max_batch_cost)
+    print(f"Batch finished: {counts['ok']} ok, {counts['rejected']} rejected, {counts['duplicate']} duplicates, "
+          f"{counts['over_budget']} over budget, {counts['error']} failed, {counts['skipped']} already done, "
+          f"${counts['cost_usd']:.4f} spent. "
+          f"Results in {args.output}")
+
+def print_stage_progress(entry):
+    print(f"{entry['role']} finished ({len(entry['content'])} chars)", file=sys.stderr)
+
+def run_generate_cli(args):
+    """ Runs the pipeline once, reports stages on stderr and writes the history as JSON """
+    item_store = ItemStore(args.store) if args.store else default_item_store
+    history, error = [], None
+    for view in stream_mcq(args.models, args.disciplines, args.systems, args.competencies, args.keywords,
+                           args.writer_model, args.reviewer_models, args.editor_model, item_store,
+                           prescreen=not args.no_prescreen,
+                           prescreen_model=args.prescreen_model,
+                           max_regenerations=args.max_regenerations,
+                           max_revision_rounds=args.revision_rounds,
+                           pipeline=load_pipeline(args.pipeline) if args.pipeline else None,
+                           max_item_cost=args.max_item_cost):
+        finished = [entry for entry in view if "role" in entry and entry.get("version") != "in progress"]
+        for entry in finished[len(history):]:
+            print_stage_progress(entry)
+        history = finished
+        error = next((entry["error"] for entry in view if "error" in entry), error)
+
+    result = json.dumps(history + ([{"error": error}] if error else []), indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(result)
+    else:
+        print(result)
+    if args.html and history:
+        report_path = generate_html_report(history)
+        if report_path:
+            os.replace(report_path, args.html)
+    if error:
+        print(f"Generation failed: {error}", file=sys.stderr)
+        return 1
+    return 0
+
+def run_export_cli(args):
+    outputs = {fmt: getattr(args, fmt) for fmt in EXPORT_WRITERS if getattr(args, fmt)}
+    if not outputs:
+        print("Nothing to export: pass at least one of " + ", ".join(f"--{fmt}" for fmt in EXPORT_WRITERS))
+        return 2
+    if args.batch_results:
+        items = iter_batch_items(args.batch_results)
+    else:
+        item_store = ItemStore(args.store) if args.store else default_item_store
+        if item_store is None:
+            print("No item store: pass --store, --batch-results or set USMLEGPT_STORE")
+            return 2
+        if args.text:
+            try:
+                item_store.check_text_query(args.text)
+            except ValueError as e:
+                print(e, file=sys.stderr)
+                return 2
+        items = item_store.query(with_history=not args.no_history, status=args.status, decision=args.decision,
+                                 discipline=args.discipline, system=args.system, competency=args.competency,
+                                 model=args.model, text=args.text)
+
+    counts = export_items(items, outputs, workers=args.workers, with_history=not args.no_history,
+                          page_size=args.page_size, title=args.title)
+    print(f"Exported {counts['items']} items to {', '.join(outputs.values())}"
+          + (f" ({counts['qti_skipped']} unparsed items left out of the QTI package)" if counts.get("qti_skipped") else ""))
+    return 0
+
+def print_coverage(plan, limit=20):
+    rows = plan.report()
+    print(f"{'discipline':<28}{'system':<34}{'competency':<34}{'quota':>6}{'accepted':>9}{'tried':>6}{'rate':>6}")
+    for row in rows[:limit]:
+        print(f"{row['discipline'][:27]:<28}{row['system'][:33]:<34}{row['competency'][:33]:<34}"
+              f"{row['quota']:>6}{row['accepted']:>9}{row['attempts']:>6}{row['rate']:>6}"
+              f"{'  retired' if row['retired'] else ''}")
+    if len(rows) > limit:
+        print(f"... {len(rows) - limit} more cells")
+    print(f"{sum(1 for row in rows if row['deficit'] == 0)}/{len(rows)} cells full, "
+          f"{sum(row['deficit'] for row in rows)} accepted items missing")
+
+def print_fill_progress(plan, record):
+    print(f"{record['status']} ({record['decision'] or '-'}, {record['elapsed_seconds']}s) "
+          f"{record['disciplines'][0]} / {record['systems'][0]} / {record['competencies'][0]}, "
+          f"{sum(plan.deficit(key) for key in plan.quotas)} accepted items missing")
+
+def run_fill_cli(args):
+    if args.blueprint:
+        targets = load_blueprint(args.blueprint)
+    else:
+        targets = blueprint_grid(args.disciplines, args.systems, args.competencies, args.count, args.keywords)
+    item_store = ItemStore(args.store) if args.store else default_item_store
+    if item_store is None:
+        print("fill needs an item store to count accepted items: pass --store or set USMLEGPT_STORE")
+        return 2
+    plan = CoveragePlan.from_store(targets, item_store, max_attempts_per_cell=args.max_attempts_per_cell,
+                                   max_consecutive_errors=args.max_consecutive_errors)
+    if args.report:
+        print_coverage(plan)
+        return 0
+
+    model_router.policy = args.routing
+    response_cache = response_cache_from_args(args)
+    checkpoint_store = CheckpointStore(args.checkpoints) if args.checkpoints else default_checkpoint_store
+    duplicate_index = None
+    if args.dedup_threshold > 0:
+        duplicate_index = NearDuplicateIndex.from_store(item_store, threshold=args.dedup_threshold)
+    counts = run_coverage(load_models_config(args.models), plan, args.output, item_store,
+                          max_concurrency=args.concurrency, per_model_concurrency=args.per_model_concurrency,
+                          progress_callback=print_fill_progress, response_cache=response_cache,
+                          checkpoint_store=checkpoint_store, max_item_cost=args.max_item_cost,
+                          max_batch_cost=args.max_batch_cost, duplicate_index=duplicate_index,
+                          prescreen=not args.no_prescreen, prescreen_model=args.prescreen_model,
+                          max_regenerations=args.max_regenerations, max_revision_rounds=args.revision_rounds,
+                          pipeline=load_pipeline(args.pipeline) if args.pipeline else None)
+    print(f"Fill finished: {counts['accepted']} accepted of {counts['done']} runs ({counts['rejected']} rejected, "
+          f"{counts['duplicate']} duplicates, {counts['over_budget']} over budget, {counts['error']} failed, "
+          f"{counts['cancelled']} cancelled), "
+          f"${counts['cost_usd']:.4f} spent, {counts['deficit']} accepted items still missing")
+    print_coverage(plan)
+    return 0
+
+def run_enqueue_cli(args):
+    if args.blueprint:
+        cells = load_blueprint(args.blueprint)
+    else:
+        cells = blueprint_grid(args.disciplines, args.systems, args.competencies, args.count, args.keywords)
+    assignments = {"writer_model": args.writer_model, "reviewer_models": args.reviewer_models,
+                   "editor_model": args.editor_model, "prescreen_model": args.prescreen_model}
+    cells = [{**{key: value for key, value in assignments.items() if value}, **cell} for cell in cells]
+    job_ids = JobQueue(args.queue).enqueue(cells)
+    print(f"Queued {len(job_ids)} jobs in {args.queue}")
+
+def print_job_progress(worker_id, job, outcome):
+    params = job["params"]
+    print(f"[{worker_id}] job {job['id']} {outcome} (attempt {job['attempts']}) "
+          f"{params.get('disciplines')} / {params.get('systems')} / {params.get('competencies')}")
+
+def run_worker_process(args):
+    """ One worker process: opens its own queue, stores and cache and runs jobs until stopped or idle """
+    job_queue = JobQueue(args.queue, lease_seconds=args.lease, max_attempts=args.max_attempts)
+    model_router.policy = args.routing
+    response_cache = response_cache_from_args(args)
+    item_store = ItemStore(args.store) if args.store else default_item_store
+    checkpoint_store = CheckpointStore(args.checkpoints) if args.checkpoints else default_checkpoint_store
+    duplicate_index = None
+    if args.dedup_threshold > 0:
+        duplicate_index = NearDuplicateIndex.from_store(item_store, threshold=args.dedup_threshold) \
+            if item_store else NearDuplicateIndex(args.dedup_threshold)
+    try:
+        counts = run_worker(job_queue, load_models_config(args.models), concurrency=args.concurrency,
+                            per_model_concurrency=args.per_model_concurrency, poll_interval=args.poll_interval,
+                            exit_when_idle=args.exit_when_idle, progress_callback=print_job_progress,
+                            response_cache=response_cache, item_store=item_store, checkpoint_store=checkpoint_store,
+                            duplicate_index=duplicate_index, prescreen=not args.no_prescreen,
+                            max_regenerations=args.max_regenerations, max_revision_rounds=args.revision_rounds,
+                            pipeline=load_pipeline(args.pipeline) if args.pipeline else None,
+                            max_item_cost=args.max_item_cost, max_cost=args.max_cost)
+    except KeyboardInterrupt:
+        return
+    print(f"Worker finished: {counts['done']} done, {counts['rejected']} rejected, {counts['duplicate']} duplicates, "
+          f"{counts['over_budget']} over budget, {counts['error']} failed attempts, {counts['lost']} lost leases, ${counts['cost_usd']:.4f} spent")
+
+def run_worker_cli(args):
+    if args.processes > 1:
+        run_worker_processes(args.processes, run_worker_process, args)
+    else:
+        run_worker_process(args)
+    print(f"Queue {args.queue}: {JobQueue(args.queue).counts()}")
+
+def run_jobs_cli(args):
+    job_queue = JobQueue(args.queue)
+    print(f"Queue {args.queue}: {job_queue.counts()}")
+    if args.results:
+        written = 0
+        with open(args.results, "w", encoding="utf-8") as f:
+            for job in job_queue.results(args.status):
+                # The same shape as batch records, so export --batch-results reads it
+                f.write(json.dumps({"item_id": job["id"], "status": "ok" if job["status"] == "done" else job["status"],
+                                    "error": job["error"], "store_id": job["store_id"], "history": job["history"] or [],
+                                    **job["params"]}, ensure_ascii=False) + "\n")
+                written += 1
+        print(f"Wrote {written} finished jobs to {args.results}")
+
+def add_grid_arguments(parser):
+    parser.add_argument("--blueprint", help="Blueprint JSON file; defaults to the grid given by the options below")
+    parser.add_argument("--disciplines", nargs="*", help="Disciplines for the grid (default: all)")
+    parser.add_argument("--systems", nargs="*", help="Systems for the grid (default: all)")
+    parser.add_argument("--competencies", nargs="*", help="Competencies for the grid (default: all)")
+    parser.add_argument("--keywords", default="", help="Additional elements for every grid item")
+    parser.add_argument("--count", type=int, default=1, help="Items per grid cell")
+
+def add_pipeline_arguments(parser):
+    parser.add_argument("--per-model-concurrency", type=int, default=2, help="Maximum in-flight calls per model")
+    parser.add_argument("--routing", choices=ModelRouter.POLICIES, default=model_router.policy,
+                        help="How models are picked for roles without an explicit assignment")
+    parser.add_argument("--cache", help="SQLite response cache file")
+    parser.add_argument("--cache-mode", choices=ResponseCache.MODES, default="read_write",
+                        help="read_write, record (always call, store) or replay (cache only, no network)")
+    parser.add_argument("--cache-ttl", type=float, help="Ignore cached responses older than this many seconds")
+    cache_limits = cache_limits_from_env()
+    parser.add_argument("--cache-max-entries", type=int, default=cache_limits["max_entries"],
+                        help="Evict the least recently used responses beyond this many (default: USMLEGPT_CACHE_MAX_ENTRIES)")
+    parser.add_argument("--cache-max-bytes", type=int, default=cache_limits["max_bytes"],
+                        help="Evict the least recently used responses beyond this total size (default: USMLEGPT_CACHE_MAX_BYTES)")
+    parser.add_argument("--checkpoints",
+                        help="SQLite checkpoint file (default: USMLEGPT_CHECKPOINTS); interrupted items resume from their first missing stage")
+    parser.add_argument("--store", help="SQLite item store every finished item is saved to (default: USMLEGPT_STORE)")
+    parser.add_argument("--dedup-threshold", type=float, default=float(os.environ.get("USMLEGPT_DEDUP_THRESHOLD", 0.8)),
+                        help="Similarity at which a draft counts as a near-duplicate of a stored or earlier item (0 disables)")
+    parser.add_argument("--no-prescreen", action="store_true", help="Skip the local structural checks on drafts")
+    parser.add_argument("--max-regenerations", type=int, default=1, help="Redrafts allowed after a draft fails the pre-screen")
+    parser.add_argument("--revision-rounds", type=int, default=0,
+                        help="Extra revision rounds run when the final decision requests revisions")
+    parser.add_argument("--pipeline", help="Pipeline JSON file with the stage graph (default: USMLEGPT_PIPELINE or the built-in flow)")
+    parser.add_argument("--max-item-cost", type=float, help="Cost ceiling in USD per item (default: USMLEGPT_MAX_ITEM_COST)")
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="USMLE MCQ Development System")
+    parser.add_argument("--concurrency-limit", type=int, default=int(os.environ.get("USMLEGPT_CONCURRENCY_LIMIT", 16)),
+                        help="Web app: number of queued requests processed at once")
+    parser.add_argument("--max-queue-size", type=int, default=int(os.environ.get("USMLEGPT_MAX_QUEUE_SIZE", 100)),
+                        help="Web app: requests allowed to wait in the queue before new ones are rejected")
+    subparsers = parser.add_subparsers(dest="command")
+
+    subparsers.add_parser("serve", help="Launch the Gradio web app on port 1210")
+
+    generate_parser = subparsers.add_parser("generate", help="Develop one item without the web UI")
+    generate_parser.add_argument("--models", required=True, help="JSON file with a list of {api_key, base_url, model_name}")
+    generate_parser.add_argument("--disciplines", nargs="+", required=True, choices=discipline_options)
+    generate_parser.add_argument("--systems", nargs="+", required=True, choices=system_options)
+    generate_parser.add_argument("--competencies", nargs="+", required=True, choices=competency_options)
+    generate_parser.add_argument("--keywords", default="", help="Additional elements to incorporate into the item")
+    generate_parser.add_argument("--writer-model", help="Model for the item writer (default: routed)")
+    generate_parser.add_argument("--reviewer-models", nargs="*", help="Models for the three reviewers (default: routed)")
+    generate_parser.add_argument("--editor-model", help="Model for the editorial staff (default: routed)")
+    generate_parser.add_argument("--prescreen-model", help="Cheap model that screens drafts for fatal flaws before review")
+    generate_parser.add_argument("--no-prescreen", action="store_true", help="Skip the local structural checks on drafts")
+    generate_parser.add_argument("--max-regenerations", type=int, default=1, help="Redrafts allowed after a draft fails the pre-screen")
+    generate_parser.add_argument("--revision-rounds", type=int, default=0,
+                                 help="Extra revision rounds run when the final decision requests revisions")
+    generate_parser.add_argument("--pipeline", help="Pipeline JSON file with the stage graph (default: USMLEGPT_PIPELINE or the built-in flow)")
+    generate_parser.add_argument("--max-item-cost", type=float, help="Cost ceiling in USD for the item (default: USMLEGPT_MAX_ITEM_COST)")
+    generate_parser.add_argument("--store", help="SQLite item store the finished item is saved to (default: USMLEGPT_STORE)")
+    generate_parser.add_argument("--output", help="File the history JSON is written to (default: stdout)")
+    generate_parser.add_argument("--html", help="Also write the HTML development report to this file")
+
+    batch_parser = subparsers.add_parser("batch", help="Generate items headlessly from a blueprint")
+    batch_parser.add_argument("--models", required=True, help="JSON file with a list of {api_key, base_url, model_name}")
+    add_grid_arguments(batch_parser)
+    batch_parser.add_argument("--output", default="mcq_batch_results.jsonl", help="JSONL file the results are appended to")
+    batch_parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of pipelines running at once")
+    batch_parser.add_argument("--prescreen-model", help="Cheap model that screens drafts for fatal flaws before review")
+    batch_parser.add_argument("--max-batch-cost", type=float, help="Cost ceiling in USD for the whole batch")
+    add_pipeline_arguments(batch_parser)
+
+    fill_parser = subparsers.add_parser("fill", help="Generate toward per-cell quotas of accepted items, neediest cells first")
+    fill_parser.add_argument("--models", help="JSON file with a list of {api_key, base_url, model_name}")
+    add_grid_arguments(fill_parser)
+    fill_parser.add_argument("--report", action="store_true", help="Only show the coverage of the quotas")
+    fill_parser.add_argument("--output", default="mcq_fill_results.jsonl", help="JSONL file the results are appended to")
+    fill_parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of pipelines running at once")
+    fill_parser.add_argument("--max-attempts-per-cell", type=int, default=10, help="Runs one fill may spend on a cell")
+    fill_parser.add_argument("--max-consecutive-errors", type=int, default=3,
+                             help="Failed runs in a row after which a cell gets no more runs")
+    fill_parser.add_argument("--prescreen-model", help="Cheap model that screens drafts for fatal flaws before review")
+    fill_parser.add_argument("--max-batch-cost", type=float, help="Cost ceiling in USD for the whole fill")
+    add_pipeline_arguments(fill_parser)
+
+    enqueue_parser = subparsers.add_parser("enqueue", help="Add blueprint items to a job queue for workers")
+    enqueue_parser.add_argument("--queue", default="mcq_jobs.sqlite3", help="SQLite job queue file")
+    add_grid_arguments(enqueue_parser)
+    enqueue_parser.add_argument("--writer-model", help="Writer model for jobs whose cell does not name one")
+    enqueue_parser.add_argument("--reviewer-models", nargs="*", help="Reviewer models for jobs whose cell does not name them")
+    enqueue_parser.add_argument("--editor-model", help="Editor model for jobs whose cell does not name one")
+    enqueue_parser.add_argument("--prescreen-model", help="Pre-screen model for jobs whose cell does not name one")
+
+    worker_parser = subparsers.add_parser("worker", help="Run queued jobs; start one per core or host")
+    worker_parser.add_argument("--queue", default="mcq_jobs.sqlite3", help="SQLite job queue file")
+    worker_parser.add_argument("--models", required=True, help="JSON file with a list of {api_key, base_url, model_name}")
+    worker_parser.add_argument("--processes", type=int, default=1, help="Worker processes to start on this host")
+    worker_parser.add_argument("--concurrency", type=int, default=2, help="Pipelines each worker process runs at once")
+    worker_parser.add_argument("--lease", type=float, default=120, help="Seconds a job stays leased without a heartbeat")
+    worker_parser.add_argument("--max-attempts", type=int, default=3, help="Attempts per job before it is marked failed")
+    worker_parser.add_argument("--poll-interval", type=float, default=1.0, help="Seconds between polls of an empty queue")
+    worker_parser.add_argument("--exit-when-idle", action="store_true", help="Stop once no job is queued or leased")
+    worker_parser.add_argument("--max-cost", type=float, help="Cost ceiling in USD per worker process; it stops leasing once reached")
+    add_pipeline_arguments(worker_parser)
+
+    jobs_parser = subparsers.add_parser("jobs", help="Show job queue counts and dump finished jobs")
+    jobs_parser.add_argument("--queue", default="mcq_jobs.sqlite3", help="SQLite job queue file")
+    jobs_parser.add_argument("--results", help="Write finished jobs to this JSONL file (readable by export --batch-results)")
+    jobs_parser.add_argument("--status", choices=JobQueue.FINISHED, help="Only dump jobs with this status")
+
+    export_parser = subparsers.add_parser("export", help="Export an item bank to JSONL, CSV, Parquet, QTI or HTML")
+    export_parser.add_argument("--store", help="SQLite item store to export (default: USMLEGPT_STORE)")
+    export_parser.add_argument("--batch-results", help="Export a batch results JSONL file instead of a store")
+    for name in ("status", "decision", "discipline", "system", "competency", "model"):
+        export_parser.add_argument(f"--{name}", help=f"Only items with this {name}")
+    export_parser.add_argument("--text", help="Only items matching this full-text query")
+    export_parser.add_argument("--jsonl", help="JSON Lines output file")
+    export_parser.add_argument("--csv", help="CSV output file")
+    export_parser.add_argument("--parquet", help="Parquet output file (requires pyarrow)")
+    export_parser.add_argument("--qti", help="QTI 2.1 content package (.zip) output file")
+    export_parser.add_argument("--html", help="Paginated HTML report output file")
+    export_parser.add_argument("--page-size", type=int, default=50, help="Items per page of the HTML report")
+    export_parser.add_argument("--title", default="USMLE MCQ Item Bank", help="Title of the HTML report")
+    export_parser.add_argument("--no-history", action="store_true", help="Leave the development histories out")
+    export_parser.add_argument("--workers", type=int, default=1, help="Processes rendering items in parallel")
+
+    return parser
+
+def main(argv=None, default_command=None, prog=None):
+    """ Runs a command line; default_command is used when none is given (UsmleGPT.py launches the web app) """
+    parser = build_arg_parser()
+    if prog:
+        parser.prog = prog
+    args = parser.parse_args(argv)
+    command = args.command or default_command
+    if command is None:
+        parser.print_help()
+        return 2
+    if os.environ.get("USMLEGPT_METRICS_PORT"):
+        # Expose stage metrics for Prometheus scraping at http://host:port/metrics
+        register_metrics_hook(PrometheusMetrics()).serve(int(os.environ["USMLEGPT_METRICS_PORT"]))
+    if command == "generate":
+        return run_generate_cli(args)
+    if command == "fill":
+        if not args.report and not args.models:
+            parser.error("fill needs --models unless --report is given")
+        return run_fill_cli(args)
+    if command == "enqueue":
+        run_enqueue_cli(args)
+        return 0
+    if command == "worker":
+        run_worker_cli(args)
+        return 0
+    if command == "jobs":
+        run_jobs_cli(args)
+        return 0
+    if command == "export":
+        return run_export_cli(args)
+    if command == "batch":
+        run_batch_cli(args)
+        return 0
+    from .ui import serve
+
+    serve(args.concurrency_limit, args.max_queue_size)
+    return 0
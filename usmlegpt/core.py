@@ -0,0 +1,3059 @@
+"""
+MCQ development pipeline without the web UI. The OpenAI SDK is imported when
+the first client is created, so scripts and batch workers start quickly; the
+Gradio interface lives in usmlegpt.ui.
+"""
+import json
+import random
+import contextlib
+import itertools
+import threading
+import queue
+import asyncio
+from email.utils import parsedate_to_datetime
+import datetime
+import time
+import os
+import re
+import hashlib
+import html
+import difflib
+import sqlite3
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+def extract_json_content(json_str):
+    """
+    Extracts the JSON content from a string by finding the outermost {} pair.
+    """
+    try:
+        # Find the first { and the last }
+        match = re.search(r'\{.*\}', json_str, re.DOTALL)
+        if match:
+            # Return the content within the outermost {}
+            return match.group(0)
+        else:
+            return None
+    except Exception as e:
+        print(f"Error extracting JSON content: {e}")
+        return None
+
+# Option markers: "(A) text" anywhere, or "A) text" / "A. text" at the start of a line
+OPTION_MARKER_PATTERN = re.compile(r'(?:(?<=\s)|^)\(([A-J])\)\s*|^[ \t>*-]*([A-J])[\).]\s+', re.MULTILINE)
+CORRECT_ANSWER_PATTERN = re.compile(r'Correct\s+Answer\s*(?:is)?\s*[:\-]?\s*\(?([A-J])\b', re.IGNORECASE)
+# Lines that introduce an item rather than belong to its stem, e.g. "Revised Item:" or "### Draft"
+ITEM_HEADER_PATTERN = re.compile(r'^\s*(#+\s.*|.{0,80}:\s*)$')
+
+def _option_chains(text):
+    """ Runs of option markers whose letters go A, B, C, ... without gaps """
+    chains = []
+    for match in OPTION_MARKER_PATTERN.finditer(text):
+        letter = match.group(1) or match.group(2)
+        if letter == "A":
+            chains.append([match])
+        elif chains and chr(ord(chains[-1][-1].group(1) or chains[-1][-1].group(2)) + 1) == letter:
+            chains[-1].append(match)
+    return [chain for chain in chains if len(chain) >= 4]
+
+def _extract_stem(text):
+    """ Walks back over paragraphs until one looks like a header or the text starts """
+    paragraphs = [p.strip() for p in re.split(r'\n\s*\n', text) if p.strip()]
+    stem = []
+    for paragraph in reversed(paragraphs):
+        lines = paragraph.splitlines()
+        if ITEM_HEADER_PATTERN.match(lines[0]) and len(lines) == 1:
+            break
+        if ITEM_HEADER_PATTERN.match(lines[0]):
+            # "Revised Item:\nA 45-year-old..." keeps the part after the header line
+            stem.append("\n".join(lines[1:]).strip())
+            break
+        stem.append(paragraph)
+    return "\n\n".join(reversed(stem)).strip()
+
+def parse_mcq_item(text):
+    """
+    Parses an item written as "<stem> (A) ... (E) ... Correct Answer: X" (or with
+    "A) ..." options on separate lines) without calling a model.
+    Returns (item, issues); item is None when no option list is found and the
+    item should only be trusted when issues is empty.
+    """
+    if not text:
+        return None, ["empty text"]
+
+    text = text.replace("**", "").replace("__", "")
+    chains = _option_chains(text)
+    if not chains:
+        return None, ["no A-E option list found"]
+
+    # Prefer the option list directly followed by a "Correct Answer" line; option-by-option
+    # rationales that come afterwards would otherwise look like another item
+    answers = list(CORRECT_ANSWER_PATTERN.finditer(text))
+    chain, answer = chains[-1], None
+    for candidate in chains:
+        following = next((a for a in answers if a.start() >= candidate[-1].end()), None)
+        if following:
+            chain, answer = candidate, following
+            break
+    if answer is None and answers:
+        answer = answers[-1]
+
+    options = []
+    for i, match in enumerate(chain):
+        end = chain[i + 1].start() if i + 1 < len(chain) else len(text)
+        if i + 1 == len(chain):
+            if answer and answer.start() >= match.end():
+                end = answer.start()
+            blank_line = re.search(r'\n\s*\n', text[match.end():end])
+            if blank_line:
+                end = match.end() + blank_line.start()
+        letter = match.group(1) or match.group(2)
+        options.append(f"{letter}) {' '.join(text[match.end():end].split())}")
+
+    item = {
+        "question": _extract_stem(text[:chain[0].start()]),
+        "options": options,
+        "correct_answer": answer.group(1).upper() if answer else ""
+    }
+
+    issues = []
+    letters = [option[0] for option in options]
+    if len(options) < 5:
+        issues.append(f"only {len(options)} options")
+    if not item["correct_answer"]:
+        issues.append("no correct answer")
+    elif item["correct_answer"] not in letters:
+        issues.append(f"correct answer {item['correct_answer']} is not an option")
+    if len(item["question"]) < 40 or "?" not in item["question"]:
+        issues.append("question stem missing or has no lead-in question")
+    if any(len(option) <= 3 or len(option) > 400 for option in options):
+        issues.append("empty or overlong option")
+    return item, issues
+
+def diff_mcq_items(draft, final):
+    """ Structured differences between two parsed items """
+    def sentences(text):
+        return [s.strip() for s in re.split(r'(?<=[.?!])\s+', text or "") if s.strip()]
+
+    def option_text(option):
+        return option[3:] if len(option) > 3 else ""
+
+    draft_sentences, final_sentences = sentences(draft["question"]), sentences(final["question"])
+    draft_options = {option[0]: option_text(option) for option in draft["options"]}
+    final_options = {option[0]: option_text(option) for option in final["options"]}
+
+    options = []
+    for letter in sorted(set(draft_options) | set(final_options)):
+        before, after = draft_options.get(letter), final_options.get(letter)
+        if before is None:
+            status = "added"
+        elif after is None:
+            status = "removed"
+        else:
+            status = "unchanged" if before == after else "changed"
+        options.append({"letter": letter, "status": status, "draft": before, "final": after})
+
+    return {
+        "question": {
+            "changed": draft["question"] != final["question"],
+            "similarity": round(difflib.SequenceMatcher(None, draft["question"], final["question"]).ratio(), 3),
+            "removed_sentences": [s for s in draft_sentences if s not in final_sentences],
+            "added_sentences": [s for s in final_sentences if s not in draft_sentences]
+        },
+        "options": options,
+        "correct_answer": {
+            "draft": draft["correct_answer"],
+            "final": final["correct_answer"],
+            "changed": draft["correct_answer"] != final["correct_answer"]
+        }
+    }
+
+def find_draft_and_final(history):
+    """ The first Item Writer entry and the last Author Revision (or Editorial Staff) entry """
+    draft = next((entry for entry in history if entry.get('role') == "Item Writer"), None)
+    final = next((entry for entry in reversed(history)
+                  if role_matches(entry.get('role', ''), ["Author Revision", "Editorial Staff"])), None)
+    return draft, final
+
+def summarize_versions_locally(history):
+    """
+    Builds the draft/final JSON summary with parse_mcq_item. Returns
+    (summary, issues); summary is None when either version fails the checks.
+    """
+    draft_entry, final_entry = find_draft_and_final(history)
+    if not draft_entry or not final_entry:
+        return None, ["history has no draft or final version"]
+
+    draft, draft_issues = parse_mcq_item(draft_entry['content'])
+    final, final_issues = parse_mcq_item(final_entry['content'])
+    issues = [f"draft: {issue}" for issue in draft_issues] + [f"final: {issue}" for issue in final_issues]
+    if issues:
+        return None, issues
+
+    return {
+        "draft": {"version": "draft", **draft},
+        "final": {"version": "final", **final},
+        "diff": diff_mcq_items(draft, final),
+        "source": "parser"
+    }, []
+
+# Structured output, strictest first: a JSON schema, plain JSON mode, then free text
+STRUCTURED_OUTPUT_MODES = ("json_schema", "json_object", "text")
+# (base_url, model_name) -> modes the endpoint rejected, so they are not tried again
+unsupported_output_modes = {}
+
+MCQ_ITEM_SCHEMA = {
+    "type": "object",
+    "required": ["version", "question", "options", "correct_answer"],
+    "properties": {
+        "version": {"type": "string"},
+        "question": {"type": "string", "minLength": 20},
+        "options": {
+            "type": "array",
+            "minItems": 4,
+            "maxItems": 10,
+            "items": {"type": "string", "pattern": r"^[A-J]\) \S"}
+        },
+        "correct_answer": {"type": "string", "enum": list("ABCDEFGHIJ")}
+    }
+}
+
+MCQ_SUMMARY_SCHEMA = {
+    "type": "object",
+    "required": ["draft", "final"],
+    "properties": {"draft": MCQ_ITEM_SCHEMA, "final": MCQ_ITEM_SCHEMA}
+}
+
+def structured_response_format(mode, schema, schema_name):
+    if mode == "json_schema":
+        return {"type": "json_schema", "json_schema": {"name": schema_name, "schema": schema}}
+    if mode == "json_object":
+        return {"type": "json_object"}
+    return None
+
+JSON_TYPES = {"object": dict, "array": list, "string": str, "number": (int, float), "integer": int, "boolean": bool}
+
+def validate_json(data, schema, path="$"):
+    """ Validates the JSON Schema subset used here (type, required, properties, items, sizes, enum, pattern) """
+    errors = []
+    expected = schema.get("type")
+    if expected and not isinstance(data, JSON_TYPES[expected]):
+        return [f"{path}: expected {expected}, got {type(data).__name__}"]
+
+    if "enum" in schema and data not in schema["enum"]:
+        errors.append(f"{path}: {data!r} is not one of {schema['enum']}")
+    if isinstance(data, str):
+        if len(data) < schema.get("minLength", 0):
+            errors.append(f"{path}: shorter than {schema['minLength']} characters")
+        if "pattern" in schema and not re.search(schema["pattern"], data):
+            errors.append(f"{path}: {data[:40]!r} does not match {schema['pattern']}")
+    if isinstance(data, dict):
+        for name in schema.get("required", []):
+            if name not in data:
+                errors.append(f"{path}: missing required property '{name}'")
+        for name, subschema in schema.get("properties", {}).items():
+            if name in data:
+                errors.extend(validate_json(data[name], subschema, f"{path}.{name}"))
+    if isinstance(data, list):
+        if len(data) < schema.get("minItems", 0):
+            errors.append(f"{path}: fewer than {schema['minItems']} items")
+        if "maxItems" in schema and len(data) > schema["maxItems"]:
+            errors.append(f"{path}: more than {schema['maxItems']} items")
+        if "items" in schema:
+            for i, item in enumerate(data):
+                errors.extend(validate_json(item, schema["items"], f"{path}[{i}]"))
+    return errors
+
+def validate_mcq_item(item, path="$"):
+    """ Schema check plus the cross-field rule that the answer must be one of the options """
+    errors = validate_json(item, MCQ_ITEM_SCHEMA, path)
+    if not errors:
+        letters = [option[0] for option in item["options"]]
+        if letters != list("ABCDEFGHIJ"[:len(letters)]):
+            errors.append(f"{path}.options: letters must run A, B, C, ... in order")
+        if item["correct_answer"] not in letters:
+            errors.append(f"{path}.correct_answer: {item['correct_answer']} is not one of the options")
+    return errors
+
+def validate_mcq_summary(data):
+    """ Validator for MCQ_SUMMARY_SCHEMA replies, including the per-item cross-field rules """
+    errors = validate_json(data, {"type": "object", "required": ["draft", "final"]})
+    for name in ("draft", "final"):
+        if isinstance(data, dict) and name in data:
+            errors.extend(validate_mcq_item(data[name], f"$.{name}"))
+    return errors
+
+def parse_json_response(content, validator):
+    """ Returns (data, errors) for a model reply that should hold JSON accepted by validator """
+    if not content:
+        return None, ["empty response"]
+    try:
+        data = json.loads(content)
+    except ValueError:
+        extracted = extract_json_content(content)
+        try:
+            data = json.loads(extracted) if extracted else None
+        except ValueError as e:
+            return None, [f"invalid JSON: {str(e)}"]
+        if data is None:
+            return None, ["no JSON object found"]
+
+    return data, validator(data)
+
+# Predefined options
+discipline_options = [
+    "Behavioral Sciences", "Pharmacology", "Biochemistry & Nutrition",
+    "Immunology", "Genetics", "Histology & Cell Biology", "Pathology",
+    "Gross Anatomy & Embryology", "Microbiology", "Physiology"
+]
+
+system_options = [
+    "Reproductive & Endocrine Systems",
+    "Social Sciences: Communication and Interpersonal Skills",
+    "Human Development", "Cardiovascular System",
+    "Respiratory & Renal/Urinary Systems",
+    "Gastrointestinal System",
+    "Behavioral Health & Nervous Systems/Special Senses",
+    "Musculoskeletal, Skin & Subcutaneous Tissue",
+    "Biostatistics & Epidemiology/Population Health",
+    "Blood & Lymphoreticular/Immune Systems",
+    "Multisystem Processes & Disorders"
+]
+
+competency_options = [
+    "Patient Care: Diagnosis",
+    "Practice–based Learning & Improvement",
+    "Communication and Interpersonal Skills",
+    "Medical Knowledge: Applying Foundational Science Concepts"
+]
+
+class ClientPool:
+    """
+    Process-wide registry of OpenAI clients keyed by (api_key, base_url).
+    Clients keep their HTTP connections alive and are shared by every Gradio
+    session and batch job. Clients unused for idle_timeout seconds are dropped.
+    """
+    def __init__(self, idle_timeout=900, keepalive_expiry=120, max_connections=100):
+        self.idle_timeout = idle_timeout
+        self.keepalive_expiry = keepalive_expiry
+        self.max_connections = max_connections
+        self._clients = {}  # key -> [client, last_used]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(api_key, base_url=None):
+        return (api_key, base_url.rstrip("/") if base_url else None)
+
+    def _create_client(self, api_key, base_url):
+        import httpx
+        from openai import OpenAI, DefaultHttpxClient
+
+        http_client = DefaultHttpxClient(
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=self.max_connections,
+                keepalive_expiry=self.keepalive_expiry
+            )
+        )
+        # Retries are handled by call_ai_model's RetryPolicy, not by the SDK
+        if base_url:
+            return OpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+        return OpenAI(api_key=api_key, http_client=http_client, max_retries=0)
+
+    def get(self, api_key, base_url=None):
+        key = self.make_key(api_key, base_url)
+        now = time.time()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = [self._create_client(*key), now]
+                self._clients[key] = entry
+            entry[1] = now
+            return entry[0]
+
+    def _evict_idle(self, now):
+        # Evicted clients are only dropped from the registry; a run still holding
+        # one keeps working and the connections are released once it is collected.
+        for key in [k for k, (_, last_used) in self._clients.items() if now - last_used > self.idle_timeout]:
+            del self._clients[key]
+
+    def retain(self, models_config):
+        """ Drops clients whose (api_key, base_url) no longer appears in the config table """
+        keep = {
+            self.make_key(config.get('api_key'), config.get('base_url'))
+            for config in models_config if config.get('api_key')
+        }
+        with self._lock:
+            for key in [k for k in self._clients if k not in keep]:
+                del self._clients[key]
+
+    def clear(self):
+        with self._lock:
+            self._clients.clear()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._clients)
+
+client_pool = ClientPool()
+
+class ModelCallError(Exception):
+    """ Raised when a model call fails for good (fatal error, retries exhausted or circuit open) """
+
+class PipelineCancelled(Exception):
+    """ Raised inside a run whose cancel_event was set, e.g. because the user left """
+
+class BudgetExceeded(Exception):
+    """ Raised before a model call that could take a run or batch past its cost ceiling """
+
+class DraftRejected(Exception):
+    """ Raised when every writer draft failed the pre-screen, so the review stages never ran """
+    def __init__(self, message, issues):
+        super().__init__(message)
+        self.issues = issues
+
+class DuplicateItemError(DraftRejected):
+    """ Raised when every writer draft was a near-duplicate of an existing item """
+    def __init__(self, message, matches):
+        super().__init__(message, [message])
+        self.matches = matches
+
+class RetryPolicy:
+    """
+    Decides which errors are worth retrying and how long to wait in between:
+    exponential backoff with jitter, or the server's Retry-After when given.
+    """
+    RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, max_attempts=5, base_delay=1.0, max_delay=60.0, jitter=0.5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def is_retryable(self, error):
+        import openai
+
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in self.RETRYABLE_STATUS_CODES or error.status_code >= 500
+        # Auth failures, unknown models and bad requests will never succeed
+        if isinstance(error, openai.OpenAIError):
+            return False
+        return True
+
+    @staticmethod
+    def retry_after(error):
+        """ Seconds requested by the server's Retry-After(-Ms) header, if any """
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None)
+        if not headers:
+            return None
+
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            value = headers.get("retry-after")
+            if not value:
+                return None
+            try:
+                return float(value)
+            except ValueError:
+                retry_at = parsedate_to_datetime(value)
+                return max(0.0, (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds())
+        except Exception:
+            return None
+
+    def backoff(self, attempt, error=None):
+        retry_after = self.retry_after(error) if error is not None else None
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return delay * (1 - self.jitter + random.random() * self.jitter)
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures so calls to an unhealthy
+    endpoint fail fast. After reset_timeout seconds a single trial call is let
+    through (half-open); its outcome closes or re-opens the circuit. A trial
+    that is cancelled gives its slot back, and one that has not reported
+    within reset_timeout is presumed lost, so the next caller gets a new trial.
+    """
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started = 0.0
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.time()
+            if (self.state == "open" and now - self.opened_at >= self.reset_timeout) or \
+                    (self.state == "half_open" and now - self.trial_started >= self.reset_timeout):
+                self.state = "half_open"
+                self.trial_started = now
+                return True
+            return False
+
+    def release_trial(self):
+        """ Hands back a half-open trial that ended without a verdict, e.g. because the run was cancelled """
+        with self._lock:
+            if self.state == "half_open":
+                # opened_at is unchanged, so the next caller is let through at once
+                self.state = "open"
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                self.state = "open"
+                self.opened_at = time.time()
+
+class CircuitBreakerRegistry:
+    """ One CircuitBreaker per (base_url, model_name), shared process-wide """
+    def __init__(self, **breaker_kwargs):
+        self.breaker_kwargs = breaker_kwargs
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def get(self, base_url, model_name):
+        key = (base_url.rstrip("/") if base_url else None, model_name)
+        with self._lock:
+            if key not in self._breakers:
+                self._breakers[key] = CircuitBreaker(**self.breaker_kwargs)
+            return self._breakers[key]
+
+circuit_breakers = CircuitBreakerRegistry()
+
+class ResponseCache:
+    """
+    SQLite-backed, content-addressed cache of model responses keyed by
+    (endpoint, model, system_prompt, user_prompt, request options such as
+    temperature, scope). Sampled generation stages are scoped to the run and
+    stage asking, so their replies are only reused by the run that produced
+    them (a retried or resumed run) and replicates of the same prompt stay
+    independent. Extraction calls (summarizer, pre-screen, JSON repairs) have
+    no scope: the same input gets the same cached answer from any run.
+
+    Modes:
+    - "read_write": serve hits from the cache, store misses
+    - "record": always call the model and store the response
+    - "replay": serve only from the cache and never touch the network
+    Entries older than ttl seconds are ignored; beyond max_entries/max_bytes
+    the least recently used entries are evicted.
+    """
+    MODES = ("read_write", "record", "replay")
+
+    def __init__(self, path="mcq_response_cache.sqlite3", mode="read_write", ttl=None, max_entries=None, max_bytes=None):
+        if mode not in self.MODES:
+            raise ValueError(f"Unknown cache mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT, response TEXT, "
+                "created_at REAL, last_access REAL, size INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)")
+            # Entry count and total size, kept up to date by triggers so eviction never scans the table
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS cache_stats (id INTEGER PRIMARY KEY CHECK (id = 0), entries INTEGER, bytes INTEGER);"
+                "INSERT OR IGNORE INTO cache_stats SELECT 0, COUNT(*), COALESCE(SUM(size), 0) FROM responses;"
+                "CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses BEGIN "
+                "UPDATE cache_stats SET entries = entries + 1, bytes = bytes + NEW.size; END;"
+                "CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses BEGIN "
+                "UPDATE cache_stats SET entries = entries - 1, bytes = bytes - OLD.size; END;"
+                "CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses BEGIN "
+                "UPDATE cache_stats SET bytes = bytes + NEW.size - OLD.size; END;"
+            )
+
+    @staticmethod
+    def make_key(model_name, system_prompt, user_prompt, request_options, base_url=None, scope=None):
+        payload = json.dumps([model_name, system_prompt, user_prompt, request_options,
+                              base_url.rstrip("/") if base_url else None, scope], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if self.ttl is not None and now - row[1] > self.ttl:
+                with self._conn:
+                    self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            with self._conn:
+                self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def put(self, key, model_name, response):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(key) DO UPDATE SET "
+                "model = excluded.model, response = excluded.response, created_at = excluded.created_at, "
+                "last_access = excluded.last_access, size = excluded.size",
+                (key, model_name, response, now, now, len(response.encode("utf-8")))
+            )
+            self._evict()
+
+    def _evict(self):
+        """ Deletes the least recently used entries over the limits, oldest first along the last_access index """
+        entries, total = self._conn.execute("SELECT entries, bytes FROM cache_stats").fetchone()
+        if self.max_entries is not None and entries > self.max_entries:
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses ORDER BY last_access LIMIT ?)",
+                (entries - self.max_entries,)
+            )
+            total = self._conn.execute("SELECT bytes FROM cache_stats").fetchone()[0]
+        while self.max_bytes is not None and total > self.max_bytes:
+            oldest = self._conn.execute("SELECT key, size FROM responses ORDER BY last_access LIMIT 32").fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                total -= size
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def cache_limits_from_env():
+    """ max_entries and max_bytes of response caches, from USMLEGPT_CACHE_MAX_ENTRIES / USMLEGPT_CACHE_MAX_BYTES """
+    max_entries = os.environ.get("USMLEGPT_CACHE_MAX_ENTRIES")
+    max_bytes = os.environ.get("USMLEGPT_CACHE_MAX_BYTES")
+    return {"max_entries": int(max_entries) if max_entries else None, "max_bytes": int(max_bytes) if max_bytes else None}
+
+def response_cache_from_env():
+    """
+    Builds the default ResponseCache from USMLEGPT_CACHE / USMLEGPT_CACHE_MODE /
+    USMLEGPT_CACHE_TTL and the size limits of cache_limits_from_env, if set
+    """
+    path = os.environ.get("USMLEGPT_CACHE")
+    if not path:
+        return None
+    ttl = os.environ.get("USMLEGPT_CACHE_TTL")
+    return ResponseCache(path, os.environ.get("USMLEGPT_CACHE_MODE", "read_write"), float(ttl) if ttl else None,
+                         **cache_limits_from_env())
+
+default_response_cache = response_cache_from_env()
+
+def model_key(model):
+    """ (base_url, model_name) identifying an endpoint/model pair """
+    base_url = getattr(model, "base_url", None)
+    return (base_url.rstrip("/") if base_url else None, model.model_name)
+
+class ModelRouter:
+    """
+    Picks a model for roles without an explicit assignment, using per-model
+    EWMA latency, EWMA error rate and in-flight call counts shared process-wide.
+
+    Policies:
+    - "p2c": power of two choices, the better of two random candidates
+    - "least_loaded": fewest in-flight calls, ties broken by score
+    - "weighted": random choice weighted by 1 / score
+    - "random": uniform choice
+    """
+    POLICIES = ("p2c", "least_loaded", "weighted", "random")
+
+    def __init__(self, policy="p2c", alpha=0.2):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown routing policy: {policy}")
+        self.policy = policy
+        self.alpha = alpha
+        self._stats = {}  # key -> {"latency": ewma seconds or None, "error": ewma rate, "in_flight": n}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        return self._stats.setdefault(key, {"latency": None, "error": 0.0, "in_flight": 0})
+
+    def start(self, key):
+        with self._lock:
+            self._get(key)["in_flight"] += 1
+
+    def finish(self, key, latency, success):
+        with self._lock:
+            stats = self._get(key)
+            stats["in_flight"] = max(0, stats["in_flight"] - 1)
+            stats["error"] += self.alpha * ((0.0 if success else 1.0) - stats["error"])
+            if success:
+                stats["latency"] = latency if stats["latency"] is None else \
+                    stats["latency"] + self.alpha * (latency - stats["latency"])
+
+    def score(self, key):
+        """ Expected cost of sending one more call to this model; lower is better """
+        with self._lock:
+            stats = dict(self._get(key))
+        latency = stats["latency"]
+        if latency is None:
+            # Untried models look cheap so they get explored; ones that only ever failed do not
+            latency = 0.001 if stats["error"] == 0 else 1.0
+        return latency * (1 + stats["in_flight"]) / max(0.05, 1 - stats["error"])
+
+    def snapshot(self):
+        with self._lock:
+            return {key: dict(stats) for key, stats in self._stats.items()}
+
+    def choose(self, candidates, key=model_key):
+        if not candidates:
+            raise ValueError("No models configured")
+        if len(candidates) == 1 or self.policy == "random":
+            return random.choice(candidates)
+
+        if self.policy == "p2c":
+            first, second = random.sample(candidates, 2)
+            return first if self.score(key(first)) <= self.score(key(second)) else second
+        if self.policy == "least_loaded":
+            snapshot = self.snapshot()
+            return min(candidates, key=lambda c: (
+                snapshot.get(key(c), {}).get("in_flight", 0), self.score(key(c))))
+        weights = [1 / self.score(key(c)) for c in candidates]
+        return random.choices(candidates, weights=weights)[0]
+
+model_router = ModelRouter(os.environ.get("USMLEGPT_ROUTING_POLICY", "p2c"))
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute limits per
+    (base_url, model), shared by every thread and every worker process on the
+    host through a small SQLite file.
+
+    Each bucket is reserved up front: a call takes its tokens even when the
+    bucket is short and then sleeps until the deficit has refilled. Callers are
+    therefore served in the order they asked (a fair FIFO queue) instead of
+    failing or racing each other. The SQLite file is only opened once a model
+    with a limit makes its first call.
+    """
+    def __init__(self, path=None):
+        self.path = path or os.path.join(tempfile.gettempdir(), "usmlegpt_rate_limits.sqlite3")
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _reserve(self, conn, bucket, capacity, amount, now):
+        """ Takes amount from the bucket and returns the seconds until it is covered """
+        rate = capacity / 60.0
+        row = conn.execute("SELECT tokens, updated_at FROM buckets WHERE key = ?", (bucket,)).fetchone()
+        tokens = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+        tokens -= min(amount, capacity)
+        conn.execute("INSERT OR REPLACE INTO buckets VALUES (?, ?, ?)", (bucket, tokens, now))
+        return max(0.0, -tokens / rate)
+
+    def acquire(self, key, rpm=None, tpm=None, tokens=0, cancel_event=None):
+        """
+        Blocks until one request of about `tokens` tokens fits both limits and
+        returns the seconds waited. When cancel_event is set during the wait,
+        the tokens are refunded and PipelineCancelled is raised.
+        """
+        if not rpm and not tpm:
+            return 0.0
+
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            wait = 0.0
+            if rpm:
+                wait = max(wait, self._reserve(conn, f"{key}|rpm", rpm, 1, now))
+            if tpm:
+                wait = max(wait, self._reserve(conn, f"{key}|tpm", tpm, tokens, now))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if wait > 0:
+            if cancel_event is None:
+                time.sleep(wait)
+            elif cancel_event.wait(wait):
+                self.refund(key, tpm, tokens)
+                raise PipelineCancelled("MCQ development was cancelled")
+        return wait
+
+    def refund(self, key, tpm, tokens):
+        """ Returns unused reserved tokens once the real usage is known """
+        if not tpm or tokens <= 0:
+            return
+        conn = self._connect()
+        with contextlib.suppress(sqlite3.Error):
+            conn.execute(
+                "UPDATE buckets SET tokens = MIN(?, tokens + ?) WHERE key = ?",
+                (tpm, tokens, f"{key}|tpm")
+            )
+
+rate_limiter = RateLimiter(os.environ.get("USMLEGPT_RATE_LIMIT_DB"))
+
+def parse_limit(value):
+    """ Dataframe cells arrive as strings, blanks or NaN; only positive numbers are limits """
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+class AIModel:
+    def __init__(self, model_name, api_key, base_url=None, rpm=None, tpm=None):
+        if not api_key:
+            raise ValueError("API key cannot be empty")
+        if not model_name:
+            raise ValueError("Model name cannot be empty")
+            
+        self.model_name = model_name
+        self.base_url = base_url
+        # Optional client-side requests/tokens per minute limits
+        self.rpm = parse_limit(rpm)
+        self.tpm = parse_limit(tpm)
+        try:
+            self.client = client_pool.get(api_key, base_url)
+        except Exception as e:
+            raise ValueError(f"Failed to initialize OpenAI client: {str(e)}")
+
+class MCQDevelopmentSystem:
+    def __init__(self, models_config, model_semaphores=None, response_cache=None, cancel_event=None,
+                 checkpoint_store=None, run_id=None, cost_budget=None):
+        if not models_config:
+            raise ValueError("Models configuration cannot be empty")
+            
+        self.models = []
+        for config in models_config:
+            try:
+                if not config.get('api_key') or not config.get('model_name'):
+                    continue
+                self.models.append(AIModel(**config))
+            except Exception as e:
+                print(f"Failed to initialize model: {str(e)}")
+                
+        if not self.models:
+            raise ValueError("No valid models could be initialized")
+            
+        self.history = []
+        self._rendered = []
+        self._history_text = ""
+        # Optional {model_name: Semaphore} shared between systems to cap in-flight calls per model
+        self.model_semaphores = model_semaphores or {}
+        self.retry_policy = RetryPolicy()
+        # Continuation requests sent for a reply cut off at max_tokens
+        self.max_continuations = 2
+        # Every call of the run is charged here, so its cost includes repairs and rejected drafts
+        self.cost_budget = cost_budget or CostBudget(default_max_item_cost)
+        self.response_cache = response_cache or default_response_cache
+        # Set from another thread to abort the run at the next stage, retry or streamed chunk
+        self.cancel_event = cancel_event or threading.Event()
+        # MinHash of the accepted writer draft, set when a NearDuplicateIndex checked it
+        self.draft_signature = None
+        # Every new history entry is checkpointed under run_id as soon as it is added
+        self.checkpoint_store = checkpoint_store
+        self.run_id = run_id
+        # Scopes read_write cache entries of runs without a run_id to this run
+        self._cache_nonce = hashlib.sha256(f"{id(self)}{time.time()}{random.random()}".encode("utf-8")).hexdigest()[:16]
+
+    def select_model(self, role, specified_model=None):
+        if not self.models:
+            raise ValueError("No models configured")
+            
+        if specified_model:
+            selected_model = next(
+                (m for m in self.models if m.model_name == specified_model),
+                None
+            )
+            if selected_model:
+                return selected_model
+                
+        return model_router.choose(self.models)
+
+    def breaker_for(self, model):
+        return circuit_breakers.get(model.base_url, model.model_name)
+
+    def reroute(self, model):
+        """ Picks another model whose circuit is closed, or None """
+        candidates = [m for m in self.models if m is not model and self.breaker_for(m).state == "closed"]
+        return model_router.choose(candidates) if candidates else None
+
+    def call_ai_model(self, model, system_prompt, user_prompt, on_token=None, metrics=None, response_format=None,
+                      temperature=0.7, max_tokens=2000, cache_tag=None):
+        """
+        Returns the model's reply. When on_token is given the reply is streamed
+        and on_token(text_so_far) is called as tokens arrive. When a metrics dict
+        is given it is filled with timing, retry and token usage details.
+        response_format is passed through to the API for structured output.
+        A text reply cut off at max_tokens is continued and stitched together.
+        Raises BudgetExceeded when the call could cross the run's cost ceiling.
+        cache_tag (the stage and attempt) marks a sampled generation call: its
+        cache entry is scoped to this run and tag (see cache_scope). Calls
+        without one are cached by their content alone.
+        """
+        if not model or not model.client:
+            raise ModelCallError("Invalid model configuration")
+
+        self.check_cancelled()
+        metrics = metrics if metrics is not None else {}
+        metrics.update(model=model.model_name, endpoint=model.base_url, cached=False)
+        request_options = {"temperature": temperature, "max_tokens": max_tokens}
+        if response_format:
+            request_options["response_format"] = response_format
+        cache = self.response_cache
+        if not cache:
+            return self._call_with_continuations(model, system_prompt, user_prompt, request_options, on_token, metrics)
+
+        scope = [self.cache_scope(cache), cache_tag] if cache_tag is not None else None
+        cache_key = cache.make_key(model.model_name, system_prompt, user_prompt, request_options, model.base_url, scope)
+        if cache.mode != "record":
+            cached = cache.get(cache_key)
+            if cached is not None:
+                metrics.update(cached=True, latency_s=0.0, retries=0, prompt_tokens=0, completion_tokens=0)
+                if on_token:
+                    on_token(cached)
+                return cached
+        if cache.mode == "replay":
+            raise ModelCallError(f"Replay mode: no recorded response for {model.model_name} (key {cache_key[:12]})")
+
+        content = self._call_with_continuations(model, system_prompt, user_prompt, request_options, on_token, metrics)
+        if content is not None:
+            cache.put(cache_key, model.model_name, content)
+        return content
+
+    def cache_scope(self, cache):
+        """
+        Scope of sampled generation calls: the run_id, or for runs without one
+        a nonce of this system in read_write mode, so unrelated runs never
+        share sampled replies. In
+        record/replay mode such runs share entries, so a recorded session can
+        be replayed.
+        """
+        if self.run_id:
+            return self.run_id
+        return self._cache_nonce if cache.mode == "read_write" else None
+
+    def _call_with_continuations(self, model, system_prompt, user_prompt, request_options, on_token, metrics):
+        """
+        While a text reply stops at max_tokens (finish_reason "length"), asks
+        the model to continue it, up to max_continuations times, and returns the
+        stitched reply. Token counts, waits and retries in metrics add up over
+        the requests; truncated is set when the reply is still cut off.
+        """
+        started = time.perf_counter()
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        content = self._call_within_budget(model, messages, request_options, on_token, metrics)
+        continuations = 0
+        # JSON output cannot be stitched; the schema validation and repair handle it instead
+        while metrics.get("finish_reason") == "length" and "response_format" not in request_options:
+            if continuations == self.max_continuations:
+                print(f"Reply from {metrics['model']} still cut off at {request_options['max_tokens']} tokens "
+                      f"after {continuations} continuations")
+                metrics["truncated"] = True
+                break
+            continuations += 1
+            part_metrics = {}
+            stream = (lambda text, prefix=content: on_token(prefix + text)) if on_token else None
+            content += self._call_within_budget(model, messages + [
+                {"role": "assistant", "content": content},
+                {"role": "user", "content": CONTINUATION_PROMPT}
+            ], request_options, stream, part_metrics)
+            for key in ("prompt_tokens", "cached_tokens", "completion_tokens", "retries", "queue_wait_s", "rate_limit_wait_s"):
+                if part_metrics.get(key) is not None:
+                    metrics[key] = round((metrics.get(key) or 0) + part_metrics[key], 3)
+            metrics.update(model=part_metrics["model"], endpoint=part_metrics["endpoint"],
+                           finish_reason=part_metrics.get("finish_reason"))
+            if part_metrics.get("usage_estimated"):
+                metrics["usage_estimated"] = True
+        if continuations:
+            metrics["continuations"] = continuations
+            metrics["latency_s"] = round(time.perf_counter() - started, 3)
+        return content
+
+    def _call_within_budget(self, model, messages, request_options, on_token, metrics):
+        """ Holds the request's worst-case cost on the run's budget while it runs, then charges the actual cost """
+        prompt_tokens = estimate_tokens("".join(message["content"] for message in messages))
+        reserved = self.cost_budget.reserve(estimate_cost({
+            "model": model.model_name, "prompt_tokens": prompt_tokens, "completion_tokens": request_options["max_tokens"]
+        }))
+        try:
+            content = self._call_with_retries(model, messages, request_options, on_token, metrics)
+        except BaseException:
+            self.cost_budget.release(reserved)
+            raise
+        self.cost_budget.settle(reserved, estimate_cost(metrics))
+        return content
+
+    def _call_with_retries(self, model, messages, request_options, on_token, metrics):
+        policy = self.retry_policy
+        started = time.perf_counter()
+        metrics.update(queue_wait_s=0.0, retries=0)
+        for attempt in range(policy.max_attempts):
+            self.check_cancelled()
+            breaker = self.breaker_for(model)
+            if not breaker.allow_request():
+                fallback = self.reroute(model)
+                if not fallback:
+                    raise ModelCallError(f"Circuit open for {model.model_name} and no healthy model to reroute to")
+                print(f"Circuit open for {model.model_name}, rerouting to {fallback.model_name}")
+                model, breaker = fallback, self.breaker_for(fallback)
+
+            metrics.update(model=model.model_name, endpoint=model.base_url, retries=attempt)
+            attempt_started = None
+            reserved_tokens = 0
+            try:
+                request = dict(model=model.model_name, messages=messages, **request_options)
+                # Wait for our turn under the model's RPM/TPM limits, reserving the worst-case token count
+                prompt_text = "".join(message["content"] for message in messages)
+                tokens = estimate_tokens(prompt_text) + request_options["max_tokens"]
+                rate_limit_wait = rate_limiter.acquire(model_key(model), model.rpm, model.tpm, tokens, self.cancel_event)
+                reserved_tokens = tokens
+                metrics["rate_limit_wait_s"] = round(metrics.get("rate_limit_wait_s", 0.0) + rate_limit_wait, 3)
+                metrics["queue_wait_s"] += rate_limit_wait
+
+                wait_started = time.perf_counter()
+                with self.model_semaphores.get(model.model_name, contextlib.nullcontext()):
+                    metrics["queue_wait_s"] += time.perf_counter() - wait_started
+                    attempt_started = time.perf_counter()
+                    model_router.start(model_key(model))
+                    if on_token:
+                        content = self._stream_completion(model, request, on_token, metrics)
+                    else:
+                        response = model.client.chat.completions.create(**request)
+                        if not response or not response.choices:
+                            raise ValueError("Empty response from API")
+                        content = response.choices[0].message.content
+                        metrics["finish_reason"] = response.choices[0].finish_reason
+                        metrics.update(usage_metrics(getattr(response, "usage", None)))
+
+                model_router.finish(model_key(model), time.perf_counter() - attempt_started, True)
+                breaker.record_success()
+                if metrics.get("prompt_tokens") is None:
+                    metrics.update(
+                        prompt_tokens=estimate_tokens(prompt_text),
+                        completion_tokens=estimate_tokens(content or ""),
+                        usage_estimated=True
+                    )
+                used_tokens = (metrics["prompt_tokens"] or 0) + (metrics.get("completion_tokens") or 0)
+                rate_limiter.refund(model_key(model), model.tpm, reserved_tokens - used_tokens)
+                metrics["queue_wait_s"] = round(metrics["queue_wait_s"], 3)
+                metrics["latency_s"] = round(time.perf_counter() - started, 3)
+                return content
+
+            except PipelineCancelled:
+                if attempt_started is not None:
+                    model_router.finish(model_key(model), time.perf_counter() - attempt_started, True)
+                rate_limiter.refund(model_key(model), model.tpm, reserved_tokens)
+                breaker.release_trial()
+                raise
+            except Exception as e:
+                if attempt_started is not None:
+                    model_router.finish(model_key(model), time.perf_counter() - attempt_started, False)
+                # A failed attempt gives its token reservation back; its request still counts against RPM
+                rate_limiter.refund(model_key(model), model.tpm, reserved_tokens)
+                print(f"Attempt {attempt + 1} with {model.model_name} failed: {str(e)}")
+                if not policy.is_retryable(e):
+                    # A request-specific error (context length, unsupported response_format) says nothing
+                    # about the endpoint's health; it only hands back a half-open trial
+                    breaker.release_trial()
+                    raise ModelCallError(f"{model.model_name}: {str(e)}") from e
+                breaker.record_failure()
+                if attempt == policy.max_attempts - 1:
+                    raise ModelCallError(
+                        f"Unable to get response from {model.model_name} after {policy.max_attempts} attempts: {str(e)}"
+                    ) from e
+                self.cancel_event.wait(policy.backoff(attempt, e))
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise PipelineCancelled("MCQ development was cancelled")
+
+    def _stream_completion(self, model, request, on_token, metrics):
+        text = ""
+        sent = time.perf_counter()
+        stream = model.client.chat.completions.create(
+            stream=True, stream_options={"include_usage": True}, **request
+        )
+        for chunk in stream:
+            if self.cancel_event.is_set():
+                # Closing the stream drops the HTTP connection so the provider stops generating
+                stream.close()
+                self.check_cancelled()
+            if getattr(chunk, "usage", None):
+                metrics.update(usage_metrics(chunk.usage))
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.finish_reason:
+                metrics["finish_reason"] = choice.finish_reason
+            delta = choice.delta.content
+            if delta:
+                if not text:
+                    metrics["ttft_s"] = round(time.perf_counter() - sent, 3)
+                text += delta
+                on_token(text)
+
+        if not text:
+            raise ValueError("Empty response from API")
+        return text
+
+    def call_ai_model_json(self, model, system_prompt, user_prompt, schema, schema_name="response",
+                           validator=None, max_repairs=2, metrics=None):
+        """
+        Asks for JSON matching schema and returns (data, errors). Uses a JSON
+        schema response_format where the endpoint supports it, falling back to
+        JSON mode and then plain text. Invalid output is fixed with short repair
+        calls that only carry the validation errors and the invalid JSON.
+        validator(data) -> errors defaults to validate_json against schema.
+        """
+        validator = validator or (lambda data: validate_json(data, schema))
+        key = model_key(model)
+        modes = [mode for mode in STRUCTURED_OUTPUT_MODES if mode not in unsupported_output_modes.get(key, set())]
+        for mode in modes:
+            response_format = structured_response_format(mode, schema, schema_name)
+            try:
+                content = self.call_ai_model(model, system_prompt, user_prompt, metrics=metrics,
+                                             response_format=response_format)
+                break
+            except ModelCallError as e:
+                import openai
+
+                if mode == "text" or not isinstance(e.__cause__, openai.BadRequestError):
+                    raise
+                print(f"{model.model_name} rejected {mode} output, falling back")
+                unsupported_output_modes.setdefault(key, set()).add(mode)
+
+        data, errors = parse_json_response(content, validator)
+        for attempt in range(max_repairs):
+            if not errors:
+                break
+            print(f"Structured output failed validation ({'; '.join(errors[:5])}), repair attempt {attempt + 1}")
+            repair_prompt = f"""The JSON below does not match the required schema.
+
+Validation errors:
+{chr(10).join("- " + error for error in errors)}
+
+JSON:
+{json.dumps(data, ensure_ascii=False) if data is not None else content}
+
+Return only the corrected JSON, changing nothing but what the errors require."""
+            content = self.call_ai_model(model, "You fix JSON so it matches a schema. Output valid JSON only.",
+                                         repair_prompt, response_format=response_format)
+            data, errors = parse_json_response(content, validator)
+        return data, errors
+
+    def add_to_history(self, role, content, version, metrics=None):
+        self.restore_history(self.finish_stage([(role, content, version, metrics)]))
+        return self.history
+
+    def finish_stage(self, entries):
+        """
+        Builds the history entries of a finished stage from add_to_history
+        arguments and checkpoints them right away, before the stages ahead of
+        it in the graph are done; restore_history adds them in stage order
+        """
+        built = []
+        for role, content, version, metrics in entries:
+            entry = {
+                "timestamp": str(datetime.datetime.now()),
+                "role": role,
+                "content": content,
+                "version": version
+            }
+            if metrics is not None:
+                metrics["cost_usd"] = estimate_cost(metrics)
+                entry["metrics"] = metrics
+                emit_metrics(role, metrics)
+            built.append(entry)
+        if self.checkpoint_store and built:
+            self.checkpoint_store.save_stage(self.run_id, built)
+        return built
+
+    def restore_history(self, entries):
+        """
+        Loads checkpointed entries so develop_mcq only runs the stages that are
+        missing. The history stays in stage order (by version), also when a
+        stage is rerun after later stages were restored.
+        """
+        entries = list(entries)
+        if self.history and any(entry["version"] < self.history[-1]["version"] for entry in entries):
+            entries = sorted(self.history + entries, key=lambda entry: entry["version"])
+            self.history.clear()
+            self._rendered.clear()
+            self._history_text = ""
+        for entry in entries:
+            self._append(entry)
+        return self.history
+
+    def _append(self, entry):
+        self.history.append(entry)
+        role = entry["role"]
+
+        # Render each entry once and append it, instead of rebuilding the transcript per stage.
+        # Prompt context leaves out timestamps so identical content gives identical prompts.
+        rendered = render_history_entry(entry)
+        context = render_history_entry(entry, with_timestamp=False)
+        self._rendered.append({"role": role, "text": context, "tokens": estimate_tokens(context)})
+        self._history_text = f"{self._history_text}\n{rendered}" if self._history_text else rendered
+
+    def get_history(self):
+        return self.history
+
+    def get_history_as_text(self):
+        if not self.history:
+            return "No history available."
+        return self._history_text
+
+    def get_context(self, stage):
+        """
+        Renders the history a stage is allowed to see according to
+        STAGE_CONTEXT_POLICIES. When the selected entries exceed the policy's
+        token budget, the oldest entries after the draft are dropped first and
+        a note lists what was left out.
+        """
+        policy = STAGE_CONTEXT_POLICIES.get(stage, {})
+        roles = policy.get("roles")
+        budget = policy.get("max_tokens", DEFAULT_CONTEXT_TOKENS)
+
+        selected = [r for r in self._rendered if not roles or role_matches(r["role"], roles)]
+        if not selected:
+            return "No history available."
+
+        total = sum(r["tokens"] for r in selected)
+        omitted = []
+        while total > budget and len(selected) > 2:
+            dropped = selected.pop(1)
+            omitted.append(dropped["role"])
+            total -= dropped["tokens"]
+
+        parts = [r["text"] for r in selected]
+        if omitted:
+            parts.insert(1, f"[{len(omitted)} earlier entries omitted to fit the context budget: {', '.join(omitted)}]\n")
+        text = "\n".join(parts)
+
+        if estimate_tokens(text) > budget:
+            # Still too long: keep the beginning (the draft) and the most recent output
+            half = budget * CHARS_PER_TOKEN // 2
+            text = f"{text[:half]}\n[... truncated to fit the context budget ...]\n{text[-half:]}"
+        return text
+
+# Sent after a reply that stopped at max_tokens; the continuation is appended to it as is
+CONTINUATION_PROMPT = "Your reply was cut off. Continue exactly where it stopped, without repeating or summarizing anything."
+
+# Rough characters-per-token ratio used to estimate prompt size without a tokenizer
+CHARS_PER_TOKEN = 4
+DEFAULT_CONTEXT_TOKENS = 6000
+
+# Which history entries each stage sees, and how many tokens of it at most.
+# Roles match exactly or by prefix, so "Reviewer" covers "Reviewer 1" to "Reviewer 3".
+STAGE_CONTEXT_POLICIES = {
+    "reviewer": {"roles": ["Item Writer"], "max_tokens": DEFAULT_CONTEXT_TOKENS},
+    "editor": {"roles": ["Item Writer", "Reviewer"], "max_tokens": DEFAULT_CONTEXT_TOKENS},
+    # Author Revision / Final Editorial Decision entries only exist here from the second revision round on
+    "revision": {"roles": ["Item Writer", "Editorial Staff", "Author Revision", "Final Editorial Decision"], "max_tokens": DEFAULT_CONTEXT_TOKENS},
+    "final_decision": {"roles": ["Item Writer", "Editorial Staff", "Author Revision", "Final Editorial Decision"], "max_tokens": DEFAULT_CONTEXT_TOKENS},
+}
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def role_matches(role, roles):
+    return any(role == r or role.startswith(r + " ") for r in roles)
+
+def render_history_entry(entry, with_timestamp=True):
+    prefix = f"[{entry['timestamp']}] " if with_timestamp else ""
+    return (
+        f"{prefix}{entry['role']} (Version {entry['version']}):\n"
+        f"{entry['content']}\n"
+    )
+
+def usage_metrics(usage):
+    """
+    Token counts from an OpenAI usage object, if the endpoint returned one.
+    cached_tokens is the part of the prompt served from the provider's prefix
+    cache (OpenAI prompt_tokens_details, or DeepSeek's prompt_cache_hit_tokens).
+    """
+    if not usage:
+        return {}
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    return {
+        "prompt_tokens": getattr(usage, "prompt_tokens", None),
+        "completion_tokens": getattr(usage, "completion_tokens", None),
+        "cached_tokens": cached
+    }
+
+def load_model_prices():
+    """
+    Optional USD prices per million tokens, from the JSON file named by
+    USMLEGPT_MODEL_PRICES: {"model_name": {"input": 2.5, "output": 10.0}}.
+    An optional "cached_input" price applies to prompt tokens served from the
+    provider's prefix cache.
+    """
+    path = os.environ.get("USMLEGPT_MODEL_PRICES")
+    if not path:
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"Failed to load model prices: {str(e)}")
+        return {}
+
+MODEL_PRICES = load_model_prices()
+
+def estimate_cost(metrics):
+    price = MODEL_PRICES.get(metrics.get("model"))
+    if not price or metrics.get("prompt_tokens") is None:
+        return None
+    cached = min(metrics.get("cached_tokens") or 0, metrics["prompt_tokens"])
+    return round(
+        ((metrics["prompt_tokens"] - cached) * price.get("input", 0)
+         + cached * price.get("cached_input", price.get("input", 0))
+         + (metrics.get("completion_tokens") or 0) * price.get("output", 0)) / 1_000_000,
+        6
+    )
+
+class CostBudget:
+    """
+    USD spent by one run, or by all runs of a batch when it is the parent of
+    their budgets, with an optional hard ceiling. reserve() holds a request's
+    worst-case cost (its prompt plus max_tokens) before it is sent and raises
+    BudgetExceeded if that could cross the ceiling of this budget or a parent;
+    settle() swaps the hold for the actual cost. Requests to models without a
+    price in USMLEGPT_MODEL_PRICES cost nothing here.
+    """
+    def __init__(self, limit_usd=None, parent=None, spent=0.0):
+        self.limit_usd = limit_usd
+        self.parent = parent
+        self.spent = spent
+        self.reserved = 0.0
+        self.calls = 0
+        self.refused = False
+        self._lock = threading.Lock()
+
+    def reserve(self, amount):
+        amount = amount or 0.0
+        if self.parent:
+            self.parent.reserve(amount)
+        with self._lock:
+            fits = self.limit_usd is None or self.spent + self.reserved + amount <= self.limit_usd
+            if fits:
+                self.reserved += amount
+            else:
+                self.refused = True
+        if not fits:
+            if self.parent:
+                self.parent.release(amount)
+            raise BudgetExceeded(f"Cost ceiling of ${self.limit_usd} reached "
+                                 f"(${self.spent:.4f} spent, next request may cost up to ${amount:.4f})")
+        return amount
+
+    def settle(self, reserved, cost):
+        with self._lock:
+            self.reserved -= reserved
+            self.spent = round(self.spent + (cost or 0.0), 6)
+            self.calls += 1
+        if self.parent:
+            self.parent.settle(reserved, cost)
+
+    def release(self, reserved):
+        """ Drops a hold whose request failed """
+        with self._lock:
+            self.reserved -= reserved
+        if self.parent:
+            self.parent.release(reserved)
+
+    @property
+    def exhausted(self):
+        """ True once the ceiling is reached or a request was refused for lack of room """
+        return self.refused or (self.limit_usd is not None and self.spent >= self.limit_usd)
+
+# Ceiling in USD for each web app run (and any run not given its own budget)
+default_max_item_cost = float(os.environ["USMLEGPT_MAX_ITEM_COST"]) if os.environ.get("USMLEGPT_MAX_ITEM_COST") else None
+
+# Callables receiving (role, metrics) for every finished stage, see register_metrics_hook
+metrics_hooks = []
+
+def register_metrics_hook(hook):
+    metrics_hooks.append(hook)
+    return hook
+
+def emit_metrics(role, metrics):
+    for hook in list(metrics_hooks):
+        try:
+            hook(role, metrics)
+        except Exception as e:
+            print(f"Metrics hook failed: {str(e)}")
+
+class PrometheusMetrics:
+    """
+    Metrics hook that aggregates stage metrics per role and model and renders
+    them in the Prometheus text exposition format, optionally over HTTP.
+    """
+    COUNTERS = {
+        "calls": "Model calls",
+        "retries": "Retried attempts",
+        "latency_seconds": "Total model call latency",
+        "queue_wait_seconds": "Total time waiting for a model slot",
+        "prompt_tokens": "Prompt tokens used",
+        "cached_tokens": "Prompt tokens served from the provider's prefix cache",
+        "completion_tokens": "Completion tokens used",
+        "cost_usd": "Estimated cost in USD"
+    }
+
+    def __init__(self, prefix="usmlegpt"):
+        self.prefix = prefix
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, role, metrics):
+        key = (role.rstrip("0123456789 "), metrics.get("model") or "", metrics.get("finish_reason") or "")
+        with self._lock:
+            values = self._values.setdefault(key, dict.fromkeys(self.COUNTERS, 0))
+            values["calls"] += 1
+            values["retries"] += metrics.get("retries") or 0
+            values["latency_seconds"] += metrics.get("latency_s") or 0
+            values["queue_wait_seconds"] += metrics.get("queue_wait_s") or 0
+            values["prompt_tokens"] += metrics.get("prompt_tokens") or 0
+            values["cached_tokens"] += metrics.get("cached_tokens") or 0
+            values["completion_tokens"] += metrics.get("completion_tokens") or 0
+            values["cost_usd"] += metrics.get("cost_usd") or 0
+
+    def render(self):
+        lines = []
+        with self._lock:
+            for name, help_text in self.COUNTERS.items():
+                metric = f"{self.prefix}_{name}_total"
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for (role, model, finish_reason), values in self._values.items():
+                    labels = f'role="{role}",model="{model}",finish_reason="{finish_reason}"'
+                    lines.append(f"{metric}{{{labels}}} {values[name]}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port=9464, host="0.0.0.0"):
+        """ Serves render() at /metrics on a background thread """
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        collector = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = collector.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+class OpenTelemetryHook:
+    """ Metrics hook that records one span per stage through the opentelemetry-api package """
+    def __init__(self, tracer_name="usmlegpt"):
+        try:
+            from opentelemetry import trace
+        except ImportError:
+            raise ImportError("OpenTelemetryHook requires the opentelemetry-api package")
+        self.tracer = trace.get_tracer(tracer_name)
+
+    def __call__(self, role, metrics):
+        end_ns = time.time_ns()
+        start_ns = end_ns - int((metrics.get("latency_s") or 0) * 1e9)
+        span = self.tracer.start_span(f"mcq.{role}", start_time=start_ns)
+        for name, value in metrics.items():
+            if value is not None:
+                span.set_attribute(f"mcq.{name}", value)
+        span.end(end_time=end_ns)
+
+def summarize_metrics(history):
+    """ Per-stage and total latency/token/cost breakdown of a development history """
+    stages = []
+    totals = {"latency_s": 0.0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0, "retries": 0, "cost_usd": None}
+    for entry in history:
+        metrics = entry.get("metrics")
+        if not metrics:
+            continue
+        stages.append({"role": entry["role"], **metrics})
+        totals["latency_s"] += metrics.get("latency_s") or 0
+        totals["prompt_tokens"] += metrics.get("prompt_tokens") or 0
+        totals["cached_tokens"] += metrics.get("cached_tokens") or 0
+        totals["completion_tokens"] += metrics.get("completion_tokens") or 0
+        totals["retries"] += metrics.get("retries") or 0
+        if metrics.get("cost_usd") is not None:
+            totals["cost_usd"] = round((totals["cost_usd"] or 0) + metrics["cost_usd"], 6)
+    totals["latency_s"] = round(totals["latency_s"], 3)
+    return {"stages": stages, "total": totals}
+
+# The decision phrases themselves, so "the revised item" or "this revision" is no verdict.
+# A negated acceptance ("not acceptable", "cannot be accepted") starts left of its
+# "accept", so the search finds it first.
+FINAL_DECISION_PATTERN = re.compile(
+    r'\b(?:(?P<not_accepted>(?:not|cannot|can\'t|never)\s+(?:\w+\s+){0,2}?accept(?:s|ed|able)?|unaccept(?:ed|able))'
+    r'|(?P<accepted>accept(?:s|ed|able)?)|(?P<rejected>reject(?:s|ed)?)'
+    r'|(?P<revise>revise|request(?:s|ed|ing)?\s+(?:\w+\s+){0,2}?revisions?'
+    r'|(?:needs|requires)\s+(?:\w+\s+)?revisions?|revisions?\s+(?:are\s+|is\s+)?(?:requested|required|needed)))\b',
+    re.IGNORECASE
+)
+
+def first_final_decision(text):
+    """
+    The first verdict in text. After a negated acceptance an explicit
+    rejection or revision request wins; without one the item is rejected.
+    """
+    negated = False
+    for match in FINAL_DECISION_PATTERN.finditer(text):
+        if match.lastgroup == "not_accepted":
+            negated = True
+        elif not negated or match.lastgroup != "accepted":
+            return match.lastgroup
+    return "rejected" if negated else None
+
+def parse_final_decision(text):
+    """ "accepted", "revise" or "rejected" from the final editorial decision, or None """
+    if not text:
+        return None
+    # Prefer the first verdict after a "Decision" label, since replies often restate all three choices
+    lines = text.splitlines()
+    for position, line in enumerate(lines):
+        if "decision" in line.lower():
+            rest = line[line.lower().index("decision") + len("decision"):]
+            # A label on a line of its own ("**Final Decision:**") has its verdict on the next one
+            following = next((later for later in lines[position + 1:] if later.strip()), "")
+            decision = first_final_decision(rest if rest.strip(" :*#-") else following)
+            if decision:
+                return decision
+    return first_final_decision(text)
+
+def summarize_item(history):
+    """
+    The final editorial decision, parsed final version and metric totals of
+    one development history, as stored by ItemStore and written by exports.
+    """
+    history = [entry for entry in history or [] if entry.get("role")]
+    _, final_entry = find_draft_and_final(history)
+    final = parse_mcq_item(final_entry["content"])[0] if final_entry else None
+    decision_entry = next((entry for entry in reversed(history)
+                           if role_matches(entry["role"], ["Final Editorial Decision"])), None)
+    totals = summarize_metrics(history)["total"]
+    return {
+        "decision": parse_final_decision(decision_entry["content"]) if decision_entry else None,
+        "question": final["question"] if final else None,
+        "options": final["options"] if final else None,
+        "correct_answer": final["correct_answer"] if final else None,
+        "final_content": final_entry["content"] if final_entry else None,
+        "latency_s": totals["latency_s"],
+        "prompt_tokens": totals["prompt_tokens"],
+        "completion_tokens": totals["completion_tokens"],
+        "cost_usd": totals["cost_usd"]
+    }
+
+class ItemStore:
+    """
+    SQLite store for finished runs: one row per item with its final decision,
+    parsed final version and metric totals, the discipline/system/competency
+    tags, and every stage with the model that produced it. Items are indexed by
+    tag, model and decision, and their text is searchable through FTS5.
+    query() streams rows from its own connection so exports never load the
+    whole store into memory.
+    """
+    TAG_KINDS = ("discipline", "system", "competency")
+
+    def __init__(self, path="mcq_items.sqlite3"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS items ("
+                "id INTEGER PRIMARY KEY, created_at REAL, status TEXT, error TEXT, decision TEXT, "
+                "disciplines TEXT, systems TEXT, competencies TEXT, keywords TEXT, "
+                "question TEXT, options TEXT, correct_answer TEXT, "
+                "latency_s REAL, prompt_tokens INTEGER, completion_tokens INTEGER, cost_usd REAL, minhash BLOB);"
+                "CREATE TABLE IF NOT EXISTS item_tags (item_id INTEGER, kind TEXT, value TEXT);"
+                "CREATE TABLE IF NOT EXISTS item_stages ("
+                "item_id INTEGER, position INTEGER, role TEXT, version TEXT, timestamp TEXT, "
+                "model TEXT, endpoint TEXT, content TEXT, metrics TEXT);"
+                "CREATE INDEX IF NOT EXISTS idx_items_decision ON items(decision, id);"
+                "CREATE INDEX IF NOT EXISTS idx_item_tags ON item_tags(kind, value, item_id);"
+                "CREATE INDEX IF NOT EXISTS idx_item_stages_item ON item_stages(item_id, position);"
+                "CREATE INDEX IF NOT EXISTS idx_item_stages_model ON item_stages(model, item_id);"
+                "CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(question, content);"
+            )
+
+    def save_run(self, history, disciplines=None, systems=None, competencies=None, keywords="", status="ok", error=None,
+                 signature=None):
+        """
+        Stores one development history and returns the new item id. signature
+        is the draft's NearDuplicateIndex MinHash, kept so the index can be
+        rebuilt without rehashing every item.
+        """
+        history = [entry for entry in history or [] if entry.get("role")]
+        summary = summarize_item(history)
+        tags = {"discipline": disciplines or [], "system": systems or [], "competency": competencies or []}
+
+        with self._lock, self._conn:
+            item_id = self._conn.execute(
+                "INSERT INTO items (created_at, status, error, decision, disciplines, systems, competencies, "
+                "keywords, question, options, correct_answer, latency_s, prompt_tokens, completion_tokens, cost_usd, "
+                "minhash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), status, error, summary["decision"],
+                 json.dumps(tags["discipline"]), json.dumps(tags["system"]), json.dumps(tags["competency"]),
+                 keywords or "", summary["question"],
+                 json.dumps(summary["options"]) if summary["options"] is not None else None,
+                 summary["correct_answer"],
+                 summary["latency_s"], summary["prompt_tokens"], summary["completion_tokens"], summary["cost_usd"],
+                 signature_bytes(signature) if signature is not None else None)
+            ).lastrowid
+            self._conn.executemany(
+                "INSERT INTO item_tags VALUES (?, ?, ?)",
+                [(item_id, kind, value) for kind in self.TAG_KINDS for value in tags[kind]]
+            )
+            self._conn.executemany(
+                "INSERT INTO item_stages VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(item_id, position, entry["role"], str(entry.get("version")), entry.get("timestamp"),
+                  (entry.get("metrics") or {}).get("model"), (entry.get("metrics") or {}).get("endpoint"),
+                  entry.get("content"), json.dumps(entry.get("metrics")) if entry.get("metrics") else None)
+                 for position, entry in enumerate(history)]
+            )
+            self._conn.execute(
+                "INSERT INTO items_fts (rowid, question, content) VALUES (?, ?, ?)",
+                (item_id, summary["question"] or "", summary["final_content"] or "")
+            )
+        return item_id
+
+    def _where(self, status=None, decision=None, discipline=None, system=None, competency=None, model=None, text=None):
+        clauses, params = [], []
+        if status:
+            clauses.append("items.status = ?")
+            params.append(status)
+        if decision:
+            clauses.append("items.decision = ?")
+            params.append(decision)
+        for kind, value in (("discipline", discipline), ("system", system), ("competency", competency)):
+            if value:
+                clauses.append("items.id IN (SELECT item_id FROM item_tags WHERE kind = ? AND value = ?)")
+                params.extend([kind, value])
+        if model:
+            clauses.append("items.id IN (SELECT item_id FROM item_stages WHERE model = ?)")
+            params.append(model)
+        if text:
+            self.check_text_query(text)
+            clauses.append("items.id IN (SELECT rowid FROM items_fts WHERE items_fts MATCH ?)")
+            params.append(text)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def check_text_query(self, text):
+        """ Raises ValueError when text is not a valid FTS5 query """
+        try:
+            with self._lock:
+                self._conn.execute("SELECT rowid FROM items_fts WHERE items_fts MATCH ? LIMIT 1", (text,)).fetchall()
+        except sqlite3.OperationalError as e:
+            raise ValueError(f"Invalid full-text query {text!r}: {e}. Put phrases in double quotes, "
+                             "e.g. '\"myocardial infarction\"'") from e
+
+    def iter_signatures(self):
+        """ Yields (item_id, minhash signature) for every item saved with one """
+        import numpy as np
+
+        conn = sqlite3.connect(self.path)
+        try:
+            for item_id, blob in conn.execute("SELECT id, minhash FROM items WHERE minhash IS NOT NULL ORDER BY id"):
+                yield item_id, np.frombuffer(blob, dtype=np.uint64)
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _row_to_item(row):
+        item = dict(row)
+        item.pop("minhash", None)
+        for column in ("disciplines", "systems", "competencies", "options"):
+            if item[column] is not None:
+                item[column] = json.loads(item[column])
+        return item
+
+    def query(self, with_history=False, limit=None, after_id=None, **filters):
+        """
+        Yields matching items as dicts, oldest first. Filters: status, decision,
+        discipline, system, competency, model (used by any stage) and text (an
+        FTS5 query over the final question and revision; ValueError when it is
+        malformed). Rows are read lazily
+        from a separate connection, so the result can be far larger than memory.
+        """
+        where, params = self._where(**filters)
+        if after_id is not None:
+            where += (" AND " if where else " WHERE ") + "items.id > ?"
+            params.append(after_id)
+        sql = f"SELECT * FROM items{where} ORDER BY items.id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        conn = sqlite3.connect(self.path)
+        conn.row_factory = sqlite3.Row
+        try:
+            for row in conn.execute(sql, params):
+                item = self._row_to_item(row)
+                if with_history:
+                    item["history"] = self._stages(conn, item["id"])
+                yield item
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _stages(conn, item_id):
+        return [
+            {"timestamp": timestamp, "role": role, "content": content, "version": version,
+             **({"metrics": json.loads(metrics)} if metrics else {})}
+            for timestamp, role, content, version, metrics in conn.execute(
+                "SELECT timestamp, role, content, version, metrics FROM item_stages "
+                "WHERE item_id = ? ORDER BY position", (item_id,))
+        ]
+
+    def get(self, item_id):
+        """ One item with its full history, or None """
+        with self._lock:
+            self._conn.row_factory = sqlite3.Row
+            try:
+                row = self._conn.execute("SELECT * FROM items WHERE id = ?", (item_id,)).fetchone()
+                if row is None:
+                    return None
+                item = self._row_to_item(row)
+                item["history"] = self._stages(self._conn, item_id)
+                return item
+            finally:
+                self._conn.row_factory = None
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM items{where}", params).fetchone()[0]
+
+    def cell_counts(self):
+        """
+        {(discipline, system, competency): (attempts, accepted)} over every
+        tag combination of the stored items. Items that failed with an error
+        or were stopped by a cost ceiling say nothing about acceptance and are
+        not counted.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT d.value, s.value, c.value, COUNT(*), SUM(items.decision = 'accepted') FROM items "
+                "JOIN item_tags d ON d.item_id = items.id AND d.kind = 'discipline' "
+                "JOIN item_tags s ON s.item_id = items.id AND s.kind = 'system' "
+                "JOIN item_tags c ON c.item_id = items.id AND c.kind = 'competency' "
+                "WHERE items.status NOT IN ('error', 'over_budget') GROUP BY d.value, s.value, c.value").fetchall()
+        return {(discipline, system, competency): (attempts, accepted or 0)
+                for discipline, system, competency, attempts, accepted in rows}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+default_item_store = ItemStore(os.environ["USMLEGPT_STORE"]) if os.environ.get("USMLEGPT_STORE") else None
+
+MINHASH_PRIME = (1 << 61) - 1
+
+def signature_bytes(signature):
+    import numpy as np
+
+    return np.asarray(signature, dtype=np.uint64).tobytes()
+
+def dedup_text(text):
+    """ The stem and options of an item (or the raw text if it does not parse), lowercased words only """
+    item = parse_mcq_item(text)[0] if text else None
+    if item:
+        text = " ".join([item["question"]] + item["options"])
+    return re.findall(r"[a-z0-9]+", (text or "").lower())
+
+class NearDuplicateIndex:
+    """
+    MinHash/LSH index of items over word shingles of their stem and options.
+    Signatures are split into bands; items sharing any band are candidates and
+    are confirmed when their estimated Jaccard similarity reaches threshold.
+    Adding and querying only touch a handful of buckets, so both stay fast
+    with tens of thousands of items. numpy is imported, and an index from a
+    store is filled, on first use rather than when the index is created.
+    """
+
+    def __init__(self, threshold=0.8, num_perm=128, bands=16, shingle_size=3, seed=1):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.seed = seed
+        self._a = self._b = None
+        self._item_store = None
+        self._buckets = [{} for _ in range(bands)]
+        self._signatures = {}
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, item_store, **kwargs):
+        """ An index over every signature saved in item_store, read on the first check """
+        index = cls(**kwargs)
+        index._item_store = item_store
+        return index
+
+    def _ensure_loaded(self):
+        if self._a is not None:
+            return
+        import numpy as np
+
+        with self._load_lock:
+            if self._a is not None:
+                return
+            if self._item_store is not None:
+                for item_id, signature in self._item_store.iter_signatures():
+                    if len(signature) == self.num_perm:
+                        self._insert(("item", item_id), signature, self._band_keys(signature))
+            # Shingle hashes are 32-bit and a, b < 2**32, so a * h + b fits in uint64 before the modulo
+            rng = np.random.RandomState(self.seed)
+            a = rng.randint(1, 2**32, size=self.num_perm, dtype=np.uint64)
+            self._b = rng.randint(0, 2**32, size=self.num_perm, dtype=np.uint64)
+            # Set last: a non-None _a marks the index as ready
+            self._a = a
+
+    def signature(self, text):
+        import numpy as np
+
+        self._ensure_loaded()
+        words = dedup_text(text)
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = np.fromiter(
+            (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=4).digest(), "big") for shingle in shingles),
+            dtype=np.uint64, count=len(shingles))
+        return ((np.outer(hashes, self._a) + self._b) % np.uint64(MINHASH_PRIME)).min(axis=0)
+
+    def _band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def _matches(self, signature, band_keys):
+        import numpy as np
+
+        candidates = set()
+        for band, band_key in enumerate(band_keys):
+            candidates.update(self._buckets[band].get(band_key, ()))
+        matches = []
+        for key in candidates:
+            similarity = float(np.count_nonzero(signature == self._signatures[key])) / self.num_perm
+            if similarity >= self.threshold:
+                matches.append((key, round(similarity, 3)))
+        return sorted(matches, key=lambda match: -match[1])
+
+    def _as_signature(self, text, signature):
+        import numpy as np
+
+        self._ensure_loaded()
+        return self.signature(text) if signature is None else np.asarray(signature, dtype=np.uint64)
+
+    def add(self, key, text=None, signature=None):
+        signature = self._as_signature(text, signature)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            self._insert(key, signature, band_keys)
+        return signature
+
+    def _insert(self, key, signature, band_keys):
+        self._signatures[key] = signature
+        for band, band_key in enumerate(band_keys):
+            self._buckets[band].setdefault(band_key, []).append(key)
+
+    def query(self, text=None, signature=None):
+        """ [(key, similarity)] of indexed items at or above the threshold, most similar first """
+        signature = self._as_signature(text, signature)
+        with self._lock:
+            return self._matches(signature, self._band_keys(signature))
+
+    def check_and_add(self, key, text):
+        """
+        Returns (near-duplicates, signature) for text; text is only added when
+        there are no near-duplicates. Checking and adding happen under one lock, so concurrent pipelines
+        cannot both accept the same vignette.
+        """
+        signature = self.signature(text)
+        band_keys = self._band_keys(signature)
+        with self._lock:
+            matches = self._matches(signature, band_keys)
+            if not matches:
+                self._insert(key, signature, band_keys)
+        return matches, signature
+
+    def __len__(self):
+        self._ensure_loaded()
+        return len(self._signatures)
+
+# Built lazily: the store's signatures are read on the first duplicate check, not at import
+default_duplicate_index = NearDuplicateIndex.from_store(
+    default_item_store, threshold=float(os.environ.get("USMLEGPT_DEDUP_THRESHOLD", 0.8))
+) if default_item_store else None
+
+class CheckpointStore:
+    """
+    SQLite checkpoints of pipeline runs. The history entries of a stage are
+    written as soon as it completes, together with the run's parameters (never
+    the API keys), so a failed, cancelled or killed run can be resumed from its
+    first missing stage without paying for the completed ones again. Stages may
+    finish out of order; load_run returns the history in stage order.
+
+    A run in progress touches its updated_at every heartbeat_interval seconds
+    (see checkpoint_outcome). A "running" run silent for stale_after seconds
+    was interrupted (its process died); until then it is live and is neither
+    listed by resumable_runs nor resumed, so two copies never run its stages.
+    A run stopped by its own cost ceiling ends "over_budget" and, like "done"
+    and "rejected" runs, is not run again.
+    """
+    FINISHED = ("done", "rejected", "over_budget")
+
+    def __init__(self, path="mcq_checkpoints.sqlite3", heartbeat_interval=30, stale_after=120):
+        self.path = path
+        self.heartbeat_interval = heartbeat_interval
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(
+                "CREATE TABLE IF NOT EXISTS runs ("
+                "run_id TEXT PRIMARY KEY, created_at REAL, updated_at REAL, status TEXT, error TEXT, params TEXT);"
+                "CREATE TABLE IF NOT EXISTS run_stages (run_id TEXT, position INTEGER, entry TEXT);"
+                "CREATE INDEX IF NOT EXISTS idx_run_stages ON run_stages(run_id, position);"
+                "CREATE INDEX IF NOT EXISTS idx_runs_status ON runs(status, updated_at);"
+            )
+
+    def start_run(self, params, run_id=None):
+        """ Registers a run (or reopens an existing one) as running and returns its id """
+        run_id = run_id or hashlib.sha256(f"{time.time()}{random.random()}".encode("utf-8")).hexdigest()[:16]
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO runs VALUES (?, ?, ?, 'running', NULL, ?) "
+                "ON CONFLICT(run_id) DO UPDATE SET status = 'running', error = NULL, updated_at = excluded.updated_at",
+                (run_id, now, now, json.dumps(params, ensure_ascii=False))
+            )
+        return run_id
+
+    def save_stage(self, run_id, entries):
+        """ Appends the entries of one finished stage in a single transaction """
+        with self._lock, self._conn:
+            for entry in entries:
+                self._conn.execute(
+                    "INSERT INTO run_stages SELECT ?, COUNT(*), ? FROM run_stages WHERE run_id = ?",
+                    (run_id, json.dumps(entry, ensure_ascii=False), run_id)
+                )
+            self._conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def heartbeat(self, run_id):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def keep_alive(self, run_id, stop_event):
+        """ Sends heartbeats for run_id until stop_event is set """
+        while not stop_event.wait(self.heartbeat_interval):
+            with contextlib.suppress(sqlite3.Error):
+                self.heartbeat(run_id)
+
+    def is_live(self, run):
+        """ True while a loaded run is being executed somewhere, judged by its heartbeat """
+        return run["status"] == "running" and time.time() - run["updated_at"] < self.stale_after
+
+    def finish_run(self, run_id, status, error=None):
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET status = ?, error = ?, updated_at = ? WHERE run_id = ?",
+                               (status, error, time.time(), run_id))
+
+    def load_run(self, run_id):
+        """
+        {"run_id", "status", "error", "updated_at", "params", "history"} or None.
+        The history is ordered by version, the position of each entry's stage
+        in the pipeline graph, not by the order in which the stages finished.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, error, updated_at, params FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            if row is None:
+                return None
+            entries = self._conn.execute(
+                "SELECT entry FROM run_stages WHERE run_id = ? ORDER BY position", (run_id,)).fetchall()
+        history = sorted((json.loads(entry) for (entry,) in entries), key=lambda entry: entry["version"])
+        return {"run_id": run_id, "status": row[0], "error": row[1], "updated_at": row[2], "params": json.loads(row[3]),
+                "history": history}
+
+    def resumable_runs(self, limit=50):
+        """
+        Most recently updated runs that did not finish and are not live:
+        [(run_id, status, updated_at, params)], where the status of a
+        "running" run whose heartbeat stopped reads "interrupted"
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT run_id, status, updated_at, params FROM runs WHERE status NOT IN {self.FINISHED} "
+                "AND (status != 'running' OR updated_at < ?) ORDER BY updated_at DESC LIMIT ?",
+                (time.time() - self.stale_after, limit)).fetchall()
+        return [(run_id, "interrupted" if status == "running" else status, updated_at, json.loads(params))
+                for run_id, status, updated_at, params in rows]
+
+    def load_resumable_run(self, run_id):
+        """ load_run for a resume: raises ValueError for unknown runs and runs still executing elsewhere """
+        run = self.load_run(run_id)
+        if run is None:
+            raise ValueError(f"Unknown run: {run_id}")
+        if self.is_live(run):
+            raise ValueError(f"Run {run_id} is still running; it can be resumed once it stops")
+        return run
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+default_checkpoint_store = CheckpointStore(os.environ["USMLEGPT_CHECKPOINTS"]) if os.environ.get("USMLEGPT_CHECKPOINTS") else None
+
+EXAMPLE_ITEMS = """
+<example#1> A 27-year-old woman comes to the office for counseling prior to conception. She states that a friend recently delivered a newborn with a neural tube defect and she wants to decrease her risk for having a child with this condition. She has no history of major medical illness and takes no medications. Physical examination shows no abnormalities. It is most appropriate to recommend that this patient begin supplementation with a vitamin that is a cofactor in which of the following processes? (A) Biosynthesis of nucleotides (B) Protein gamma glutamate carboxylation (C) Scavenging of free radicals (D) Transketolation (E) Triglyceride lipolysis Correct Answer: A </example1>
+
+<example#2> A 26-year-old woman comes to the physician with her husband for counseling prior to conception. Her mother and three of her five siblings have type 2 diabetes mellitus. She is 170 cm (5 ft 7 in) tall and weighs 82 kg (180 lb); BMI is 28 kg/m2. Her blood pressure is 148/84 mm Hg. Physical examination shows no other abnormalities. Her fasting serum glucose concentration is 110 mg/dL. Which of the following is the most appropriate initial statement by the physician?
+
+(A) "Let's review ways you can optimize your own health before conceiving." (B) "We should test you for islet cell antibodies before you try to conceive." (C) "You can conceive right away since you are in good health." (D) "You should avoid gaining weight during pregnancy because you are already overweight and at risk for type 2 diabetes mellitus." (E) "You should have no problems with your pregnancy if you start insulin therapy." Correct Answer: A </example#2>
+
+<example#3> {Patient Information: {Age: 6 years Gender: M, Race/Ethnicity: unspecified, Site of Care: office} } The patient is brought by his mother because of a 1-month history of bleeding gums after brushing his teeth, increasingly severe muscle and joint pain, fatigue, and easy bruising. His mother says he has lost six baby teeth and has been irritable during this time. Use of acetaminophen has provided minimal relief of his pain. He has autism spectrum disorder. He is not toilet-trained. He has a 10-word vocabulary. Vital signs and oxygen saturation on room air are within normal limits. The patient appears alert but does not speak or make eye contact. Skin is pale and coarse. Examination of the scalp shows erythematous hair follicles. Dentition is poor, and gingivae bleed easily to touch. Multiple ecchymoses and petechiae are noted over the trunk and all extremities. There is marked swelling and tenderness to palpation of the elbow, wrist, knee, and ankle joints. He moves all extremities in a limited, guarded manner. Deep tendon reflexes are absent throughout. It is most appropriate to obtain specific additional history regarding which of the following in this patient? (A) Diet (B) Evidence of pica (C) Herbal supplementations (D) Lead exposure (E) Self-injurious behaviors Correct Answer: A </example#3>
+"""
+
+REVIEWER_GUIDELINES = "As a medical expert serving as a reviewer for USMLE item development, please reviews the item. You are expected to see that if it conforms to the requested USMLE style and to ensure no information is missing. You also edit and annotate items for clarity, grammar and punctuation, uniformity of style and technical item flaws – particularly those that might otherwise benefit test-wise examinees or add irrelevant difficulty.  Please note that, if there is a clinical setting, most items are in the form of a patient vignette in which the first sentence provides the patient age, gender, site of care, presenting complaint and its duration. Subsequent sentences in the vignette provide additional patient history, physical findings, the results of diagnostic studies and/or response to initial treatment."
+
+REVIEWER_FOCUS = [
+    "scientific accuracy and clinical relevance",
+    "psychometric expert focusing on item construction and option quality",
+    "clarity, formatting, and style guidelines"
+]
+
+# The system prompt of every development stage, byte for byte. Stage prompts
+# put the constant or shared parts first (EXAMPLE_ITEMS for the writer, the
+# history for later stages, which get_context always starts with the same
+# draft) and the role's instructions last, so providers with prompt prefix
+# caching can reuse the leading tokens across stages, roles and batch items.
+STAGE_SYSTEM_PROMPT = "You are an experienced member of a team developing USMLE Step 1 multiple choice items following the NBME item development process."
+
+def models_config_to_records(models_config):
+    """ Accepts the Gradio Dataframe (pandas), a plain list of dicts or the path of a JSON file holding that list """
+    if models_config is None:
+        return []
+    if isinstance(models_config, (str, os.PathLike)):
+        return load_models_config(models_config)
+    if hasattr(models_config, "to_dict"):
+        return models_config.to_dict(orient='records')
+    return list(models_config)
+
+PRESCREEN_SCHEMA = {
+    "type": "object",
+    "required": ["pass", "issues"],
+    "properties": {
+        "pass": {"type": "boolean"},
+        "issues": {"type": "array", "items": {"type": "string"}}
+    }
+}
+
+def prescreen_issues(text):
+    """ Local structural checks on a writer draft; an empty list means it may go to review """
+    if not text or not text.strip():
+        return ["draft is empty"]
+    if text.lstrip().startswith("Error:"):
+        return [text.strip().splitlines()[0]]
+    return parse_mcq_item(text)[1]
+
+def model_prescreen(mcq_system, model, draft, metrics):
+    """
+    Asks a cheap model for fatal flaws in a draft that passed the local checks.
+    Returns its issues; a failed or unreadable screen lets the draft through.
+    """
+    prompt = f"""Check this USMLE item draft for fatal flaws only: the keyed answer is wrong, more than one option is defensible, the stem gives the answer away, or the item is unusable as written. Ignore style.
+
+Reply with JSON: {{"pass": true or false, "issues": ["..."]}}
+
+Draft:
+{draft}"""
+    try:
+        data, errors = mcq_system.call_ai_model_json(model, "You are a strict USMLE item pre-screener.", prompt,
+                                                     PRESCREEN_SCHEMA, "prescreen", metrics=metrics)
+    except ModelCallError as e:
+        print(f"Pre-screen model failed, skipping it: {str(e)}")
+        return []
+    if errors or data.get("pass", True):
+        return []
+    return [str(issue) for issue in data.get("issues") or []] or ["pre-screen model rejected the draft"]
+
+# Prompt templates of the default pipeline. Stage prompts are filled with
+# str.format: {examples}, {guidelines}, {disciplines}, {systems},
+# {competencies} and {keywords}, {context} (the history the stage's context
+# policy allows), {requested} (a note on revision rounds after the first) and
+# the stage's own "params".
+WRITER_PROMPT = """Study these example items carefully:
+{examples}
+
+You are the item writer. Create a high-quality MCQ item following USMLE guidelines. Now, create a similar multiple choice question for:
+Disciplines: {disciplines}
+Systems: {systems}
+Competencies: {competencies}
+Additional elements incoporated into the MCQ: {keywords}
+
+Follow the same format as the examples."""
+
+REVIEWER_PROMPT = """History:
+{context}
+
+You are an experienced USMLE item reviewer. {guidelines} Also, do focus more on {focus}."""
+
+EDITOR_PROMPT = """History:
+{context}
+
+You are the editorial coordinator. Synthesize all reviews and provide a comprehensive summary for the item writer."""
+
+REVISION_PROMPT = """History:
+{context}
+
+Now you are the author reviewing the item draft you developed as well as the comments/suggestions from three NBME editorial staff members. {requested}
+
+Please carefully review materials provided, respond to queries from the staff editor, verify the correct answer and classification codes, and confirm the appearance of any associated pictorials. Any disagreements about phrasing should be documented so that they can be presented to the editorial staff again.
+
+Provide your revised version of the item and explain your responses to the feedback."""
+
+FINAL_DECISION_PROMPT = """History:
+{context}
+
+You are the editorial coordinator making the final decision. As the editorial staff, make the final decision on this item.
+Review the entire development process and either:
+1. Accept the item as is
+2. Request further revisions
+3. Reject the item"""
+
+REVISION_REQUESTED = "The editorial staff requested further revisions in their final decision; address it as well."
+
+# The development flow as a graph. Each stage names its history role, the
+# STAGE_CONTEXT_POLICIES entry it sees, the model slot it runs on, its prompt
+# template, request settings and the stages it depends on. Stages of one
+# "kind": "draft" are the writer draft (pre-screened and regenerated).
+# "round" stages repeat, with a numbered role, while the "decision" stage
+# asks for revisions. Model slots are resolved once per run: "writer" and
+# "editor" take the writer_model/editor_model assignments, "reviewer N" the
+# Nth reviewer_models entry; a stage's "model_name" overrides its slot.
+# max_tokens is sized per role: it is reserved against the TPM limit and the
+# cost ceiling, and replies that reach it are continued, not cut off.
+DEFAULT_PIPELINE = {
+    "stages": [
+        {"role": "Item Writer", "kind": "draft", "model": "writer", "prompt": WRITER_PROMPT,
+         "max_tokens": 1200, "depends_on": []},
+        *({"role": f"Reviewer {i+1}", "context": "reviewer", "model": f"reviewer {i+1}", "prompt": REVIEWER_PROMPT,
+           "params": {"focus": focus}, "max_tokens": 1200, "depends_on": ["Item Writer"]}
+          for i, focus in enumerate(REVIEWER_FOCUS)),
+        {"role": "Editorial Staff", "context": "editor", "model": "editor", "prompt": EDITOR_PROMPT,
+         "max_tokens": 1500, "depends_on": [f"Reviewer {i+1}" for i in range(len(REVIEWER_FOCUS))]},
+        {"role": "Author Revision", "context": "revision", "model": "writer", "prompt": REVISION_PROMPT,
+         "max_tokens": 2500, "depends_on": ["Editorial Staff"], "round": True},
+        {"role": "Final Editorial Decision", "context": "final_decision", "model": "editor",
+         "prompt": FINAL_DECISION_PROMPT, "temperature": 0.3, "max_tokens": 600, "depends_on": ["Author Revision"],
+         "round": True, "decision": True}
+    ]
+}
+
+# Stage settings a pipeline's "budgets" may override, by role or role prefix ("*" for every stage)
+BUDGET_SETTINGS = ("max_tokens", "temperature")
+
+STAGE_DEFAULTS = {"kind": "call", "context": None, "model": None, "model_name": None, "params": {},
+                  "temperature": 0.7, "max_tokens": 2000, "depends_on": [], "round": False, "decision": False}
+
+def topological_order(stages):
+    """ Orders stages so each comes after its dependencies, keeping the given order otherwise """
+    ordered, placed = [], set()
+    remaining = list(stages)
+    while remaining:
+        ready = [stage for stage in remaining if all(dep in placed for dep in stage["depends_on"])]
+        if not ready:
+            raise ValueError(f"Pipeline has a dependency cycle among: {', '.join(stage['role'] for stage in remaining)}")
+        for stage in ready:
+            ordered.append(stage)
+            placed.add(stage["role"])
+            remaining.remove(stage)
+    return ordered
+
+def compile_pipeline(pipeline):
+    """
+    Checks a pipeline definition (see DEFAULT_PIPELINE) and returns its stages
+    with defaults filled in, in topological order. A definition's "budgets"
+    ({role or role prefix: {"max_tokens": ..., "temperature": ...}}) override
+    those settings of the matching stages, "*" first so roles can override it;
+    without "stages" they apply to the default ones. Raises ValueError for
+    unknown dependencies, cycles, misplaced round or decision stages, unknown
+    budget settings and budgets matching no stage.
+    """
+    if isinstance(pipeline, dict):
+        stages, budgets = pipeline.get("stages", DEFAULT_PIPELINE["stages"]), pipeline.get("budgets", {})
+    else:
+        stages, budgets = pipeline, {}
+    stages = [{**STAGE_DEFAULTS, **stage} for stage in stages]
+    for prefix, settings in sorted(budgets.items(), key=lambda budget: budget[0] != "*"):
+        unknown = set(settings) - set(BUDGET_SETTINGS)
+        if unknown:
+            raise ValueError(f"Unknown budget settings for {prefix}: {', '.join(sorted(unknown))}")
+        matched = [stage for stage in stages if prefix == "*" or role_matches(stage.get("role") or "", [prefix])]
+        if not matched:
+            raise ValueError(f"Budget {prefix!r} matches no pipeline stage")
+        for stage in matched:
+            stage.update(settings)
+    roles = [stage.get("role") for stage in stages]
+    if not stages or not all(roles) or len(set(roles)) != len(roles):
+        raise ValueError("Pipeline stages need unique, non-empty roles")
+    by_role = {stage["role"]: stage for stage in stages}
+    for stage in stages:
+        if not stage.get("prompt"):
+            raise ValueError(f"Pipeline stage {stage['role']} has no prompt")
+        if stage["kind"] not in ("call", "draft"):
+            raise ValueError(f"Pipeline stage {stage['role']} has unknown kind {stage['kind']!r}")
+        if stage["kind"] == "draft" and stage["round"]:
+            raise ValueError(f"Draft stage {stage['role']} cannot be part of the revision round")
+        if stage["decision"] and not stage["round"]:
+            raise ValueError(f"Decision stage {stage['role']} must be part of the revision round")
+        for dep in stage["depends_on"]:
+            if dep not in by_role:
+                raise ValueError(f"Pipeline stage {stage['role']} depends on unknown stage {dep}")
+            if by_role[dep]["round"] and not stage["round"]:
+                raise ValueError(f"Pipeline stage {stage['role']} cannot depend on round stage {dep}")
+    if sum(stage["decision"] for stage in stages) > 1:
+        raise ValueError("A pipeline can have only one decision stage")
+    return topological_order(stages)
+
+def load_pipeline(path):
+    """ Loads a pipeline JSON file: {"stages": [...], "budgets": {...}} (either may be left out) or a list of stages """
+    with open(path, "r", encoding="utf-8") as f:
+        pipeline = json.load(f)
+    compile_pipeline(pipeline)
+    return pipeline
+
+default_pipeline = load_pipeline(os.environ["USMLEGPT_PIPELINE"]) if os.environ.get("USMLEGPT_PIPELINE") else DEFAULT_PIPELINE
+
+def completed_output(mcq_system, role):
+    """ Output of a stage already in the history, i.e. finished or restored from a checkpoint """
+    return next((entry['content'] for entry in mcq_system.history if entry['role'] == role), None)
+
+def run_stage_graph(mcq_system, stages, run_stage):
+    """
+    Runs stages (in topological order) as soon as every stage they depend on
+    is in the history, independent stages at the same time. A stage's entries
+    are checkpointed as soon as it finishes and added to the history in the
+    stages' order. run_stage(stage) returns (entries, error) with entries as
+    add_to_history arguments. Stages already in the history (restored from a
+    checkpoint) are skipped. After a failure no new stage starts; the running
+    ones finish, what succeeded is kept and the first error is raised.
+    """
+    in_history = {entry["role"] for entry in mcq_system.history}
+    results = {index: [] for index, stage in enumerate(stages) if stage["role"] in in_history}
+    started, pending, errors = set(results), {}, []
+    next_index = 0
+
+    with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+        while True:
+            # After a failure, stages that will never run no longer hold back the ones after them
+            while next_index < len(stages) and (next_index in results or (errors and next_index not in started)):
+                mcq_system.restore_history(results.pop(next_index, []))
+                in_history.add(stages[next_index]["role"])
+                next_index += 1
+            if not errors:
+                for index, stage in enumerate(stages):
+                    if index not in started and all(dep in in_history for dep in stage["depends_on"]):
+                        started.add(index)
+                        pending[executor.submit(run_stage, stage)] = index
+            if not pending:
+                break
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                index = pending.pop(future)
+                try:
+                    entries, error = future.result()
+                except Exception as e:
+                    entries, error = [], e
+                results[index] = mcq_system.finish_stage(entries)
+                if error is not None:
+                    errors.append(error)
+                    # Entries of failed stages (e.g. rejected drafts) are kept, but they complete nothing
+                    started.discard(index)
+
+    if errors:
+        raise errors[0]
+
+def develop_mcq(mcq_system, disciplines, systems, competencies, keywords, writer_model=None, reviewer_models=None, editor_model=None, on_token=None,
+                duplicate_index=None, duplicate_key=None, max_regenerations=1, prescreen=True, prescreen_model=None,
+                max_revision_rounds=0, pipeline=None):
+    """
+    Runs the stages of pipeline (default_pipeline: writer, reviewers, editor,
+    revision and final decision) and returns the history. Independent stages
+    run concurrently; entries are added in topological order with the stage's
+    position as version. If on_token is given, every stage is streamed and
+    on_token(role, text_so_far) is called as tokens arrive.
+
+    Before any reviewer runs, the draft is pre-screened: local structural checks
+    (if prescreen), then prescreen_model if one is given, then the near-duplicate
+    check against duplicate_index. A failing draft is recorded in the history and
+    regenerated up to max_regenerations times; if every draft fails, DraftRejected
+    (DuplicateItemError for duplicates) is raised. When the final decision asks
+    for revisions, up to max_revision_rounds more revision/decision rounds run.
+    Stages already in mcq_system.history (restored from a checkpoint) are skipped.
+    """
+    stages = compile_pipeline(pipeline or default_pipeline)
+
+    def stream_to(role):
+        if not on_token:
+            return None
+        return lambda text: on_token(role, text)
+
+    # Model slots are resolved once, so the revision runs on the writer's model and the decision on the editor's
+    reviewer_models = reviewer_models or []
+    assignments = {"writer": writer_model or None, "editor": editor_model or None,
+                   **{f"reviewer {i+1}": model or None for i, model in enumerate(reviewer_models)}}
+    slots = {}
+
+    def stage_model(stage):
+        if stage["model_name"]:
+            return mcq_system.select_model(stage["role"], stage["model_name"])
+        slot = stage["model"] or stage["role"]
+        if slot not in slots:
+            slots[slot] = mcq_system.select_model(slot, assignments.get(slot))
+        return slots[slot]
+
+    values = {"examples": EXAMPLE_ITEMS, "guidelines": REVIEWER_GUIDELINES, "disciplines": disciplines,
+              "systems": systems, "competencies": competencies, "keywords": keywords}
+
+    def stage_prompt(stage, requested=""):
+        context = mcq_system.get_context(stage["context"]) if stage["context"] else ""
+        return stage["prompt"].format(**values, context=context, requested=requested, **stage["params"])
+
+    prescreen_ai = mcq_system.select_model("prescreen", prescreen_model) if prescreen_model else None
+
+    def run_draft(stage, model):
+        """ Writes the draft, regenerating it while it fails the pre-screen or duplicate check """
+        base_prompt = writer_prompt = stage_prompt(stage)
+        entries = []
+        for attempt in range(max_regenerations + 1):
+            writer_metrics = {}
+            draft = mcq_system.call_ai_model(model, STAGE_SYSTEM_PROMPT, writer_prompt, stream_to(stage["role"]),
+                                             writer_metrics, temperature=stage["temperature"],
+                                             max_tokens=stage["max_tokens"], cache_tag=f"{stage['role']} {attempt + 1}")
+
+            rejection, prescreen_metrics = None, {}
+            issues = prescreen_issues(draft) if prescreen else []
+            if not issues and prescreen_ai:
+                issues = model_prescreen(mcq_system, prescreen_ai, draft, prescreen_metrics)
+            if issues:
+                rejection = DraftRejected(f"Draft failed the pre-screen: {'; '.join(issues)}", issues)
+                feedback = (f"Your previous draft was rejected: {'; '.join(issues)}. "
+                            "Fix these problems and follow the format of the examples exactly.")
+            elif duplicate_index is not None:
+                matches, mcq_system.draft_signature = duplicate_index.check_and_add(
+                    duplicate_key if duplicate_key is not None else id(mcq_system), draft)
+                if matches:
+                    rejection = DuplicateItemError(
+                        f"Draft is a near-duplicate of {matches[0][0]} (similarity {matches[0][1]})", matches)
+                    feedback = ("Your previous draft was nearly identical to an existing item. "
+                                "Write a clearly different item: a different patient, presentation and tested concept.")
+            if rejection is None:
+                if prescreen_metrics:
+                    entries.append(("Pre-screen", "Draft passed the pre-screen.", stage["version"], prescreen_metrics))
+                entries.append((stage["role"], draft, stage["version"], writer_metrics))
+                return entries, None
+
+            # Record the early exit; the rejected draft stays out of the reviewers' context
+            entries.append(("Rejected Draft", draft, stage["version"], writer_metrics))
+            entries.append(("Pre-screen", str(rejection), stage["version"], prescreen_metrics or None))
+            if attempt == max_regenerations:
+                return entries, rejection
+            print(f"{rejection}, regenerating")
+            writer_prompt = f"{base_prompt}\n\n{feedback}"
+
+    def run_stage(stage, requested=""):
+        model = stage["model_ai"]
+        if stage["kind"] == "draft":
+            return run_draft(stage, model)
+        metrics = {}
+        content = mcq_system.call_ai_model(model, STAGE_SYSTEM_PROMPT, stage_prompt(stage, requested),
+                                           stream_to(stage["role"]), metrics, temperature=stage["temperature"],
+                                           max_tokens=stage["max_tokens"], cache_tag=stage["role"])
+        return [(stage["role"], content, stage["version"], metrics)], None
+
+    def prepare(stage_list, first_version, suffix=""):
+        """ Numbers the stages' roles and versions and resolves their models """
+        renamed = {stage["role"]: stage["role"] + suffix for stage in stage_list}
+        prepared = []
+        for position, stage in enumerate(stage_list):
+            stage = {**stage, "role": renamed[stage["role"]], "version": first_version + position,
+                     "depends_on": [renamed.get(dep, dep) for dep in stage["depends_on"]]}
+            stage["model_ai"] = stage_model(stage)
+            prepared.append(stage)
+        return prepared
+
+    base = prepare(stages, 1)
+    run_stage_graph(mcq_system, base, run_stage)
+
+    # Only a request for revisions in the decision stage earns another round
+    decision = next((stage for stage in base if stage["decision"]), None)
+    round_stages = [stage for stage in stages if stage["round"]]
+    version = len(base) + 1
+    for round_number in range(1, max_revision_rounds + 1):
+        if decision is None or parse_final_decision(completed_output(mcq_system, decision["role"])) != "revise":
+            break
+        current = prepare(round_stages, version, f" {round_number + 1}")
+        run_stage_graph(mcq_system, current, lambda stage: run_stage(stage, REVISION_REQUESTED))
+        decision = next(stage for stage in current if stage["decision"])
+        version += len(current)
+
+    return mcq_system.history
+
+@contextlib.contextmanager
+def checkpoint_outcome(mcq_system):
+    """
+    Records how the enclosed pipeline run ended on mcq_system's checkpoint run,
+    if it has one, and keeps its heartbeat going while it runs. A run its own
+    cost ceiling stopped ends "over_budget"; one stopped by a shared ceiling
+    (e.g. the batch's) ends "failed" and can be resumed once there is budget.
+    """
+    status, error = "done", None
+    stop_heartbeat = threading.Event()
+    if mcq_system.checkpoint_store:
+        threading.Thread(target=mcq_system.checkpoint_store.keep_alive, args=(mcq_system.run_id, stop_heartbeat),
+                         daemon=True).start()
+    try:
+        yield
+    except PipelineCancelled:
+        status = "cancelled"
+        raise
+    except BudgetExceeded as e:
+        status, error = "over_budget" if mcq_system.cost_budget.refused else "failed", str(e)
+        raise
+    except Exception as e:
+        status, error = "rejected" if isinstance(e, DraftRejected) else "failed", str(e)
+        raise
+    finally:
+        stop_heartbeat.set()
+        if mcq_system.checkpoint_store:
+            mcq_system.checkpoint_store.finish_run(mcq_system.run_id, status, error)
+
+def resume_run(models_config, checkpoint_store, run_id, **pipeline_options):
+    """
+    Continues a checkpointed run from its first failed or missing stage with
+    the given models and returns the full history. Completed stages are reused,
+    not paid for again.
+    """
+    run = checkpoint_store.load_resumable_run(run_id)
+    mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config),
+                                      checkpoint_store=checkpoint_store, run_id=run_id)
+    mcq_system.restore_history(run["history"])
+    checkpoint_store.start_run(run["params"], run_id)
+    with checkpoint_outcome(mcq_system):
+        return develop_mcq(mcq_system, **{**run["params"], **pipeline_options})
+
+def start_mcq_pipeline(mcq_system, emit, disciplines, systems, competencies, keywords, writer_model, reviewer_models, editor_model,
+                       item_store=None, **pipeline_options):
+    """
+    Runs develop_mcq on a worker thread. emit((role, text_so_far)) is called for
+    streamed tokens, emit(("error", message)) on failure and emit(None) at the end.
+    Completed runs are saved to item_store when one is given; pipeline_options
+    (duplicate_index, prescreen_model, max_revision_rounds, ...) go to develop_mcq.
+    The outcome is recorded on the system's checkpoint run, if it has one.
+    """
+    def run():
+        try:
+            with checkpoint_outcome(mcq_system):
+                develop_mcq(mcq_system, disciplines, systems, competencies, keywords,
+                            writer_model, reviewer_models, editor_model,
+                            on_token=lambda role, text: emit((role, text)),
+                            **pipeline_options)
+            if item_store:
+                item_store.save_run(mcq_system.history, disciplines, systems, competencies, keywords,
+                                    signature=mcq_system.draft_signature)
+        except PipelineCancelled:
+            print("MCQ pipeline cancelled")
+        except Exception as e:
+            print(f"Error in process_mcq: {str(e)}")
+            emit(("error", str(e)))
+        finally:
+            emit(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def apply_pipeline_events(mcq_system, streaming, pending):
+    """
+    Folds streamed events into the per-role text and returns
+    (view, finished, error) where view is the finalized history plus the entries
+    still being written.
+    """
+    finished, error = False, None
+    for event in pending:
+        if event is None:
+            finished = True
+        elif event[0] == "error":
+            error = event[1]
+        else:
+            role, text = event
+            streaming[role] = text
+
+    history = list(mcq_system.history)
+    done_roles = {entry['role'] for entry in history}
+    in_progress = [
+        {"timestamp": str(datetime.datetime.now()), "role": role, "content": text, "version": "in progress"}
+        for role, text in streaming.items() if role not in done_roles
+    ]
+    return history + in_progress, finished, error
+
+def stream_mcq(models_config, disciplines, systems, competencies, keywords, writer_model=None, reviewer_models=None, editor_model=None,
+               item_store=None, max_item_cost=None, **pipeline_options):
+    """
+    Synchronous generator for scripts: streams every stage's tokens and yields
+    the finalized history entries plus the entries still being written.
+    Closing the generator cancels the run. max_item_cost (USD) overrides
+    USMLEGPT_MAX_ITEM_COST as the run's cost ceiling.
+    """
+    try:
+        mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config), cancel_event=threading.Event(),
+                                          cost_budget=CostBudget(max_item_cost) if max_item_cost is not None else None)
+    except Exception as e:
+        print(f"Error in process_mcq: {str(e)}")
+        yield [{"error": str(e)}]
+        return
+
+    events = queue.Queue()
+    start_mcq_pipeline(mcq_system, events.put, disciplines, systems, competencies, keywords,
+                       writer_model, reviewer_models, editor_model, item_store, **pipeline_options)
+    streaming = {}
+    try:
+        finished = False
+        while not finished:
+            # Coalesce everything that arrived since the last update into one refresh
+            pending = [events.get()]
+            while True:
+                try:
+                    pending.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            view, finished, error = apply_pipeline_events(mcq_system, streaming, pending)
+            yield view + ([{"error": error}] if error else [])
+    finally:
+        mcq_system.cancel_event.set()
+
+async def process_mcq(models_config, disciplines, systems, competencies, keywords, writer_model, reviewer_models, editor_model, summarizer_model,
+                      prescreen_model=None, revision_rounds=0):
+    """
+    Async generator for the Gradio UI. The pipeline runs on a worker thread so
+    the event loop stays free for other sessions; when the user leaves, Gradio
+    cancels this task and the in-flight model call is aborted.
+    With USMLEGPT_CHECKPOINTS set, every stage is checkpointed for resume_mcq.
+    """
+    params = {
+        "disciplines": disciplines, "systems": systems, "competencies": competencies, "keywords": keywords,
+        "writer_model": writer_model or None, "reviewer_models": reviewer_models or None,
+        "editor_model": editor_model or None, "prescreen_model": prescreen_model or None,
+        "max_revision_rounds": int(revision_rounds or 0)
+    }
+    try:
+        # Convert the DataFrame to a list of dictionaries
+        run_id = default_checkpoint_store.start_run(params) if default_checkpoint_store else None
+        mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config), cancel_event=threading.Event(),
+                                          checkpoint_store=default_checkpoint_store, run_id=run_id)
+    except Exception as e:
+        print(f"Error in process_mcq: {str(e)}")
+        yield [{"error": str(e)}]
+        return
+
+    async for view in run_mcq_session(mcq_system, params):
+        yield view
+
+async def resume_mcq(models_config, run_choice):
+    """
+    Async generator for the UI's resume action: reloads a checkpointed run and
+    continues it from its first failed or missing stage with the current models.
+    """
+    run_id = (run_choice or "").split(" ")[0]
+    try:
+        if not default_checkpoint_store:
+            raise ValueError("Checkpoints are disabled; set USMLEGPT_CHECKPOINTS to enable them")
+        run = default_checkpoint_store.load_resumable_run(run_id)
+        mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config), cancel_event=threading.Event(),
+                                          checkpoint_store=default_checkpoint_store, run_id=run_id)
+        mcq_system.restore_history(run["history"])
+        default_checkpoint_store.start_run(run["params"], run_id)
+    except Exception as e:
+        print(f"Error in resume_mcq: {str(e)}")
+        yield [{"error": str(e)}]
+        return
+
+    async for view in run_mcq_session(mcq_system, run["params"]):
+        yield view
+
+async def run_mcq_session(mcq_system, params):
+    """ Runs the pipeline for one UI session and yields the history as it grows """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    start_mcq_pipeline(mcq_system, lambda event: loop.call_soon_threadsafe(events.put_nowait, event),
+                       item_store=default_item_store, duplicate_index=default_duplicate_index, **params)
+    streaming = {}
+    try:
+        finished = False
+        while not finished:
+            # Coalesce everything that arrived since the last update into one UI refresh
+            pending = [await events.get()]
+            while not events.empty():
+                pending.append(events.get_nowait())
+            view, finished, error = apply_pipeline_events(mcq_system, streaming, pending)
+            yield view + ([{"error": error}] if error else [])
+    finally:
+        # Runs on completion, on cancellation and when the generator is closed
+        mcq_system.cancel_event.set()
+
+def generate_mcq_json_summary(history):
+    """ Generate a JSON summary of initial and final MCQ versions """
+    if not history:
+        return None
+
+    try:
+        initial_version, final_version = find_draft_and_final(history)
+        if not initial_version or not final_version:
+            return None
+
+        draft = parse_mcq_item(initial_version['content'])[0] or \
+            {"question": initial_version['content'], "options": [], "correct_answer": ""}
+        final = parse_mcq_item(final_version['content'])[0] or \
+            {"question": final_version['content'], "options": [], "correct_answer": ""}
+
+        summary = {
+            "draft": {"version": "draft", **draft},
+            "final": {"version": "final", **final},
+            "diff": diff_mcq_items(draft, final)
+        }
+
+        summary["metrics"] = summarize_metrics(history)["total"]
+        return json.dumps(summary, indent=2)
+    except Exception as e:
+        print(f"Error in generate_mcq_json_summary: {str(e)}")
+        return None
+
+REPORT_STYLE = """
+        body { font-family: Arial, sans-serif; margin: 40px; }
+        .entry { margin-bottom: 30px; border-bottom: 1px solid #ccc; padding-bottom: 20px; }
+        .timestamp { color: #666; font-size: 0.9em; }
+        .role { font-weight: bold; color: #2c5282; }
+        .version { color: #718096; }
+        .content { margin-top: 10px; white-space: pre-wrap; }
+        .header { background-color: #f7fafc; padding: 20px; margin-bottom: 30px; }
+        .metrics { border-collapse: collapse; margin-bottom: 30px; font-size: 0.9em; }
+        .metrics th, .metrics td { border: 1px solid #ccc; padding: 4px 10px; text-align: right; }
+        .metrics th:first-child, .metrics td:first-child { text-align: left; }
+"""
+
+def render_history_entries(history):
+    """ HTML for the history entries; model output is escaped, never trusted as markup """
+    return "".join(f"""
+            <div class="entry">
+                <div class="timestamp">{html.escape(str(entry.get('timestamp', '')))}</div>
+                <div class="role">
+                    <span class="role">{html.escape(str(entry.get('role', '')))}</span>
+                    <span class="version">(Version {html.escape(str(entry.get('version', '')))})</span>
+                </div>
+                <div class="content">{html.escape(str(entry.get('content', '')))}</div>
+            </div>
+            """ for entry in history)
+
+def generate_html_report(history):
+    """ Convert the development history into a formatted HTML document """
+    try:
+        html_content = """
+        <html>
+        <head>
+        <meta charset="utf-8">
+        <style>""" + REPORT_STYLE + """        </style>
+        </head>
+        <body>
+        <div class="header">
+            <h1>USMLE MCQ Development Process Record</h1>
+            <p>Generated on: """ + datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + """</p>
+        </div>
+        """
+
+        html_content += render_metrics_table(history)
+        html_content += render_history_entries(history)
+
+        html_content += """
+        </body>
+        </html>
+        """
+        
+        # Save HTML file
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"mcq_development_history_{timestamp}.html"
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(html_content)
+            
+        return filename
+    except Exception as e:
+        print(f"Error in generate_html_report: {str(e)}")
+        return None
+
+def render_metrics_table(history):
+    """ HTML cost/latency breakdown of the stages that carry metrics """
+    summary = summarize_metrics(history)
+    if not summary["stages"]:
+        return ""
+
+    def cell(value):
+        return "" if value is None else html.escape(str(value))
+
+    rows = ""
+    for stage in summary["stages"]:
+        rows += f"""
+            <tr><td>{cell(stage['role'])}</td><td>{cell(stage.get('model'))}</td><td>{cell(stage.get('latency_s'))}</td>
+            <td>{cell(stage.get('ttft_s'))}</td><td>{cell(stage.get('queue_wait_s'))}</td><td>{cell(stage.get('retries'))}</td>
+            <td>{cell(stage.get('prompt_tokens'))}</td><td>{cell(stage.get('cached_tokens'))}</td><td>{cell(stage.get('completion_tokens'))}</td>
+            <td>{cell(stage.get('finish_reason'))}</td><td>{cell(stage.get('cost_usd'))}</td></tr>"""
+    total = summary["total"]
+    return f"""
+        <h2>Cost &amp; Latency Breakdown</h2>
+        <table class="metrics">
+            <tr><th>Stage</th><th>Model</th><th>Latency (s)</th><th>First token (s)</th><th>Queue wait (s)</th>
+            <th>Retries</th><th>Prompt tokens</th><th>Cached tokens</th><th>Completion tokens</th><th>Finish reason</th><th>Cost (USD)</th></tr>{rows}
+            <tr><th>Total</th><th></th><th>{total['latency_s']}</th><th></th><th></th><th>{total['retries']}</th>
+            <th>{total['prompt_tokens']}</th><th>{total['cached_tokens']}</th><th>{total['completion_tokens']}</th><th></th><th>{cell(total['cost_usd'])}</th></tr>
+        </table>
+        """
+
+def save_json_to_file(json_content):
+    if not json_content:
+        return None
+
+    try:
+        # Save JSON content to a file
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"mcq_versions_summary_{timestamp}.json"
+
+        with open(filename, "w", encoding="utf-8") as f:
+            f.write(json_content)
+
+        print(f"JSON summary saved to {filename}")
+        return filename
+    except Exception as e:
+        print(f"Error saving JSON to file: {e}")
+        return None
+
+def save_json_summary(history, models_config, summarizer_model):
+    if not history:
+        print("No history available.")
+        return None
+
+    try:
+        # Items follow a regular format, so parse them locally and only ask the
+        # summarizer model when the parsed versions fail the confidence checks
+        summary, issues = summarize_versions_locally(history)
+        if summary:
+            summary["metrics"] = summarize_metrics(history)
+            return json.dumps(summary, indent=2, ensure_ascii=False)
+        print(f"Local parsing not confident ({'; '.join(issues)}), falling back to the summarizer model")
+
+        # Initialize MCQ system
+        mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config))
+        summarizer_ai = mcq_system.select_model("summarizer", summarizer_model)
+
+        # Convert history to text format
+        history_text = ""
+        for entry in history:
+            history_text += f"[{entry['timestamp']}] {entry['role']} (Version {entry['version']}):\n{entry['content']}\n\n"
+
+        # Create summarizer prompt
+        summarizer_prompt = f"""Please see the entire history of an item's development, and extract information of the first draft and finalized version of the item that one can track the differences in between. Please following the following json format:
+        {{
+            "draft": {{
+                "version": "draft",
+                "question": "[full question stem]",
+                "options": ["A) [option text]", "B) [option text]", "C) [option text]", "D) [option text]", "E) [option text]"],
+                "correct_answer": "[letter A-E]"
+            }},
+            "final": {{
+                "version": "final",
+                "question": "[full question stem]",
+                "options": ["A) [option text]", "B) [option text]", "C) [option text]", "D) [option text]", "E) [option text]"],
+                "correct_answer": "[letter A-E]"
+            }}
+        }}
+
+        Here is the complete development history:
+
+        {history_text}"""
+
+        # Print the summarizer prompt to the console for debugging
+        print("Summarizer Prompt:")
+        print(summarizer_prompt)
+
+        # Get a schema-validated JSON summary from AI, repairing it if needed
+        summary, errors = mcq_system.call_ai_model_json(
+            summarizer_ai,
+            "You are a technical summarizer. Extract the first and final versions of the MCQ from the history and output valid JSON only.",
+            summarizer_prompt,
+            MCQ_SUMMARY_SCHEMA,
+            "mcq_versions_summary",
+            validate_mcq_summary
+        )
+        if not isinstance(summary, dict):
+            print(f"Failed to get a JSON summary: {'; '.join(errors)}")
+            return None
+
+        summary["source"] = "llm"
+        if errors:
+            summary["validation_errors"] = errors
+        summary["metrics"] = summarize_metrics(history)
+        return json.dumps(summary, indent=2, ensure_ascii=False)
+
+    except Exception as e:
+        print(f"Error in save_json_summary: {e}")
+        return None
+
+def blueprint_grid(disciplines=None, systems=None, competencies=None, count=1, keywords=""):
+    """
+    Expands discipline x system x competency combinations into blueprint cells.
+    Defaults to the full grid of predefined options.
+    """
+    return [
+        {
+            "disciplines": [discipline],
+            "systems": [system],
+            "competencies": [competency],
+            "keywords": keywords,
+            "count": count
+        }
+        for discipline, system, competency in itertools.product(
+            disciplines or discipline_options,
+            systems or system_options,
+            competencies or competency_options
+        )
+    ]
+
+def load_blueprint(path):
+    """
+    Loads a blueprint JSON file. Either a list of cells, or an object with
+    "cells" and/or a "grid" of {disciplines, systems, competencies, count}.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        blueprint = json.load(f)
+
+    if isinstance(blueprint, list):
+        return blueprint
+
+    cells = list(blueprint.get("cells", []))
+    grid = blueprint.get("grid")
+    if grid:
+        cells.extend(blueprint_grid(
+            grid.get("disciplines"), grid.get("systems"), grid.get("competencies"),
+            grid.get("count", 1), grid.get("keywords", "")
+        ))
+    return cells
+
+def load_models_config(path):
+    """ Loads a JSON list of {api_key, base_url, model_name} entries """
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def batch_run_id(position, cell, index):
+    """ Checkpoint run id of one blueprint job, stable across restarts of the same batch """
+    payload = json.dumps([position, cell, index], ensure_ascii=False, sort_keys=True)
+    return "batch-" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def develop_cell_item(models_config, cell, run_id=None, model_semaphores=None, response_cache=None, item_store=None,
+                      checkpoint_store=None, cancel_event=None, duplicate_key=None, cost_budget=None, max_item_cost=None,
+                      **pipeline_options):
+    """
+    Develops one item of a blueprint cell (its tags, keywords and optional
+    writer/reviewer/editor/prescreen models) and returns a dict with status
+    (ok, rejected, duplicate, over_budget, cancelled or error), history, error,
+    store_id and cost_usd; a cancelled run is not saved to item_store. With a
+    checkpoint_store the run is checkpointed under run_id and resumed from its
+    first missing stage (resumed_stages counts the restored ones). The item
+    may cost at most max_item_cost USD (default USMLEGPT_MAX_ITEM_COST),
+    restored stages included; its spending is also charged to cost_budget,
+    e.g. the batch's budget. A run stopped by a ceiling ends "over_budget",
+    with ceiling "item" when its own ceiling refused the request and "shared"
+    when cost_budget's did.
+    """
+    result = {}
+    item_budget = CostBudget(max_item_cost if max_item_cost is not None else default_max_item_cost, parent=cost_budget)
+    options = {**pipeline_options, **({"prescreen_model": cell["prescreen_model"]} if cell.get("prescreen_model") else {})}
+    disciplines, systems = cell.get("disciplines", []), cell.get("systems", [])
+    competencies, keywords = cell.get("competencies", []), cell.get("keywords", "")
+    mcq_system = None
+    try:
+        mcq_system = MCQDevelopmentSystem(models_config_to_records(models_config), model_semaphores, response_cache,
+                                          cancel_event=cancel_event, checkpoint_store=checkpoint_store, run_id=run_id,
+                                          cost_budget=item_budget)
+        if checkpoint_store:
+            previous = checkpoint_store.load_run(run_id)
+            restored = mcq_system.restore_history(previous["history"] if previous else [])
+            result["resumed_stages"] = len(restored)
+            # Stages paid for by earlier attempts count against the item's ceiling
+            item_budget.spent = summarize_metrics(restored)["total"]["cost_usd"] or 0.0
+            checkpoint_store.start_run({
+                "disciplines": disciplines, "systems": systems, "competencies": competencies, "keywords": keywords,
+                "writer_model": cell.get("writer_model"), "reviewer_models": cell.get("reviewer_models"),
+                "editor_model": cell.get("editor_model"), "prescreen_model": options.get("prescreen_model"),
+                "max_revision_rounds": options.get("max_revision_rounds", 0), "pipeline": options.get("pipeline")
+            }, run_id)
+        with checkpoint_outcome(mcq_system):
+            result["history"] = develop_mcq(
+                mcq_system, disciplines, systems, competencies, keywords, cell.get("writer_model"),
+                cell.get("reviewer_models"), cell.get("editor_model"), duplicate_key=duplicate_key, **options
+            )
+        result["status"] = "ok"
+    except DraftRejected as e:
+        result["status"] = "duplicate" if isinstance(e, DuplicateItemError) else "rejected"
+        result["error"] = str(e)
+        result["history"] = mcq_system.history
+    except BudgetExceeded as e:
+        result.update(status="over_budget", error=str(e), history=mcq_system.history,
+                      ceiling="item" if item_budget.refused else "shared")
+    except PipelineCancelled as e:
+        result.update(status="cancelled", error=str(e), history=mcq_system.history)
+    except Exception as e:
+        result["status"] = "error"
+        result["error"] = str(e)
+    if item_store and result["status"] != "cancelled":
+        result["store_id"] = item_store.save_run(
+            result.get("history"), disciplines, systems, competencies, keywords, result["status"], result.get("error"),
+            mcq_system.draft_signature if result["status"] == "ok" else None)
+    result["cost_usd"] = item_budget.spent
+    return result
+
+def run_batch(models_config, blueprint, output_path, max_concurrency=4, per_model_concurrency=2, progress_callback=None, response_cache=None,
+              item_store=None, checkpoint_store=None, max_item_cost=None, max_batch_cost=None, **pipeline_options):
+    """
+    Generates every item in the blueprint with at most max_concurrency pipelines
+    and per_model_concurrency in-flight calls per model. One JSON record per item
+    is appended to output_path as soon as that item finishes, and saved to
+    item_store if one is given. pipeline_options go to develop_mcq; items whose
+    drafts keep failing the pre-screen stop before review with status "rejected",
+    or "duplicate" for near-duplicates. A cell's own "prescreen_model" wins.
+    With a checkpoint_store every stage is checkpointed as it completes, and
+    running the same batch again skips finished items and resumes the others
+    from their first missing stage. Each item may cost at most max_item_cost
+    USD and all of them together max_batch_cost. An item stopped by a ceiling
+    ends "over_budget"; once the batch ceiling is reached no further item is
+    started, and the ones left are recorded as "over_budget" without a call.
+    Returns a dict with the ok/error/rejected/duplicate/over_budget/skipped
+    counts and the batch's cost_usd.
+    """
+    batch_budget = CostBudget(max_batch_cost)
+    models_config = models_config_to_records(models_config)
+    model_semaphores = {
+        config['model_name']: threading.BoundedSemaphore(per_model_concurrency)
+        for config in models_config if config.get('model_name')
+    }
+
+    jobs = [
+        (batch_run_id(position, cell, index), cell, index)
+        for position, cell in enumerate(blueprint)
+        for index in range(int(cell.get("count", 1)))
+    ]
+    total = len(jobs)
+    counts = {"ok": 0, "error": 0, "rejected": 0, "duplicate": 0, "over_budget": 0, "skipped": 0, "done": 0}
+    lock = threading.Lock()
+
+    def run_job(item_id, run_id, cell, index):
+        started = time.time()
+        record = {
+            "item_id": item_id,
+            "run_id": run_id,
+            "disciplines": cell.get("disciplines", []),
+            "systems": cell.get("systems", []),
+            "competencies": cell.get("competencies", []),
+            "keywords": cell.get("keywords", ""),
+            "replicate": index
+        }
+        previous = checkpoint_store.load_run(run_id) if checkpoint_store else None
+        if previous and previous["status"] in CheckpointStore.FINISHED:
+            # Its record was written when it finished
+            record.update(status="skipped", elapsed_seconds=0.0)
+            with lock:
+                counts["skipped"] += 1
+                counts["done"] += 1
+                done = counts["done"]
+            if progress_callback:
+                progress_callback(done, total, record)
+            return record["status"]
+
+        if batch_budget.exhausted:
+            # Starting it would only pay for stages it cannot finish
+            record.update(status="over_budget", error=f"Batch cost ceiling of ${max_batch_cost} reached", ceiling="shared")
+        else:
+            record.update(develop_cell_item(models_config, cell, run_id, model_semaphores, response_cache, item_store,
+                                            checkpoint_store, duplicate_key=("batch", item_id), cost_budget=batch_budget,
+                                            max_item_cost=max_item_cost, **pipeline_options))
+        if record["status"] in ("error", "over_budget"):
+            print(f"Error in batch item {item_id}: {record['error']}")
+        elif record["status"] != "ok":
+            print(f"Batch item {item_id} stopped before review: {record['error']}")
+        record["elapsed_seconds"] = round(time.time() - started, 3)
+
+        # Write the record right away so finished items are never held in memory
+        with lock:
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[record["status"]] += 1
+            counts["done"] += 1
+            done = counts["done"]
+        if progress_callback:
+            progress_callback(done, total, record)
+        return record["status"]
+
+    with open(output_path, "a", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [
+            executor.submit(run_job, item_id, run_id, cell, index)
+            for item_id, (run_id, cell, index) in enumerate(jobs)
+        ]
+        for future in as_completed(futures):
+            future.result()
+
+    counts["cost_usd"] = batch_budget.spent
+    return counts
@@ -0,0 +1,232 @@
+"""
+Blueprint coverage: fills an item bank toward target quotas of accepted items
+per discipline/system/competency cell. Each new job goes to the cell that
+still needs the most attempts (its deficit divided by its acceptance rate so
+far), and nothing more is spent on a cell once its quota is met.
+"""
+import hashlib
+import json
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from .core import (
+    CheckpointStore,
+    CostBudget,
+    competency_options,
+    develop_cell_item,
+    discipline_options,
+    models_config_to_records,
+    summarize_item,
+    system_options
+)
+
+def cell_key(cell):
+    """ (discipline, system, competency) of a blueprint cell naming exactly one of each """
+    key = []
+    for field, name, options in (("disciplines", "discipline", discipline_options),
+                                 ("systems", "system", system_options),
+                                 ("competencies", "competency", competency_options)):
+        values = cell.get(field)
+        values = [values] if isinstance(values, str) else list(values or [])
+        if len(values) != 1:
+            raise ValueError(f"Coverage cells need exactly one {name}, got {values}")
+        if values[0] not in options:
+            raise ValueError(f"Unknown {name}: {values[0]}")
+        key.append(values[0])
+    return tuple(key)
+
+class CoveragePlan:
+    """
+    Quotas of accepted items per cell, with the attempts and acceptances seen
+    so far and the jobs in flight. A cell's acceptance rate is its own record
+    shrunk toward the rate over all cells (prior_weight pseudo-attempts), so
+    cells without history start from what the bank as a whole achieves.
+    next_cell() picks the cell whose expected remaining attempts,
+    deficit / rate minus the jobs already running for it, are largest.
+    A cell gets at most max_attempts_per_cell runs from this plan (None for
+    no cap) and is retired after max_consecutive_errors failed runs in a row,
+    e.g. from a bad model assignment or a cost ceiling it cannot fit under.
+    """
+    def __init__(self, targets, counts=None, prior_weight=2.0, max_attempts_per_cell=10, max_consecutive_errors=3):
+        self.quotas = {}
+        self.keywords = {}
+        for cell in targets:
+            key = cell_key(cell)
+            self.quotas[key] = self.quotas.get(key, 0) + int(cell.get("count", 1))
+            self.keywords.setdefault(key, cell.get("keywords", ""))
+        counts = counts or {}
+        self.attempts = {key: counts.get(key, (0, 0))[0] for key in self.quotas}
+        self.accepted = {key: counts.get(key, (0, 0))[1] for key in self.quotas}
+        self.in_flight = {key: 0 for key in self.quotas}
+        # Attempts started by this plan, capped by max_attempts_per_cell
+        self.dispatched = {key: 0 for key in self.quotas}
+        # Failed runs since the cell's last judged outcome
+        self.errors = {key: 0 for key in self.quotas}
+        self.prior_weight = prior_weight
+        self.max_attempts_per_cell = max_attempts_per_cell
+        self.max_consecutive_errors = max_consecutive_errors
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_store(cls, targets, item_store, **kwargs):
+        """ A plan starting from the accepted items already in item_store """
+        return cls(targets, item_store.cell_counts() if item_store else None, **kwargs)
+
+    def overall_rate(self):
+        attempts, accepted = sum(self.attempts.values()), sum(self.accepted.values())
+        # Laplace smoothing so an empty bank starts at one half
+        return (accepted + 1) / (attempts + 2)
+
+    def rate(self, key):
+        return ((self.accepted[key] + self.prior_weight * self.overall_rate())
+                / (self.attempts[key] + self.prior_weight))
+
+    def deficit(self, key):
+        return max(0, self.quotas[key] - self.accepted[key])
+
+    def full(self, key):
+        return self.deficit(key) == 0
+
+    def done(self):
+        return all(self.full(key) for key in self.quotas)
+
+    def retired(self, key):
+        """ True once a cell may not be attempted any more: its attempts are used up or it keeps failing """
+        return ((self.max_attempts_per_cell is not None and self.dispatched[key] >= self.max_attempts_per_cell)
+                or (self.max_consecutive_errors is not None and self.errors[key] >= self.max_consecutive_errors))
+
+    def next_cell(self):
+        """ Reserves a job for the cell that needs it most, or returns None when none does """
+        with self._lock:
+            best, best_need = None, 0.0
+            for key in self.quotas:
+                if self.full(key) or self.retired(key):
+                    continue
+                need = self.deficit(key) / max(self.rate(key), 0.01) - self.in_flight[key]
+                if need > best_need:
+                    best, best_need = key, need
+            if best is not None:
+                self.in_flight[best] += 1
+                self.dispatched[best] += 1
+            return best
+
+    def finish(self, key, outcome):
+        """
+        Records a finished job: "accepted", "attempted" (any other judged
+        outcome), "error" (failed or over budget) or None (cancelled)
+        """
+        with self._lock:
+            self.in_flight[key] -= 1
+            if outcome == "error":
+                self.errors[key] += 1
+            elif outcome:
+                self.errors[key] = 0
+                self.attempts[key] += 1
+            if outcome == "accepted":
+                self.accepted[key] += 1
+
+    def report(self):
+        """
+        One row per cell: tags, quota, accepted, attempts, acceptance rate,
+        deficit and whether it is retired, largest deficit first
+        """
+        rows = [{"discipline": key[0], "system": key[1], "competency": key[2], "quota": self.quotas[key],
+                 "accepted": self.accepted[key], "attempts": self.attempts[key], "rate": round(self.rate(key), 3),
+                 "deficit": self.deficit(key), "retired": not self.full(key) and self.retired(key)}
+                for key in self.quotas]
+        return sorted(rows, key=lambda row: -row["deficit"])
+
+def coverage_run_id(key, index):
+    payload = json.dumps([list(key), index], ensure_ascii=False)
+    return "coverage-" + hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+def run_coverage(models_config, plan, output_path, item_store=None, max_concurrency=4, per_model_concurrency=2,
+                 progress_callback=None, response_cache=None, checkpoint_store=None, max_item_cost=None,
+                 max_batch_cost=None, **pipeline_options):
+    """
+    Keeps up to max_concurrency pipelines running on the cells plan picks
+    until every quota is met, every open cell is retired (see CoveragePlan),
+    or the batch cost ceiling is reached. When a cell fills, its jobs still running are
+    cancelled. One JSON record per job is appended to output_path (status ok,
+    rejected, duplicate, error or cancelled, plus the final decision) and
+    finished items go to item_store, from which the next run's plan starts.
+    With a checkpoint_store, interrupted attempts are resumed by the next run.
+    Returns the counts per status, accepted, the remaining deficit and cost_usd.
+    """
+    models_config = models_config_to_records(models_config)
+    model_semaphores = {
+        config['model_name']: threading.BoundedSemaphore(per_model_concurrency)
+        for config in models_config if config.get('model_name')
+    }
+    batch_budget = CostBudget(max_batch_cost)
+    counts = {"ok": 0, "error": 0, "rejected": 0, "duplicate": 0, "over_budget": 0, "cancelled": 0, "accepted": 0,
+              "done": 0}
+    next_index = {}
+
+    def run_id_for(key):
+        # Unfinished checkpoints are resumed; finished ones are already in the store
+        while True:
+            index = next_index.get(key, plan.attempts[key])
+            next_index[key] = index + 1
+            run_id = coverage_run_id(key, index)
+            previous = checkpoint_store.load_run(run_id)
+            if not previous or previous["status"] not in CheckpointStore.FINISHED:
+                return run_id
+
+    def run_job(key, run_id, cancel_event):
+        cell = {"disciplines": [key[0]], "systems": [key[1]], "competencies": [key[2]], "keywords": plan.keywords[key]}
+        return develop_cell_item(models_config, cell, run_id, model_semaphores, response_cache, item_store,
+                                 checkpoint_store, cancel_event=cancel_event,
+                                 duplicate_key=("coverage", run_id or id(cancel_event)),
+                                 cost_budget=batch_budget, max_item_cost=max_item_cost, **pipeline_options)
+
+    running = {}
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        while True:
+            while len(running) < max_concurrency and not batch_budget.exhausted:
+                key = plan.next_cell()
+                if key is None:
+                    break
+                run_id = run_id_for(key) if checkpoint_store else None
+                cancel_event = threading.Event()
+                future = executor.submit(run_job, key, run_id, cancel_event)
+                running[future] = (key, run_id, cancel_event, time.time())
+            if not running:
+                break
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                key, run_id, cancel_event, started = running.pop(future)
+                result = future.result()
+                status = result["status"]
+                decision = summarize_item(result.get("history"))["decision"] if status == "ok" else None
+                outcome = None
+                if status in ("ok", "rejected", "duplicate"):
+                    outcome = "accepted" if decision == "accepted" else "attempted"
+                elif status in ("error", "over_budget"):
+                    outcome = "error"
+                plan.finish(key, outcome)
+                if plan.full(key):
+                    # Nothing more is spent on a full cell
+                    for other_key, _, other_cancel, _ in running.values():
+                        if other_key == key:
+                            other_cancel.set()
+
+                record = {
+                    "run_id": run_id, "disciplines": [key[0]], "systems": [key[1]], "competencies": [key[2]],
+                    "keywords": plan.keywords[key], **result, "status": status, "decision": decision,
+                    "elapsed_seconds": round(time.time() - started, 3)
+                }
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                counts[status] += 1
+                counts["done"] += 1
+                if outcome == "accepted":
+                    counts["accepted"] += 1
+                if progress_callback:
+                    progress_callback(plan, record)
+
+    counts["deficit"] = sum(plan.deficit(key) for key in plan.quotas)
+    counts["cost_usd"] = batch_budget.spent
+    return counts
@@ -0,0 +1,375 @@
+"""
+Bulk export of item banks. Items stream from an ItemStore query or a batch
+results file through a single pass that writes any of JSONL, CSV, Parquet, a
+QTI 2.1 content package and one paginated HTML report. Writers append as items
+arrive, so memory stays flat however large the bank is, and rendering can be
+spread over worker processes.
+"""
+import collections
+import csv
+import datetime
+import html
+import itertools
+import json
+import tempfile
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from xml.sax.saxutils import escape as xml_escape, quoteattr
+
+from .core import REPORT_STYLE, render_history_entries, render_metrics_table, summarize_item
+
+def item_from_history(history, **fields):
+    """
+    An export item (the shape ItemStore.query yields) for one development
+    history; fields such as id, status or disciplines are kept as given.
+    """
+    summary = summarize_item(history)
+    item = {
+        "id": None, "status": "ok", "error": None, "disciplines": [], "systems": [], "competencies": [], "keywords": "",
+        **{key: value for key, value in summary.items() if key != "final_content"},
+        "history": [entry for entry in history or [] if entry.get("role")]
+    }
+    item.update(fields)
+    return item
+
+def iter_batch_items(path):
+    """ Streams the records of a run_batch results file as export items """
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield item_from_history(
+                record.get("history"), id=record.get("item_id"), status=record.get("status", "ok"),
+                error=record.get("error"), disciplines=record.get("disciplines") or [],
+                systems=record.get("systems") or [], competencies=record.get("competencies") or [],
+                keywords=record.get("keywords") or ""
+            )
+
+class JsonlWriter:
+    """ One JSON object per line """
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8")
+
+    @staticmethod
+    def render(position, item):
+        return json.dumps(item, ensure_ascii=False) + "\n"
+
+    def write(self, rendered):
+        self._file.write(rendered)
+
+    def close(self):
+        self._file.close()
+
+class CsvWriter:
+    """ One row per item; tags are joined with "; " and options with newlines """
+    COLUMNS = ["id", "status", "decision", "disciplines", "systems", "competencies", "keywords", "question",
+               "options", "correct_answer", "latency_s", "prompt_tokens", "completion_tokens", "cost_usd"]
+
+    def __init__(self, path):
+        self._file = open(path, "w", encoding="utf-8", newline="")
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.COLUMNS)
+
+    @staticmethod
+    def render(position, item):
+        row = []
+        for column in CsvWriter.COLUMNS:
+            value = item.get(column)
+            if column == "options":
+                value = "\n".join(value or [])
+            elif isinstance(value, list):
+                value = "; ".join(value)
+            row.append("" if value is None else value)
+        return row
+
+    def write(self, rendered):
+        self._writer.writerow(rendered)
+
+    def close(self):
+        self._file.close()
+
+class ParquetWriter:
+    """
+    Parquet file through the pyarrow package. Rows are buffered into row
+    groups of row_group_size, which bounds memory; the history is a JSON string.
+    """
+    def __init__(self, path, row_group_size=1000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet export requires the pyarrow package")
+        self._pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()), ("status", pa.string()), ("decision", pa.string()),
+            ("disciplines", pa.list_(pa.string())), ("systems", pa.list_(pa.string())),
+            ("competencies", pa.list_(pa.string())), ("keywords", pa.string()), ("question", pa.string()),
+            ("options", pa.list_(pa.string())), ("correct_answer", pa.string()), ("latency_s", pa.float64()),
+            ("prompt_tokens", pa.int64()), ("completion_tokens", pa.int64()), ("cost_usd", pa.float64()),
+            ("history", pa.string())
+        ])
+        self.row_group_size = row_group_size
+        self._rows = []
+        self._writer = pq.ParquetWriter(path, self.schema)
+
+    @staticmethod
+    def render(position, item):
+        row = {column: item.get(column) for column in CsvWriter.COLUMNS}
+        row["history"] = json.dumps(item["history"], ensure_ascii=False) if "history" in item else None
+        return row
+
+    def write(self, rendered):
+        self._rows.append(rendered)
+        if len(self._rows) >= self.row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._rows:
+            self._writer.write_table(self._pa.Table.from_pylist(self._rows, schema=self.schema))
+            self._rows = []
+
+    def close(self):
+        self._flush()
+        self._writer.close()
+
+class QtiWriter:
+    """
+    IMS QTI 2.1 content package (a zip): one single-choice assessmentItem per
+    item plus imsmanifest.xml. Items whose final version does not parse into a
+    stem, options and answer are skipped and counted in skipped.
+    """
+    NAMESPACE = "http://www.imsglobal.org/xsd/imsqti_v2p1"
+    SCHEMA_LOCATION = "http://www.imsglobal.org/xsd/imsqti_v2p1 http://www.imsglobal.org/xsd/qti/qtiv2p1/imsqti_v2p1.xsd"
+    MATCH_CORRECT = "http://www.imsglobal.org/question/qti_v2p1/rptemplates/match_correct"
+
+    def __init__(self, path):
+        self.skipped = 0
+        self._zip = zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED)
+        # Manifest entries are spooled to disk and copied into the zip on close
+        self._resources = tempfile.TemporaryFile("w+", encoding="utf-8")
+
+    @staticmethod
+    def render(position, item):
+        options = item.get("options") or []
+        if not item.get("question") or len(options) < 2 or not item.get("correct_answer"):
+            return None
+        identifier = f"item-{item['id'] if item.get('id') is not None else position + 1}"
+        tags = ", ".join((item.get("disciplines") or []) + (item.get("systems") or []))
+        choices = "\n".join(
+            f'      <simpleChoice identifier="{chr(ord("A") + index)}">{xml_escape(option[3:] if option[1:3] == ") " else option)}</simpleChoice>'
+            for index, option in enumerate(options)
+        )
+        xml = f"""<?xml version="1.0" encoding="UTF-8"?>
+<assessmentItem xmlns="{QtiWriter.NAMESPACE}" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance"
+    xsi:schemaLocation="{QtiWriter.SCHEMA_LOCATION}"
+    identifier="{identifier}" title={quoteattr(tags or identifier)} adaptive="false" timeDependent="false">
+  <responseDeclaration identifier="RESPONSE" cardinality="single" baseType="identifier">
+    <correctResponse>
+      <value>{xml_escape(item['correct_answer'])}</value>
+    </correctResponse>
+  </responseDeclaration>
+  <outcomeDeclaration identifier="SCORE" cardinality="single" baseType="float"/>
+  <itemBody>
+    <p>{xml_escape(item['question'])}</p>
+    <choiceInteraction responseIdentifier="RESPONSE" shuffle="false" maxChoices="1">
+{choices}
+    </choiceInteraction>
+  </itemBody>
+  <responseProcessing template="{QtiWriter.MATCH_CORRECT}"/>
+</assessmentItem>
+"""
+        return identifier, xml
+
+    def write(self, rendered):
+        if rendered is None:
+            self.skipped += 1
+            return
+        identifier, xml = rendered
+        href = f"items/{identifier}.xml"
+        self._zip.writestr(href, xml)
+        self._resources.write(
+            f'    <resource identifier="res-{identifier}" type="imsqti_item_xmlv2p1" href="{href}">\n'
+            f'      <file href="{href}"/>\n'
+            f'    </resource>\n'
+        )
+
+    def close(self):
+        with self._zip.open("imsmanifest.xml", "w") as manifest:
+            manifest.write(
+                b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<manifest xmlns="http://www.imsglobal.org/xsd/imscp_v1p1" identifier="usmlegpt-export">\n'
+                b'  <organizations/>\n'
+                b'  <resources>\n'
+            )
+            self._resources.seek(0)
+            for line in self._resources:
+                manifest.write(line.encode("utf-8"))
+            manifest.write(b'  </resources>\n</manifest>\n')
+        self._resources.close()
+        self._zip.close()
+
+class HtmlReportWriter:
+    """
+    One HTML report for the whole bank, split into pages of page_size items.
+    Pages link to their neighbours and an index of all pages closes the file;
+    a small script shows one page at a time (every page shows without it).
+    All model output is escaped.
+    """
+    def __init__(self, path, page_size=50, title="USMLE MCQ Item Bank"):
+        self.page_size = page_size
+        self.pages = 0
+        self._on_page = 0
+        self._file = open(path, "w", encoding="utf-8")
+        self._file.write(f"""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{html.escape(title)}</title>
+<style>{REPORT_STYLE}        .item {{ margin-bottom: 40px; border-bottom: 2px solid #2c5282; padding-bottom: 20px; }}
+        .tags {{ color: #4a5568; font-size: 0.9em; }}
+        .pager {{ margin: 20px 0; }}
+        .pager a {{ margin-right: 8px; }}
+</style>
+</head>
+<body>
+<div class="header">
+    <h1>{html.escape(title)}</h1>
+    <p>Generated on: {datetime.datetime.now():%Y-%m-%d %H:%M:%S}</p>
+</div>
+""")
+
+    @staticmethod
+    def render(position, item):
+        number = item["id"] if item.get("id") is not None else position + 1
+        tags = " · ".join(", ".join(item.get(kind) or []) for kind in ("disciplines", "systems", "competencies"))
+        if item.get("question"):
+            body = (f'<p class="content">{html.escape(item["question"])}</p>\n<ul>'
+                    + "".join(f"<li>{html.escape(option)}</li>" for option in item.get("options") or [])
+                    + f'</ul>\n<p><b>Correct Answer:</b> {html.escape(str(item.get("correct_answer") or ""))}</p>')
+        else:
+            body = '<p class="content"><i>The final version could not be parsed.</i></p>'
+        history = item.get("history")
+        details = ""
+        if history:
+            details = (f"<details><summary>Development history ({len(history)} stages)</summary>"
+                       f"{render_metrics_table(history)}{render_history_entries(history)}</details>")
+        return f"""<div class="item" id="item-{html.escape(str(number))}">
+<h2>Item {html.escape(str(number))}</h2>
+<p class="tags">{html.escape(tags)} · status: {html.escape(str(item.get("status")))} · decision: {html.escape(str(item.get("decision")))}</p>
+{body}
+{details}
+</div>
+"""
+
+    def _pager(self, page, has_next):
+        links = []
+        if page > 1:
+            links.append(f'<a href="#page-{page - 1}">&laquo; Previous</a>')
+        links.append(f"Page {page}")
+        if has_next:
+            links.append(f'<a href="#page-{page + 1}">Next &raquo;</a>')
+        links.append('<a href="#pages">All pages</a>')
+        return f'<div class="pager">{" ".join(links)}</div>\n'
+
+    def write(self, rendered):
+        if self.pages == 0 or self._on_page == self.page_size:
+            if self.pages:
+                self._file.write(self._pager(self.pages, True) + "</section>\n")
+            self.pages += 1
+            self._on_page = 0
+            self._file.write(f'<section class="page" id="page-{self.pages}">\n' + self._pager(self.pages, False))
+        self._file.write(rendered)
+        self._on_page += 1
+
+    def close(self):
+        if self.pages:
+            self._file.write(self._pager(self.pages, False) + "</section>\n")
+        self._file.write('<nav class="pager" id="pages">Pages: '
+                         + " ".join(f'<a href="#page-{page}">{page}</a>' for page in range(1, self.pages + 1))
+                         + "</nav>\n")
+        self._file.write("""<script>
+function showPage() {
+    var match = /^#page-(\\d+)$/.exec(location.hash);
+    var current = match ? match[1] : "1";
+    document.querySelectorAll("section.page").forEach(function (page) {
+        page.style.display = page.id === "page-" + current ? "" : "none";
+    });
+}
+window.addEventListener("hashchange", showPage);
+showPage();
+</script>
+</body>
+</html>
+""")
+        self._file.close()
+
+EXPORT_WRITERS = {
+    "jsonl": JsonlWriter,
+    "csv": CsvWriter,
+    "parquet": ParquetWriter,
+    "qti": QtiWriter,
+    "html": HtmlReportWriter
+}
+
+def render_chunk(formats, chunk):
+    """ Renders a chunk of (position, item) pairs for every format; runs in worker processes """
+    return [tuple(EXPORT_WRITERS[fmt].render(position, item) for fmt in formats) for position, item in chunk]
+
+def iter_rendered(items, formats, workers=1, chunk_size=64):
+    """
+    Yields the rendered formats of every item in order. With workers > 1,
+    chunks are rendered in a process pool with at most two chunks per worker
+    in flight, so memory does not grow with the number of items.
+    """
+    positions = enumerate(items)
+    chunks = iter(lambda: list(itertools.islice(positions, chunk_size)), [])
+    if workers <= 1:
+        for chunk in chunks:
+            yield from render_chunk(formats, chunk)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for chunk in chunks:
+            pending.append(executor.submit(render_chunk, formats, chunk))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def export_items(items, outputs, workers=1, chunk_size=64, with_history=True, page_size=50,
+                 title="USMLE MCQ Item Bank", row_group_size=1000):
+    """
+    Writes items (e.g. ItemStore.query(with_history=True) or iter_batch_items())
+    to every {format: path} in outputs in one streaming pass and returns the
+    counts. page_size and title apply to the HTML report, row_group_size to
+    Parquet.
+    """
+    unknown = set(outputs) - set(EXPORT_WRITERS)
+    if unknown:
+        raise ValueError(f"Unknown export formats: {', '.join(sorted(unknown))}")
+    formats = [fmt for fmt in EXPORT_WRITERS if outputs.get(fmt)]
+    if not with_history:
+        items = ({key: value for key, value in item.items() if key != "history"} for item in items)
+
+    options = {"html": {"page_size": page_size, "title": title}, "parquet": {"row_group_size": row_group_size}}
+    writers = []
+    counts = {"items": 0}
+    try:
+        for fmt in formats:
+            writers.append(EXPORT_WRITERS[fmt](outputs[fmt], **options.get(fmt, {})))
+        for rendered in iter_rendered(items, formats, workers, chunk_size):
+            for writer, output in zip(writers, rendered):
+                writer.write(output)
+            counts["items"] += 1
+    finally:
+        for writer in writers:
+            writer.close()
+
+    for writer in writers:
+        if isinstance(writer, QtiWriter):
+            counts["qti_skipped"] = writer.skipped
+        elif isinstance(writer, HtmlReportWriter):
+            counts["html_pages"] = writer.pages
+    return counts
@@ -0,0 +1,256 @@
+"""
+Durable job queue for generation campaigns spread over processes and hosts.
+Jobs live in a SQLite file (no outside service; hosts share it over a file
+system with working locks). Workers lease a job, renew the lease with
+heartbeats while its pipeline runs and write the finished history back. A job
+whose worker died is leased again once the lease expires and, with
+checkpoints, resumes from its first missing stage.
+"""
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from .core import CostBudget, develop_cell_item, models_config_to_records
+
+class JobQueue:
+    """
+    SQLite job queue. A job is one item to develop: its disciplines, systems,
+    competencies, keywords and optional writer/reviewer/editor/prescreen
+    model assignments (a blueprint cell with count 1).
+
+    lease() hands a queued job, or one whose lease expired, to exactly one
+    worker with a fresh lease token; heartbeat(), complete() and release()
+    only act while that token still owns the job, so a worker that lost its
+    lease cannot overwrite the result of the worker that took over. Failed
+    attempts are retried with exponential backoff up to max_attempts.
+    """
+    FINISHED = ("done", "rejected", "duplicate", "failed", "over_budget")
+
+    def __init__(self, path="mcq_jobs.sqlite3", lease_seconds=120, max_attempts=3, retry_delay=5.0):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._local = threading.local()
+        self._connect().executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id INTEGER PRIMARY KEY, created_at REAL, updated_at REAL, status TEXT, params TEXT, "
+            "attempts INTEGER DEFAULT 0, available_at REAL, worker TEXT, lease_token TEXT, lease_expires REAL, "
+            "history TEXT, error TEXT, store_id INTEGER);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_lease ON jobs(status, available_at, id);"
+            "CREATE INDEX IF NOT EXISTS idx_jobs_expired ON jobs(status, lease_expires);"
+        )
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, cells):
+        """ Adds one job per item of the blueprint cells (a cell's count is expanded) and returns their ids """
+        now = time.time()
+        rows = [
+            (now, now, "queued", json.dumps({key: value for key, value in cell.items() if key != "count"},
+                                            ensure_ascii=False), now)
+            for cell in cells
+            for _ in range(int(cell.get("count", 1)))
+        ]
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM jobs").fetchone()[0]
+            conn.executemany("INSERT INTO jobs (created_at, updated_at, status, params, available_at) "
+                             "VALUES (?, ?, ?, ?, ?)", rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return list(range(first, first + len(rows)))
+
+    def lease(self, worker):
+        """
+        Leases the oldest available job to worker and returns
+        {"id", "params", "attempts", "token"}, or None when nothing is available.
+        """
+        now = time.time()
+        token = uuid.uuid4().hex
+        conn = self._connect()
+        # Expired leases that used their last attempt will not be retried
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = COALESCE(error, 'lease expired'), updated_at = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts >= ?", (now, now, self.max_attempts))
+        # A single UPDATE ... RETURNING is atomic, so concurrent workers never get the same job
+        row = conn.execute(
+            "UPDATE jobs SET status = 'leased', worker = ?, lease_token = ?, lease_expires = ?, "
+            "attempts = attempts + 1, updated_at = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE (status = 'queued' AND available_at <= ?) "
+            "OR (status = 'leased' AND lease_expires < ? AND attempts < ?) ORDER BY id LIMIT 1) "
+            "RETURNING id, params, attempts",
+            (worker, token, now + self.lease_seconds, now, now, now, self.max_attempts)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "params": json.loads(row[1]), "attempts": row[2], "token": token}
+
+    def heartbeat(self, job_id, token):
+        """ Extends the lease; False means the job was lost to another worker """
+        now = time.time()
+        updated = self._connect().execute(
+            "UPDATE jobs SET lease_expires = ?, updated_at = ? WHERE id = ? AND lease_token = ? AND status = 'leased'",
+            (now + self.lease_seconds, now, job_id, token)).rowcount
+        return updated == 1
+
+    def complete(self, job_id, token, status, history, error=None, store_id=None):
+        """ Writes a finished pipeline back (status done, rejected, duplicate or over_budget); False if the lease was lost """
+        updated = self._connect().execute(
+            "UPDATE jobs SET status = ?, history = ?, error = ?, store_id = ?, lease_token = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+            (status, json.dumps(history, ensure_ascii=False) if history is not None else None, error, store_id,
+             time.time(), job_id, token)).rowcount
+        return updated == 1
+
+    def release(self, job_id, token, error):
+        """ Gives a failed attempt back: requeued after a backoff, or failed once attempts run out """
+        now = time.time()
+        updated = self._connect().execute(
+            "UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END, "
+            "available_at = ? + ? * (1 << (attempts - 1)), error = ?, lease_token = NULL, updated_at = ? "
+            "WHERE id = ? AND lease_token = ? AND status = 'leased'",
+            (self.max_attempts, now, self.retry_delay, error, now, job_id, token)).rowcount
+        return updated == 1
+
+    def counts(self):
+        """ {status: number of jobs} """
+        return dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def pending(self):
+        """ Jobs that are queued or leased """
+        return self._connect().execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'leased')").fetchone()[0]
+
+    def results(self, status=None):
+        """ Yields finished jobs as {"id", "status", "params", "history", "error", "store_id"}, oldest first """
+        sql = "SELECT id, status, params, history, error, store_id FROM jobs WHERE status IN ('done', 'rejected', 'duplicate', 'over_budget', 'failed')"
+        params = []
+        if status:
+            sql += " AND status = ?"
+            params.append(status)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            for job_id, job_status, job_params, history, error, store_id in conn.execute(sql + " ORDER BY id", params):
+                yield {"id": job_id, "status": job_status, "params": json.loads(job_params),
+                       "history": json.loads(history) if history else None, "error": error, "store_id": store_id}
+        finally:
+            conn.close()
+
+def run_worker(job_queue, models_config, worker_id=None, concurrency=1, per_model_concurrency=2, poll_interval=1.0,
+               exit_when_idle=False, stop_event=None, progress_callback=None, response_cache=None, item_store=None,
+               checkpoint_store=None, max_item_cost=None, max_cost=None, **pipeline_options):
+    """
+    Leases and runs jobs until stop_event is set (or, with exit_when_idle, no
+    job is queued or leased any more), running up to concurrency pipelines at
+    once. Each running job is heartbeated every third of the lease; a job
+    whose lease is lost is cancelled. Each job may cost at most max_item_cost
+    USD; a job reaching it is finished as "over_budget", not retried. Once
+    the worker has spent max_cost it leases no more jobs (those cut short go
+    back to the queue). Returns the counts of finished jobs and the worker's
+    cost_usd.
+    """
+    models_config = models_config_to_records(models_config)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    stop_event = stop_event or threading.Event()
+    worker_budget = CostBudget(max_cost)
+    model_semaphores = {
+        config['model_name']: threading.BoundedSemaphore(per_model_concurrency)
+        for config in models_config if config.get('model_name')
+    }
+    counts = {"done": 0, "rejected": 0, "duplicate": 0, "over_budget": 0, "error": 0, "lost": 0}
+    lock = threading.Lock()
+
+    def run_job(job):
+        cancel_event = threading.Event()
+        finished = threading.Event()
+
+        def keep_leased():
+            while not finished.wait(job_queue.lease_seconds / 3):
+                if not job_queue.heartbeat(job["id"], job["token"]):
+                    print(f"Job {job['id']}: lease lost, cancelling")
+                    cancel_event.set()
+                    return
+
+        heartbeat = threading.Thread(target=keep_leased, daemon=True)
+        heartbeat.start()
+        try:
+            result = develop_cell_item(
+                models_config, job["params"], f"job-{job['id']}" if checkpoint_store else None, model_semaphores,
+                response_cache, item_store, checkpoint_store, cancel_event=cancel_event,
+                duplicate_key=("job", job["id"]), cost_budget=worker_budget, max_item_cost=max_item_cost,
+                **pipeline_options
+            )
+        finally:
+            finished.set()
+            heartbeat.join()
+
+        # A job over its own ceiling would only spend it again from scratch; one cut short by the worker's goes back,
+        # and so does one cancelled because its lease was lost (releasing it is then a no-op)
+        if result["status"] in ("error", "cancelled") or (result["status"] == "over_budget" and result["ceiling"] != "item"):
+            print(f"Job {job['id']} attempt {job['attempts']} failed: {result['error']}")
+            kept = job_queue.release(job["id"], job["token"], result["error"])
+            result["status"] = "error"
+        else:
+            status = "done" if result["status"] == "ok" else result["status"]
+            kept = job_queue.complete(job["id"], job["token"], status, result.get("history"),
+                                      result.get("error"), result.get("store_id"))
+        outcome = result["status"] if kept else "lost"
+        outcome = "done" if outcome == "ok" else outcome
+        with lock:
+            counts[outcome] += 1
+        if progress_callback:
+            progress_callback(worker_id, job, outcome)
+
+    def work():
+        while not stop_event.is_set():
+            if worker_budget.exhausted:
+                print(f"Worker {worker_id} reached its cost ceiling of ${max_cost}")
+                return
+            job = job_queue.lease(worker_id)
+            if job is None:
+                if exit_when_idle and job_queue.pending() == 0:
+                    return
+                stop_event.wait(poll_interval)
+                continue
+            run_job(job)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(work) for _ in range(concurrency)]:
+            future.result()
+    counts["cost_usd"] = worker_budget.spent
+    return counts
+
+def run_worker_processes(processes, target, *args):
+    """
+    Starts target(*args) in that many spawned processes (fresh interpreters,
+    so no SQLite connection or lock is inherited) and waits for them.
+    Returns the exit codes.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=target, args=args, name=f"usmlegpt-worker-{index}") for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+        raise
+    return [worker.exitcode for worker in workers]
@@ -0,0 +1,284 @@
+"""
+Gradio web app for the MCQ pipeline. Importing this module loads Gradio;
+scripts and workers that only run the pipeline should use usmlegpt.core.
+"""
+import asyncio
+import datetime
+import os
+import gradio as gr
+
+from .core import (
+    ClientPool,
+    client_pool,
+    competency_options,
+    default_checkpoint_store,
+    discipline_options,
+    generate_html_report,
+    model_router,
+    models_config_to_records,
+    process_mcq,
+    resume_mcq,
+    save_json_summary,
+    save_json_to_file,
+    system_options
+)
+
+def list_resumable_runs():
+    """ Dropdown choices for the runs that can be resumed, newest first """
+    if not default_checkpoint_store:
+        return gr.Dropdown.update(choices=[])
+    choices = [
+        f"{run_id} ({status}, {datetime.datetime.fromtimestamp(updated_at):%Y-%m-%d %H:%M}) "
+        f"{', '.join((params.get('disciplines') or []) + (params.get('systems') or []))}"
+        for run_id, status, updated_at, params in default_checkpoint_store.resumable_runs()
+    ]
+    return gr.Dropdown.update(choices=choices, value=choices[0] if choices else None)
+
+def update_model_choices(df):
+    try:
+        if df is None or len(df) == 0:
+            return [], [], [], [], []
+
+        # Forget pooled clients for rows that were removed or edited
+        client_pool.retain(models_config_to_records(df))
+
+        models = [row['model_name'] for row in df.to_dict(orient='records') if row['model_name']]
+        return (
+            gr.Dropdown.update(choices=models),
+            gr.Dropdown.update(choices=models),
+            gr.Dropdown.update(choices=models),
+            gr.Dropdown.update(choices=models),
+            gr.Dropdown.update(choices=models)
+        )
+    except Exception as e:
+        print(f"Error in update_model_choices: {str(e)}")
+        return [], [], [], [], []
+
+def shuffle_models(df):
+    try:
+        if df is None or len(df) == 0:
+            return None, None, None, None
+
+        rows = [row for row in df.to_dict(orient='records') if row['model_name']]
+        if not rows:
+            return None, None, None, None
+
+        # Route through the shared router so slow or failing endpoints are picked less often
+        key = lambda row: ClientPool.make_key(None, row.get('base_url'))[1:] + (row['model_name'],)
+        return tuple(model_router.choose(rows, key)['model_name'] for _ in range(4))
+    except Exception as e:
+        print(f"Error in shuffle_models: {str(e)}")
+        return None, None, None, None
+
+async def process_json_summary(history, config, model):
+    # The summarizer call blocks on network I/O, so keep it off the event loop
+    loop = asyncio.get_running_loop()
+    json_result = await loop.run_in_executor(None, save_json_summary, history, config, model)
+    return (
+        json_result,  # JSON result
+        "JSON generation completed, ready for download" if json_result else "Generation failed, please try again",  # Status message
+        gr.Button.update(visible=True, interactive=True),  # Download button state
+        gr.Button.update(interactive=True)  # Generate button state
+    )
+
+def create_interface():
+    with gr.Blocks() as app:
+        gr.Markdown("# USMLE MCQ Development System")
+
+        # Administrator Mode Textbox
+        admin_mode = gr.Textbox(
+            label="Administrator Mode",
+            placeholder="Enter password to enable administrator mode",
+            lines=1,
+            visible=True
+        )
+
+        # Function to handle administrator mode
+        def handle_admin_mode(password):
+            if password == "password":  #example
+                return [
+                    ["sk-abc123def456ghi789", "https://api.openai.com/v1", "model-alpha", "", ""],
+                    ["sk-abc123def456ghi789", "https://api.openai.com/v1", "model-beta", "", ""],
+                    ["sk-abc123def456ghi789", "https://api.openai.com/v1", "model-gamma", "", ""],
+                    ["sk-abc123def456ghi789", "https://api.openai.com/v1", "model-delta", "", ""]
+                ]
+            else:
+                return [["", "", "", "", ""]]
+
+        # AI Models Configuration
+        with gr.Row():
+            with gr.Column():
+                gr.Markdown("### Openai API modules are available")
+                models_config = gr.Dataframe(
+                    headers=["api_key", "base_url", "model_name", "rpm", "tpm"],
+                    datatype=["str", "str", "str", "str", "str"],
+                    label="AI Models Configuration (rpm/tpm: optional requests/tokens per minute limits)",
+                    value=[["", "", "", "", ""]]
+                )
+
+        # Update models_config when admin_mode changes
+        admin_mode.change(
+            fn=handle_admin_mode,
+            inputs=[admin_mode],
+            outputs=[models_config],
+            queue=False
+        )
+
+        with gr.Row():
+            with gr.Column():
+                writer_model = gr.Dropdown(
+                    label="Specific Model for Writer",
+                    choices=[],
+                    value=None,
+                    allow_custom_value=True
+                )
+                reviewer_models = gr.Dropdown(
+                    label="Specific Models for Reviewers",
+                    choices=[],
+                    multiselect=True,
+                    value=None,
+                    allow_custom_value=True
+                )
+                editor_model = gr.Dropdown(
+                    label="Specific Model for Editor",
+                    choices=[],
+                    value=None,
+                    allow_custom_value=True
+                )
+                summarizer_model = gr.Dropdown(
+                    label="Specific Model for Version Summarizer",
+                    choices=[],
+                    value=None,
+                    allow_custom_value=True
+                )
+                prescreen_model = gr.Dropdown(
+                    label="Optional Cheap Model for Draft Pre-screen",
+                    choices=[],
+                    value=None,
+                    allow_custom_value=True
+                )
+                revision_rounds = gr.Slider(
+                    label="Extra Revision Rounds When the Editor Requests Revisions",
+                    minimum=0,
+                    maximum=3,
+                    step=1,
+                    value=0
+                )
+
+        with gr.Row():
+            disciplines = gr.Dropdown(
+                label="Disciplines",
+                choices=discipline_options,
+                multiselect=True
+            )
+            systems = gr.Dropdown(
+                label="Systems",
+                choices=system_options,
+                multiselect=True
+            )
+            competencies = gr.Dropdown(
+                label="Competencies",
+                choices=competency_options,
+                multiselect=True
+            )
+            keywords = gr.Textbox(label="Keywords")
+
+        with gr.Row():
+            submit_btn = gr.Button("Start MCQ Development Process")
+            shuffle_btn = gr.Button("Shuffle Models")
+
+        # Checkpointed runs (USMLEGPT_CHECKPOINTS) that failed, were cancelled or were interrupted
+        with gr.Row(visible=default_checkpoint_store is not None):
+            resumable_runs = gr.Dropdown(label="Unfinished Runs", choices=[], value=None)
+            refresh_runs_btn = gr.Button("Refresh Unfinished Runs", size="sm")
+            resume_btn = gr.Button("Resume Run", size="sm")
+
+        output = gr.JSON(label="Development Process History")
+        json_summary_result = gr.Textbox(label="JSON Summary Result", visible=False)
+        download_btn = gr.Button("Download Development History as HTML")
+        
+        with gr.Row():
+            json_summary_btn = gr.Button("Generate JSON Summary", size="sm")
+            download_json_btn = gr.Button("Download JSON Summary", size="sm", visible=False)
+            status_text = gr.Text(label="Status", value="", visible=True)  # Add status text
+
+        # Event handlers. Quick UI updates bypass the queue so they never wait behind MCQ runs.
+        models_config.change(
+            fn=update_model_choices,
+            inputs=[models_config],
+            outputs=[writer_model, reviewer_models, editor_model, summarizer_model, prescreen_model],
+            queue=False
+        )
+
+        shuffle_btn.click(
+            fn=shuffle_models,
+            inputs=[models_config],
+            outputs=[writer_model, reviewer_models, editor_model, summarizer_model],
+            queue=False
+        )
+
+        submit_btn.click(
+            fn=process_mcq,
+            inputs=[
+                models_config,
+                disciplines,
+                systems,
+                competencies,
+                keywords,
+                writer_model,
+                reviewer_models,
+                editor_model,
+                summarizer_model,
+                prescreen_model,
+                revision_rounds
+            ],
+            outputs=[output]
+        )
+
+        refresh_runs_btn.click(
+            fn=list_resumable_runs,
+            outputs=[resumable_runs],
+            queue=False
+        )
+
+        resume_btn.click(
+            fn=resume_mcq,
+            inputs=[models_config, resumable_runs],
+            outputs=[output]
+        )
+
+        download_btn.click(
+            fn=generate_html_report,
+            inputs=[output],
+            outputs=[gr.File(label="Download HTML Report")]
+        )
+
+        # Display JSON summary in the UI
+        json_summary_btn.click(
+            fn=lambda: (None, "Generating JSON...", gr.Button.update(visible=False), gr.Button.update(interactive=False)),
+            outputs=[json_summary_result, status_text, download_json_btn, json_summary_btn],
+            queue=False
+        ).then(
+            fn=process_json_summary,
+            inputs=[output, models_config, summarizer_model],
+            outputs=[json_summary_result, status_text, download_json_btn, json_summary_btn]
+        )
+
+        # Download JSON summary as a file
+        download_json_btn.click(
+            fn=lambda json_content: save_json_to_file(json_content),
+            inputs=[json_summary_result],
+            outputs=[gr.File(label="Download JSON File")]
+        )
+
+    return app
+
+def serve(concurrency_limit=16, max_queue_size=100):
+    """ Launches the web app on port 1210 """
+    # Terminate the process occupying port 1210 before starting
+    os.system("kill -9 $(lsof -t -i:1210)")
+    app = create_interface()
+    # The queue is required for streaming handlers; concurrency_count sessions run at
+    # once and the rest wait in line with their queue position shown in the UI
+    app.queue(concurrency_count=concurrency_limit, max_size=max_queue_size)
+    app.launch(server_name="0.0.0.0", server_port=1210, show_error=True)